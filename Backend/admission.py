@@ -0,0 +1,205 @@
+import os
+import math
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from fastapi import HTTPException, Request, status
+
+
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+
+
+def group_setting(group, name, default):
+    return float(os.getenv(f"ADMISSION_{group.upper()}_{name}", str(default)))
+
+
+class TokenBuckets:
+    """Per-key token buckets, LRU-bounded to ADMISSION_MAX_KEYS keys."""
+
+    def __init__(self, rate, burst, max_keys=ADMISSION_MAX_KEYS):
+        self.rate, self.burst, self.max_keys = rate, burst, max_keys
+        self.buckets = OrderedDict()
+
+    def take(self, key):
+        """Spend a token; returns 0 on success, otherwise seconds until one is available."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionGroup:
+    """Admission control for one group of expensive endpoints.
+
+    Each caller first spends a token from its own bucket (rate per second,
+    up to burst), or gets a 429. Then it takes one of `concurrency` slots.
+    When none is free it waits in a FIFO of at most `queue` callers for up
+    to `wait_ms`, and a full queue or an expired wait gets a 503 right away.
+    Both carry Retry-After. Ordinary reads have no group, so under overload
+    they keep the Mongo connections the groups are not allowed to take.
+    """
+
+    def __init__(self, name, concurrency, queue, wait_ms, rate, burst):
+        self.name = name
+        self.concurrency = int(concurrency)
+        self.queue_limit = int(queue)
+        self.wait = wait_ms / 1000
+        self.buckets = TokenBuckets(rate, burst)
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.timed_out = 0
+
+    @classmethod
+    def from_env(cls, name, concurrency, queue, wait_ms, rate, burst):
+        return cls(
+            name,
+            group_setting(name, "CONCURRENCY", concurrency),
+            group_setting(name, "QUEUE", queue),
+            group_setting(name, "WAIT_MS", wait_ms),
+            group_setting(name, "RATE", rate),
+            group_setting(name, "BURST", burst),
+        )
+
+    def reject(self, status_code, detail, retry_after):
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    async def acquire(self, key):
+        wait = self.buckets.take(key)
+        if wait:
+            self.rate_limited += 1
+            raise self.reject(status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests", wait)
+        if self.in_flight < self.concurrency and not self.waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self.waiters) >= self.queue_limit:
+            self.queue_full += 1
+            raise self.reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Server busy, please retry", self.wait)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.queued += 1
+        try:
+            # release() hands the slot over by resolving the future, so in_flight is already counted
+            await asyncio.wait_for(asyncio.shield(waiter), self.wait)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot arrived just as the wait expired; take it
+                self.admitted += 1
+                return
+            self.waiters.remove(waiter)
+            self.timed_out += 1
+            raise self.reject(status.HTTP_503_SERVICE_UNAVAILABLE, "Server busy, please retry", self.wait)
+        except asyncio.CancelledError:
+            # Client went away; pass on a slot that was already handed over
+            if waiter.done():
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self):
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "queue_limit": self.queue_limit,
+            "wait_ms": int(self.wait * 1000),
+            "rate": self.buckets.rate,
+            "burst": self.buckets.burst,
+            "tracked_keys": len(self.buckets.buckets),
+            "admitted": self.admitted,
+            "queued_total": self.queued,
+            "rate_limited": self.rate_limited,
+            "queue_full": self.queue_full,
+            "timed_out": self.timed_out,
+        }
+
+
+# Defaults keep the write groups' combined concurrency well under
+# MONGO_MAX_POOL_SIZE (100), leaving connections free for reads
+GROUPS = {
+    "auth": AdmissionGroup.from_env("auth", concurrency=16, queue=128, wait_ms=1000, rate=2, burst=10),
+    "purchase": AdmissionGroup.from_env("purchase", concurrency=32, queue=256, wait_ms=2000, rate=5, burst=10),
+    "grid_write": AdmissionGroup.from_env("grid_write", concurrency=16, queue=128, wait_ms=2000, rate=10, burst=20),
+    # Exports hold a cursor (and a connection) for as long as the download runs
+    "export": AdmissionGroup.from_env("export", concurrency=4, queue=8, wait_ms=5000, rate=0.1, burst=3),
+}
+
+
+def client_key(request: Request):
+    """Who a bucket belongs to, known before any database work: the bearer token, else the client address."""
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+    return request.client.host if request.client else "unknown"
+
+
+def admit(group_name):
+    """Dependency holding a slot of group_name for the duration of the endpoint.
+
+    Put it in the route's dependencies=[...] so it runs before
+    get_current_principal and an overloaded server sheds requests without
+    authenticating them.
+    """
+    group = GROUPS[group_name]
+
+    async def dependency(request: Request):
+        await group.acquire(client_key(request))
+        try:
+            yield
+        finally:
+            group.release()
+
+    return dependency
+
+
+async def admit_stream(group_name, request: Request):
+    """admit() for streaming responses, whose body is sent after dependencies exit.
+
+    Acquires a slot and returns a release function that is safe to call
+    twice: call it when the body finishes, and again from the response's
+    background task, which still runs when the client disconnects.
+    """
+    group = GROUPS[group_name]
+    await group.acquire(client_key(request))
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            group.release()
+
+    return release
+
+
+def admission_stats():
+    return {name: group.stats() for name, group in GROUPS.items()}
@@ -0,0 +1,332 @@
+"""Hot/cold split of the transactions collection.
+
+    python archive.py --after-days 180
+
+Transactions older than ARCHIVE_AFTER_DAYS are moved, one IST month at a
+time, into transactions_YYYY_MM collections, and each archived month
+leaves a (user, period) row with its count, bought and sold units in
+transaction_periods. The archive_state document records the archived
+periods and the watermark, the start of the oldest month still in
+transactions. Readers bound the hot set to time >= watermark, add the
+period rows for lifetime totals, and read an archive collection only when
+the requested page or range reaches below the watermark.
+
+Run it from a single process: either the app (ARCHIVE_AFTER_DAYS > 0,
+one worker) or this script from cron.
+"""
+import os
+import time
+import asyncio
+import argparse
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import BulkWriteError
+from database import db
+from background import BackgroundLoop
+from history import IST, totals_pipeline, page_pipeline
+
+
+# 0 leaves every transaction in the hot set
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "5000"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# How long a worker may serve reads with an old watermark; archived rows
+# stay in transactions for twice this long after the watermark moves
+ARCHIVE_STATE_TTL = float(os.getenv("ARCHIVE_STATE_TTL", "30"))
+ARCHIVE_PREFIX = "transactions_"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Transaction_Collection = db["transactions"]
+Period_Collection = db["transaction_periods"]
+State_Collection = db["archive_state"]
+
+
+def utc(dt):
+    # Mongo hands datetimes back naive, in UTC
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def period_of(dt):
+    local = utc(dt).astimezone(IST)
+    return f"{local.year:04d}_{local.month:02d}"
+
+
+def period_start(period):
+    year, month = map(int, period.split("_"))
+    return IST.localize(datetime(year, month, 1))
+
+
+def next_period(period):
+    year, month = map(int, period.split("_"))
+    return f"{year + month // 12:04d}_{month % 12 + 1:02d}"
+
+
+def archive_collection(period):
+    return db[ARCHIVE_PREFIX + period]
+
+
+def period_totals_pipeline(period):
+    """Per-user count, bought and sold units of one archive collection, merged into transaction_periods.
+
+    Same rules as totals_pipeline: sold units belong to the grid owner, and
+    a purchase from an own grid counts as bought only.
+    """
+    units = {"$ifNull": ["$units", 0]}
+    return [
+        {"$lookup": {
+            "from": "user_grid",
+            "localField": "grid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"_id": 0, "user": 1}}],
+            "as": "grid_doc",
+        }},
+        {"$set": {"seller": {"$ifNull": [{"$first": "$grid_doc.user"}, "$buyer"]}}},
+        {"$project": {"sides": [
+            {"user": "$buyer", "bought": units, "sold": 0},
+            {"$cond": [{"$ne": ["$seller", "$buyer"]}, {"user": "$seller", "bought": 0, "sold": units}, None]},
+        ]}},
+        {"$unwind": "$sides"},
+        {"$match": {"sides": {"$ne": None}}},
+        {"$group": {
+            "_id": "$sides.user",
+            "count": {"$sum": 1},
+            "bought": {"$sum": "$sides.bought"},
+            "sold": {"$sum": "$sides.sold"},
+        }},
+        {"$project": {"_id": 0, "user": "$_id", "period": {"$literal": period}, "count": 1, "bought": 1, "sold": 1}},
+        {"$merge": {
+            "into": "transaction_periods",
+            "on": ["user", "period"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+def archived_totals_pipeline(user_id, before_period):
+    """A user's count, bought and sold units over the archived periods before before_period."""
+    return [
+        {"$match": {"user": user_id, "period": {"$lt": before_period}}},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": "$count"},
+            "bought": {"$sum": "$bought"},
+            "sold": {"$sum": "$sold"},
+        }},
+    ]
+
+
+class TransactionArchiver(BackgroundLoop):
+    """Moves transactions of months older than after_days into their archive collections.
+
+    A month is archived in three idempotent steps, so a run that dies
+    half way is finished by the next one:
+    1. Copy its transactions into transactions_YYYY_MM in insert_many
+       batches of ARCHIVE_BATCH_SIZE, skipping ones already copied.
+    2. Rebuild its transaction_periods rows from the archive collection.
+    3. Move the watermark past it in archive_state.
+    Only then, once every worker has seen the new watermark, are the
+    copies deleted from transactions, again in batches.
+    """
+
+    max_backoff = 300
+
+    def __init__(self, after_days=ARCHIVE_AFTER_DAYS):
+        super().__init__()
+        self.after_days = after_days
+        self.cached = None
+        self.copied = 0
+        self.deleted = 0
+        self.periods = 0
+        self.busy = 0.0
+        self.last_run = None
+
+    @property
+    def configured(self):
+        return self.after_days > 0
+
+    async def state(self, fresh=False):
+        """archive_state, cached for ARCHIVE_STATE_TTL seconds."""
+        now = time.monotonic()
+        if fresh or self.cached is None or self.cached[0] <= now:
+            doc = await State_Collection.find_one({"_id": "transactions"}) or {}
+            state = {
+                "periods": sorted(doc.get("periods", [])),
+                "watermark": utc(doc["watermark"]) if doc.get("watermark") else None,
+                "advanced_at": utc(doc["advanced_at"]) if doc.get("advanced_at") else None,
+            }
+            self.cached = (now + ARCHIVE_STATE_TTL, state)
+        return self.cached[1]
+
+    async def insert(self, target, batch):
+        try:
+            await target.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Copied by an earlier run that didn't get to delete them
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+        return len(batch)
+
+    async def copy_period(self, period):
+        start, end = period_start(period), period_start(next_period(period))
+        target = archive_collection(period)
+        # indexes imports meter_readings, which imports this module through summaries
+        from indexes import INDEXES
+        await target.create_indexes(INDEXES["transactions"])
+        batch, copied = [], 0
+        cursor = Transaction_Collection.find({"time": {"$gte": start, "$lt": end}}).batch_size(ARCHIVE_BATCH_SIZE)
+        async for tx in cursor:
+            batch.append(tx)
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                copied += await self.insert(target, batch)
+                batch = []
+        if batch:
+            copied += await self.insert(target, batch)
+        await target.aggregate(period_totals_pipeline(period), allowDiskUse=True).to_list(length=None)
+        await State_Collection.update_one(
+            {"_id": "transactions"},
+            {
+                "$addToSet": {"periods": period},
+                "$max": {"watermark": end},
+                "$set": {"advanced_at": datetime.now(timezone.utc)},
+            },
+            upsert=True,
+        )
+        return copied
+
+    async def delete_archived(self, state):
+        """Delete the hot copies of archived transactions, after the watermark has had time to reach every worker."""
+        if state["watermark"] is None:
+            return 0
+        wait = 2 * ARCHIVE_STATE_TTL - (datetime.now(timezone.utc) - state["advanced_at"]).total_seconds()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        deleted = 0
+        while True:
+            batch = await Transaction_Collection.find(
+                {"time": {"$lt": state["watermark"]}}, {"_id": 1}
+            ).limit(ARCHIVE_BATCH_SIZE).to_list(length=ARCHIVE_BATCH_SIZE)
+            if not batch:
+                break
+            result = await Transaction_Collection.delete_many({"_id": {"$in": [tx["_id"] for tx in batch]}})
+            deleted += result.deleted_count
+        self.deleted += deleted
+        return deleted
+
+    async def step(self):
+        """Archive every month older than after_days; returns the number of transactions copied."""
+        started = time.perf_counter()
+        cutoff = period_of(datetime.now(timezone.utc) - timedelta(days=self.after_days))
+        state = await self.state(fresh=True)
+        copied = 0
+        while True:
+            oldest = await Transaction_Collection.find_one(
+                {"time": {"$gte": state["watermark"] or EPOCH}}, {"time": 1}, sort=[("time", 1)])
+            if not oldest or period_of(oldest["time"]) >= cutoff:
+                break
+            period = period_of(oldest["time"])
+            count = await self.copy_period(period)
+            print(f"Archived {count} transactions of {period}")
+            copied += count
+            self.copied += count
+            self.periods += 1
+            state = await self.state(fresh=True)
+        await self.delete_archived(state)
+        self.cached = None
+        self.busy += time.perf_counter() - started
+        self.last_run = datetime.now(timezone.utc)
+        return copied
+
+    async def run_once(self):
+        await self.step()
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+    def stats(self):
+        state = self.cached[1] if self.cached else {}
+        return {
+            "running": self.task is not None,
+            "after_days": self.after_days,
+            "watermark": state.get("watermark"),
+            "archived_periods": len(state.get("periods", [])),
+            "copied": self.copied,
+            "deleted": self.deleted,
+            "periods": self.periods,
+            "last_run": self.last_run,
+            "copied_per_second": self.copied / self.busy if self.busy else 0.0,
+        }
+
+
+archiver = TransactionArchiver()
+
+
+async def history_totals(user_id, grid_ids):
+    """Lifetime count, bought and sold units: the hot set plus the period rows of archived months."""
+    watermark = (await archiver.state())["watermark"]
+    parts = [Transaction_Collection.aggregate(totals_pipeline(user_id, grid_ids, watermark)).to_list(length=1)]
+    if watermark is not None:
+        parts.append(Period_Collection.aggregate(
+            archived_totals_pipeline(user_id, period_of(watermark))).to_list(length=1))
+    totals = {"count": 0, "bought": 0, "sold": 0}
+    for part in await asyncio.gather(*parts):
+        for key in totals:
+            totals[key] += part[0][key] if part else 0
+    return totals
+
+
+async def history_page(user_id, grid_ids, limit=None, before_key=None, start=None):
+    """Transactions newest first, like page_pipeline over the hot set and the archives.
+
+    Archives are read only when the range reaches below the watermark:
+    a page that the hot set can't fill, a cursor older than the watermark,
+    or a start before it. Without a limit or a start only the hot set is
+    returned.
+    """
+    state = await archiver.state()
+    watermark = state["watermark"]
+    since = max(watermark, start) if watermark and start else watermark or start
+    rows = []
+    if before_key is None or watermark is None or before_key[0] >= watermark:
+        rows = await Transaction_Collection.aggregate(
+            page_pipeline(user_id, grid_ids, limit, before_key, since)).to_list(length=None)
+    if watermark is None or (start is not None and start >= watermark) or (limit is None and start is None):
+        return rows
+    for period in reversed(state["periods"]):
+        if limit is not None and len(rows) >= limit:
+            break
+        if start is not None and period_start(next_period(period)) <= start:
+            break
+        if before_key is not None and period_start(period) > before_key[0]:
+            continue
+        remaining = None if limit is None else limit - len(rows)
+        rows += await archive_collection(period).aggregate(
+            page_pipeline(user_id, grid_ids, remaining, before_key, start)).to_list(length=None)
+    return rows
+
+
+async def sources(start=None, end=None, fresh=False):
+    """(collection, since) pairs covering [start, end), oldest first.
+
+    since is the watermark for the hot set, so rows archived but not yet
+    deleted are read from their archive only.
+    """
+    state = await archiver.state(fresh)
+    result = []
+    for period in state["periods"]:
+        if end is not None and period_start(period) >= end:
+            break
+        if start is not None and period_start(next_period(period)) <= start:
+            continue
+        result.append((archive_collection(period), None))
+    if end is None or state["watermark"] is None or end > state["watermark"]:
+        result.append((Transaction_Collection, state["watermark"]))
+    return result
+
+
+async def archive_names():
+    return [ARCHIVE_PREFIX + period for period in (await archiver.state(fresh=True))["periods"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--after-days", type=int, default=ARCHIVE_AFTER_DAYS or 180)
+    args = parser.parse_args()
+    print(f"Copied {asyncio.run(TransactionArchiver(args.after_days).step())} transactions")
@@ -0,0 +1,122 @@
+"""Fail if any router query is planned as a collection scan.
+
+    python audit_query_plans.py
+
+Runs explain() for the query shape of every indexed router query against
+the database in MONGO_URI (after ensure_indexes) and exits with status 1
+when a winning plan contains COLLSCAN. Run it in CI next to a seeded
+database whenever a query or index changes.
+"""
+import asyncio
+import sys
+from datetime import datetime, timezone
+from bson import ObjectId
+from database import db
+from indexes import ensure_indexes
+from sell_pool import SELL_POOL_PIPELINE, nearby_pipeline
+from history import history_match, totals_pipeline, page_pipeline
+from export import export_query
+from archive import archived_totals_pipeline, period_of
+from order_book import OPEN_ORDER_SORT, open_orders
+from chain_indexer import candidates_pipeline
+from routers.Energypool import BULK_CANDIDATE_LIMIT, candidates_query, nearest_candidates_pipeline
+
+USER_ID = ObjectId()
+GRID_ID = ObjectId()
+NOW = datetime.now(timezone.utc)
+
+
+def aggregate(collection, pipeline):
+    return {"aggregate": collection, "cursor": {}, "pipeline": pipeline}
+
+
+def find(collection, filter, sort=None, limit=None):
+    command = {"find": collection, "filter": filter}
+    if sort is not None:
+        command["sort"] = sort
+    if limit is not None:
+        command["limit"] = limit
+    return command
+
+
+# (name, explain command) for each query issued by the routers. Pipelines
+# and filters come from the same builders the routers call, so a changed
+# query shape is audited as it is. Archive collections get the indexes of
+# transactions, so the history pipelines are only explained there.
+QUERIES = [
+    ("users by email", find("users", {"email": "audit@example.com"})),
+    ("grid by owner", find("user_grid", {"user": USER_ID})),
+    ("grid by id", find("user_grid", {"_id": GRID_ID})),
+    ("grid ids by owner", {"distinct": "user_grid", "key": "_id", "query": {"user": USER_ID}}),
+    ("sell pool", aggregate("user_grid", SELL_POOL_PIPELINE)),
+    ("nearby sellers", aggregate("user_grid", nearby_pipeline(
+        9.93, 76.27, {"units_for_sell": {"$gte": 1}, "user": {"$ne": USER_ID}}, 50))),
+    ("transaction history", aggregate("transactions", page_pipeline(USER_ID, [GRID_ID], 50))),
+    ("history above watermark", aggregate("transactions", page_pipeline(USER_ID, [GRID_ID], 50, since=NOW))),
+    ("history before cursor", aggregate("transactions", page_pipeline(USER_ID, [GRID_ID], 50, (NOW, ObjectId())))),
+    ("history totals", aggregate("transactions", totals_pipeline(USER_ID, [GRID_ID], NOW))),
+    ("user export", find("transactions", export_query(history_match(USER_ID, [GRID_ID]), NOW, NOW), {"time": 1})),
+    ("admin export", find("transactions", export_query(None, NOW, NOW), {"time": 1})),
+    ("archived period totals", aggregate("transaction_periods", archived_totals_pipeline(USER_ID, period_of(NOW)))),
+    ("port hold by id", find("port_holds", {"hold": ObjectId(), "user": USER_ID})),
+    ("my port holds", find("port_holds", {"user": USER_ID, "expires_at": {"$gt": NOW}})),
+    ("stations", find("user_grid", {"station": True})),
+    ("grid listing page", find("user_grid", {"_id": {"$gt": GRID_ID}}, {"_id": 1}, 100)),
+    ("user listing page", find("users", {"_id": {"$gt": USER_ID}}, {"_id": 1}, 100)),
+    ("dashboard summary by grid", find("dashboard_summary", {"grid_id": GRID_ID})),
+    ("monthly rollups", find("monthly_energy", {"user": USER_ID, "year": NOW.year})),
+    ("open orders load", find("orders", open_orders(), dict(OPEN_ORDER_SORT))),
+    ("my open orders", find("orders", open_orders(USER_ID), {"time": -1})),
+    ("bulk candidates oldest", find("user_grid", candidates_query(USER_ID), {"_id": 1}, BULK_CANDIDATE_LIMIT)),
+    ("bulk candidates nearest", aggregate("user_grid", nearest_candidates_pipeline(USER_ID, 9.93, 76.27))),
+    ("chain reconcile candidates", aggregate("transactions", candidates_pipeline([USER_ID], NOW, NOW))),
+]
+
+
+def find_stages(plan, stages):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            find_stages(value, stages)
+    elif isinstance(plan, list):
+        for value in plan:
+            find_stages(value, stages)
+    return stages
+
+
+def winning_plans(explain):
+    # find/distinct put queryPlanner at the top, aggregations nest it under stages/shards
+    plans = []
+    if isinstance(explain, dict):
+        if "winningPlan" in explain:
+            plans.append(explain["winningPlan"])
+        for key, value in explain.items():
+            if key != "winningPlan":
+                plans.extend(winning_plans(value))
+    elif isinstance(explain, list):
+        for value in explain:
+            plans.extend(winning_plans(value))
+    return plans
+
+
+async def audit():
+    await ensure_indexes()
+    failures = []
+    for name, command in QUERIES:
+        explain = await db.command({"explain": command, "verbosity": "queryPlanner"})
+        stages = []
+        for plan in winning_plans(explain):
+            find_stages(plan, stages)
+        ok = "COLLSCAN" not in stages
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: {' > '.join(stages)}")
+        if not ok:
+            failures.append(name)
+    return failures
+
+
+if __name__ == "__main__":
+    failures = asyncio.run(audit())
+    if failures:
+        print(f"{len(failures)} queries use COLLSCAN: {', '.join(failures)}")
+        sys.exit(1)
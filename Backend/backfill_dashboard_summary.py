@@ -0,0 +1,33 @@
+"""Build the dashboard_summary document of every user.
+
+    python backfill_dashboard_summary.py
+
+Summaries are otherwise built lazily on a user's first /dashboard/summary
+read. Run it after restoring transactions or editing them by hand;
+purchases can keep running, build_summary redoes a user whose summary
+changed while it was being built.
+"""
+import asyncio
+from database import db
+from summaries import build_summary
+
+User_Collection = db["users"]
+
+CONCURRENCY = 16
+
+
+async def rebuild_dashboard_summaries():
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def rebuild(user_id):
+        async with semaphore:
+            await build_summary(user_id)
+
+    user_ids = await User_Collection.distinct("_id")
+    await asyncio.gather(*(rebuild(user_id) for user_id in user_ids))
+    return len(user_ids)
+
+
+if __name__ == "__main__":
+    count = asyncio.run(rebuild_dashboard_summaries())
+    print(f"Rebuilt {count} dashboard summaries")
@@ -0,0 +1,33 @@
+"""Store grid locations as GeoJSON points and build the indexes.
+
+    python backfill_grid_geo.py
+
+Copies location.latitude/longitude into a geo Point for every grid that
+does not have one yet, in a single server-side update.
+"""
+import asyncio
+from database import db
+from indexes import ensure_indexes
+
+Grid_Collection = db["user_grid"]
+
+
+async def backfill_grid_geo():
+    result = await Grid_Collection.update_many(
+        {
+            "geo": {"$exists": False},
+            "location.latitude": {"$type": "number"},
+            "location.longitude": {"$type": "number"},
+        },
+        [{"$set": {"geo": {
+            "type": "Point",
+            "coordinates": ["$location.longitude", "$location.latitude"],
+        }}}],
+    )
+    await ensure_indexes()
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    count = asyncio.run(backfill_grid_geo())
+    print(f"Added GeoJSON locations to {count} grids")
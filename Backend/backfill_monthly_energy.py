@@ -0,0 +1,76 @@
+"""Rebuild the monthly_energy rollups from the transactions collection and its archives.
+
+    python backfill_monthly_energy.py
+
+Buckets are (year, month) in Asia/Kolkata, the same as history.IST.
+Run it while purchases are paused; rollups written by buy_energy during
+the rebuild would be replaced.
+"""
+import asyncio
+from pymongo import ReplaceOne
+from database import db
+from archive import sources
+
+Monthly_Energy_Collection = db["monthly_energy"]
+
+BATCH_SIZE = 1000
+
+
+def bucket_pipeline(user_field, amount_field):
+    return [
+        {"$group": {
+            "_id": {
+                "user": user_field,
+                "year": {"$year": {"date": "$time", "timezone": "Asia/Kolkata"}},
+                "month": {"$month": {"date": "$time", "timezone": "Asia/Kolkata"}},
+            },
+            amount_field: {"$sum": "$units"},
+        }},
+    ]
+
+
+async def add_rollups(rollups, collection, pipeline, amount_field):
+    async for doc in collection.aggregate(pipeline, allowDiskUse=True):
+        key = (doc["_id"]["user"], doc["_id"]["year"], doc["_id"]["month"])
+        rollups.setdefault(key, {"bought": 0, "sold": 0})[amount_field] += doc[amount_field]
+
+
+async def rebuild_monthly_energy():
+    rollups = {}
+    # Archived months are rebuilt from their archive collections and the rest
+    # from transactions at or after the watermark, so rows archived but not
+    # yet deleted from transactions are counted once. A month can span an
+    # archive and the hot set, hence the += in add_rollups.
+    for collection, since in await sources(fresh=True):
+        match = {"$match": {"time": {"$gte": since} if since is not None else {"$ne": None}}}
+        await add_rollups(rollups, collection, [match] + bucket_pipeline("$buyer", "bought"), "bought")
+        # Sold units belong to the grid owner; purchases from an own grid are not counted as sold
+        await add_rollups(rollups, collection, [
+            match,
+            {"$lookup": {
+                "from": "user_grid",
+                "localField": "grid",
+                "foreignField": "_id",
+                "pipeline": [{"$project": {"user": 1}}],
+                "as": "grid_doc",
+            }},
+            {"$set": {"seller": {"$first": "$grid_doc.user"}}},
+            {"$match": {"seller": {"$ne": None}, "$expr": {"$ne": ["$seller", "$buyer"]}}},
+        ] + bucket_pipeline("$seller", "sold"), "sold")
+
+    await Monthly_Energy_Collection.delete_many({})
+    batch = []
+    for (user, year, month), totals in rollups.items():
+        bucket = {"user": user, "year": year, "month": month}
+        batch.append(ReplaceOne(bucket, {**bucket, **totals}, upsert=True))
+        if len(batch) >= BATCH_SIZE:
+            await Monthly_Energy_Collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await Monthly_Energy_Collection.bulk_write(batch, ordered=False)
+    return len(rollups)
+
+
+if __name__ == "__main__":
+    count = asyncio.run(rebuild_monthly_energy())
+    print(f"Rebuilt {count} monthly energy rollups")
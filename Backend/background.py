@@ -0,0 +1,119 @@
+import asyncio
+
+
+class BackgroundLoop:
+    """One asyncio task per worker process, started and stopped by main.lifespan.
+
+    run() calls run_once() until stop(). A failure is printed and retried
+    after a delay that doubles from 1 s up to max_backoff, so a database or
+    node that is down never takes the app down; a run_once() that returns
+    resets the delay. stop() cancels the task.
+    """
+
+    max_backoff = 60
+
+    def __init__(self):
+        self.task = None
+        self.stopping = False
+        self.retry_delay = 1
+
+    @property
+    def configured(self):
+        return True
+
+    async def run_once(self):
+        raise NotImplementedError
+
+    async def failed(self, error):
+        """Called after run_once() raised, before backing off."""
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await self.run_once()
+                self.retry_delay = 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(e)
+                await self.failed(e)
+                await asyncio.sleep(self.retry_delay)
+                self.retry_delay = min(self.retry_delay * 2, self.max_backoff)
+
+    def start(self):
+        if self.task is None and self.configured:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+class GroupCommitLoop(BackgroundLoop):
+    """Calls flush() every interval_ms, or as soon as wakeup is set.
+
+    stop() is not a cancel: it lets the batch in progress finish and
+    flushes whatever is still buffered, so no waiter is left hanging.
+    """
+
+    interval_ms = 200
+
+    def __init__(self):
+        super().__init__()
+        self.wakeup = asyncio.Event()
+
+    async def flush(self):
+        raise NotImplementedError
+
+    async def run_once(self):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), self.interval_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        await self.flush()
+
+    async def stop(self):
+        if self.task is not None:
+            self.stopping = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+            self.stopping = False
+        await self.flush()
+
+
+class StartupStep(BackgroundLoop):
+    """A startup call that has to succeed eventually, like loading a cache from Mongo.
+
+    first() runs it inline, so a healthy start is complete before the first
+    request. If that fails, the failure is printed and the call is retried
+    in the background with the usual backoff until it succeeds; /ready
+    reports the worker as not ready until then.
+    """
+
+    def __init__(self, name, call):
+        super().__init__()
+        self.name = name
+        self.call = call
+        self.done = False
+
+    async def run_once(self):
+        await self.call()
+        self.done = True
+        self.stopping = True
+
+    async def failed(self, error):
+        print(f"STARTUP FAILED: {self.name}: {error!r}, retrying in {self.retry_delay} s")
+
+    async def first(self):
+        try:
+            await self.run_once()
+        except Exception as e:
+            await self.failed(e)
+            self.start()
@@ -0,0 +1,125 @@
+"""History and summary query latency before and after archiving old transactions.
+
+    MONGO_DB=sorbet_bench python benchmarks/seed.py --transactions 3000000 --days 730 --drop
+    MONGO_DB=sorbet_bench python benchmarks/archive.py --after-days 90
+    MONGO_DB=sorbet_bench python benchmarks/archive.py --restore
+
+Expects a database seeded by benchmarks/seed.py. Picks --sample users and
+times, for each of them, what transaction_history and build_summary run:
+- totals: lifetime count, bought and sold units
+- page: the newest 50 rows
+- all rows: the default history without a limit
+- old page: 50 rows older than --after-days, read from the archives
+Each is timed once with everything in transactions, then again after
+TransactionArchiver.step() has moved the months older than --after-days
+into their archive collections. The script prints p50/p99 for both runs,
+and checks that the lifetime totals match.
+
+--restore moves every archived transaction back into transactions and
+drops the archive collections, so the benchmark can be run again.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+# Delete the archived copies right away instead of waiting for other workers
+os.environ.setdefault("ARCHIVE_STATE_TTL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from database import db
+from archive import TransactionArchiver, archive_names, history_totals, history_page
+from run import percentile
+
+
+async def measure(users, old_start):
+    # A cursor at old_start, as a client paging back through history would send
+    old_key = (old_start, ObjectId("f" * 24))
+    timings = {"totals": [], "page": [], "all rows": [], "old page": []}
+    totals = {}
+    for user_id, grid_ids in users:
+        for name, call in (
+            ("totals", lambda: history_totals(user_id, grid_ids)),
+            ("page", lambda: history_page(user_id, grid_ids, 50)),
+            ("all rows", lambda: history_page(user_id, grid_ids)),
+            ("old page", lambda: history_page(user_id, grid_ids, 50, old_key)),
+        ):
+            t0 = time.perf_counter()
+            result = await call()
+            timings[name].append(time.perf_counter() - t0)
+            if name == "totals":
+                totals[user_id] = result
+    return timings, totals
+
+
+async def restore():
+    names = await archive_names()
+    for name in names:
+        async for batch in batches(db[name].find()):
+            try:
+                await db["transactions"].insert_many(batch, ordered=False)
+            except BulkWriteError:
+                # Not deleted from transactions yet
+                pass
+        await db[name].drop()
+    await db["transaction_periods"].drop()
+    await db["archive_state"].drop()
+    print(f"restored {len(names)} archived months")
+
+
+async def batches(cursor, size=10000):
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def main(args):
+    if args.restore:
+        await restore()
+        return
+    if await archive_names():
+        sys.exit("transactions are already archived; run with --restore first")
+    buyers = await db["transactions"].aggregate([
+        {"$sample": {"size": args.sample}},
+        {"$group": {"_id": "$buyer"}},
+    ]).to_list(length=None)
+    users = [(doc["_id"], await db["user_grid"].distinct("_id", {"user": doc["_id"]})) for doc in buyers]
+    old_start = datetime.now(timezone.utc) - timedelta(days=args.after_days + 31)
+    hot_before = await db["transactions"].estimated_document_count()
+
+    before, totals_before = await measure(users, old_start)
+
+    started = time.perf_counter()
+    copied = await TransactionArchiver(args.after_days).step()
+    print(f"archived {copied} of {hot_before} transactions in {time.perf_counter() - started:.1f}s, "
+          f"{await db['transactions'].estimated_document_count()} left in the hot set")
+
+    after, totals_after = await measure(users, old_start)
+
+    print(f"{len(users)} users, latency ms before -> after archival")
+    for name in before:
+        b, a = sorted(before[name]), sorted(after[name])
+        print(f"{name:<10} p50 {percentile(b, 0.5):7.2f} -> {percentile(a, 0.5):7.2f}   "
+              f"p99 {percentile(b, 0.99):7.2f} -> {percentile(a, 0.99):7.2f}")
+    mismatched = [user for user in totals_before if totals_before[user] != totals_after[user]]
+    if mismatched:
+        print(f"FAILED lifetime totals differ for {len(mismatched)} users")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--after-days", type=int, default=90)
+    parser.add_argument("--sample", type=int, default=200, help="transactions sampled to pick users")
+    parser.add_argument("--restore", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,73 @@
+"""Hundreds of simultaneous buyers against one grid.
+
+    MONGO_URI=mongodb://localhost:27017/?replicaSet=rs0 \\
+        python benchmarks/buy_contention.py --buyers 500 --units 300
+
+Seeds a single grid in a scratch database (MONGO_DB, default
+sorbet_bench), fires every purchase at once through purchase_units and
+checks that no units were oversold: units sold + units left must equal
+the starting pool, and never more purchases succeed than there were
+units. Multi-document transactions need a replica set, even a
+single-node one.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi import HTTPException
+from database import db
+from indexes import ensure_indexes
+from routers.Energypool import purchase_units
+
+
+async def main(args):
+    await ensure_indexes()
+    grids, transactions = db["user_grid"], db["transactions"]
+    seller = ObjectId()
+    grid_id = (await grids.insert_one({
+        "grid name": "contention-bench", "user": seller, "units": 0, "units_for_sell": args.units,
+    })).inserted_id
+
+    async def buy(buyer):
+        try:
+            await purchase_units(buyer, grid_id, args.per_buy)
+            return "ok"
+        except HTTPException as e:
+            return e.status_code
+
+    buyers = [ObjectId() for _ in range(args.buyers)]
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(buy(b) for b in buyers), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+
+    left = (await grids.find_one({"_id": grid_id}))["units_for_sell"]
+    sold = 0
+    async for doc in transactions.aggregate([
+        {"$match": {"grid": grid_id}},
+        {"$group": {"_id": None, "units": {"$sum": "$units"}}},
+    ]):
+        sold = doc["units"]
+    succeeded = outcomes.count("ok")
+    print(f"buyers={args.buyers} succeeded={succeeded} rejected={len(outcomes) - succeeded}")
+    print(f"units: start={args.units} sold={sold} left={left}")
+    print(f"purchases/s: {succeeded / elapsed:.1f}")
+
+    await transactions.delete_many({"grid": grid_id})
+    await grids.delete_one({"_id": grid_id})
+    if left < 0 or sold + left != args.units or succeeded * args.per_buy != sold:
+        print("OVERSOLD")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--units", type=int, default=300)
+    parser.add_argument("--per-buy", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
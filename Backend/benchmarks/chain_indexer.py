@@ -0,0 +1,117 @@
+"""PowerShare event indexer throughput and reorg handling on an in-process chain.
+
+    pip install "eth-tester[py-evm]"
+    python benchmarks/chain_indexer.py --transfers 2000 --empty-blocks 20000 --reorg
+
+Runs against eth-tester through web3's EthereumTesterProvider, so no node is
+needed; Mongo is a scratch database (MONGO_DB, default sorbet_bench).
+
+The repo ships only PowerShare's ABI, so the script deploys a stand-in
+contract. It emits the same Transfer(address,address,uint256) event from
+calldata (to, value). Each transfer has a matching purchase in
+transactions, and the script prints blocks/s, events/s and how many events
+were settled. With --reorg the chain is reverted to a snapshot taken
+halfway and extended with empty blocks. The second half's events and
+settlements must then be rolled back.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+os.environ.setdefault("INDEXER_CONFIRMATIONS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import Web3, EthereumTesterProvider
+from database import db
+from indexes import ensure_indexes
+from chain_indexer import ChainIndexer, TRANSFER_TOPIC, TOKEN_DECIMALS
+
+# runtime: mem[0] = calldata[32]; LOG3(0, 32, TRANSFER_TOPIC, caller, calldata[0])
+RUNTIME = bytes.fromhex("602035600052600035337f" + TRANSFER_TOPIC[2:] + "60206000a300")
+INIT_CODE = bytes.fromhex(f"60{len(RUNTIME):02x}600c600039" f"60{len(RUNTIME):02x}6000f3") + RUNTIME
+
+
+def transfer(w3, contract, sender, to, units):
+    value = units * 10 ** TOKEN_DECIMALS
+    data = bytes(12) + bytes.fromhex(to[2:]) + value.to_bytes(32, "big")
+    return w3.eth.send_transaction({"from": sender, "to": contract, "data": data})
+
+
+async def index_all(indexer):
+    start = time.perf_counter()
+    while not await indexer.step():
+        pass
+    return time.perf_counter() - start
+
+
+async def main(args):
+    await ensure_indexes()
+    w3 = Web3(EthereumTesterProvider())
+    accounts = w3.eth.accounts
+    receipt = w3.eth.wait_for_transaction_receipt(w3.eth.send_transaction({"from": accounts[0], "data": INIT_CODE}))
+    contract = receipt["contractAddress"]
+    start_block = receipt["blockNumber"] + 1
+
+    users, grids, transactions = db["users"], db["user_grid"], db["transactions"]
+    buyer, seller = accounts[1], accounts[2]
+    user_ids = (await users.insert_many([
+        {"name": "chain bench buyer", "email": "chain-bench-buyer@example.com", "walletAddress": buyer},
+        {"name": "chain bench seller", "email": "chain-bench-seller@example.com", "walletAddress": seller.lower()},
+    ])).inserted_ids
+    grid_id = (await grids.insert_one({"grid name": "chain bench", "user": user_ids[1], "units": 0, "units_for_sell": 0})).inserted_id
+
+    snapshot = None
+    tx_ids = []
+    try:
+        for i in range(args.transfers):
+            if args.reorg and i == args.transfers // 2:
+                snapshot = w3.testing.snapshot()
+            mined = w3.eth.wait_for_transaction_receipt(transfer(w3, contract, buyer, seller, 1 + i % 5))
+            # What /energypool/buy records once the frontend's transfer is mined. eth-tester
+            # runs block timestamps ahead of the wall clock, so use the block's own time
+            block_time = w3.eth.get_block(mined["blockNumber"])["timestamp"]
+            tx_ids.append((await transactions.insert_one({
+                "buyer": user_ids[0], "grid": grid_id, "units": 1 + i % 5,
+                "time": datetime.fromtimestamp(block_time, timezone.utc), "status": "completed",
+            })).inserted_id)
+        if args.empty_blocks:
+            w3.testing.mine(args.empty_blocks)
+
+        indexer = ChainIndexer(w3, contract, start_block)
+        elapsed = await index_all(indexer)
+        stats = indexer.stats()
+        print(f"blocks={stats['blocks']} events={stats['events']} matched={stats['matched']} elapsed={elapsed:.2f}s")
+        print(f"throughput: {stats['blocks_per_second']:.0f} blocks/s, {stats['events_per_second']:.0f} events/s")
+        settled = await transactions.count_documents({"_id": {"$in": tx_ids}, "settlement": {"$exists": True}})
+        print(f"settled {settled}/{len(tx_ids)} purchases")
+
+        if snapshot is not None:
+            w3.testing.revert(snapshot)
+            w3.testing.mine(args.transfers + args.empty_blocks + 1)
+            await index_all(indexer)
+            kept = args.transfers // 2
+            events = await db["chain_events"].count_documents({"contract": indexer.address})
+            settled = await transactions.count_documents({"_id": {"$in": tx_ids}, "settlement": {"$exists": True}})
+            ok = indexer.reorgs == 1 and events == kept and settled == kept
+            print(f"reorg: rollbacks={indexer.reorgs} events={events} settled={settled} expected={kept} "
+                  f"{'OK' if ok else 'FAILED'}")
+            if not ok:
+                sys.exit(1)
+    finally:
+        await users.delete_many({"_id": {"$in": user_ids}})
+        await grids.delete_one({"_id": grid_id})
+        await transactions.delete_many({"_id": {"$in": tx_ids}})
+        await db["chain_events"].delete_many({"contract": contract})
+        await db["chain_checkpoints"].delete_one({"_id": contract})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--transfers", type=int, default=1000)
+    parser.add_argument("--empty-blocks", type=int, default=10000)
+    parser.add_argument("--reorg", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,50 @@
+"""Cold start to first-request time.
+
+    python benchmarks/cold_start.py --runs 5
+
+Starts ``uvicorn main:app`` in a fresh process and polls GET / until it
+answers, reporting process start to first 200 response. The import-time
+ping used to add a full Mongo round trip (or a timeout) to this number.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(port, timeout):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise TimeoutError("server did not answer")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    times = [measure(args.port, args.timeout) * 1000 for _ in range(args.runs)]
+    print(f"cold start to first response ms: median={statistics.median(times):.0f} "
+          f"min={min(times):.0f} max={max(times):.0f}")
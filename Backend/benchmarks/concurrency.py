@@ -0,0 +1,64 @@
+"""Throughput benchmark with many requests in flight.
+
+Start the backend (``uvicorn main:app``) and run for example:
+
+    python benchmarks/concurrency.py --path /grid/ --concurrency 200 --requests 5000
+
+Run it once on the old synchronous pymongo build and once on the motor build
+to compare requests/s; with a blocking driver the throughput stays flat as
+``--concurrency`` grows, with the async driver it scales until Mongo saturates.
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+
+
+async def worker(session, url, headers, queue, latencies, errors):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as resp:
+                await resp.read()
+                if resp.status >= 400:
+                    errors.append(resp.status)
+        except aiohttp.ClientError as e:
+            errors.append(str(e))
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args):
+    url = args.base_url.rstrip("/") + args.path
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+    latencies, errors = [], []
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            worker(session, url, headers, queue, latencies, errors)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    print(f"{url} concurrency={args.concurrency} requests={len(latencies)} errors={len(errors)}")
+    print(f"throughput: {len(latencies) / elapsed:.1f} req/s")
+    print(f"latency ms: p50={p(0.50):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/grid/")
+    parser.add_argument("--token", default=None)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    asyncio.run(run(parser.parse_args()))
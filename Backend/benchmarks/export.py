@@ -0,0 +1,81 @@
+"""Export throughput and memory on a large transaction history.
+
+    MONGO_DB=sorbet_bench python benchmarks/seed.py --transactions 1000000 --drop
+    MONGO_DB=sorbet_bench python benchmarks/export.py
+
+Expects a database seeded by benchmarks/seed.py. Streams every
+transaction through export_chunks (the admin export) in each format, then
+the history of the busiest buyer (the user export), writing the chunks to
+/dev/null. For each run it prints rows/s, MB/s, name lookups and the peak
+RSS sampled after every chunk, next to the RSS before the run. RSS should
+stay flat however many rows go through; with --max-growth-mb set, the
+script exits with status 1 when it doesn't.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db
+from history import history_match
+from export import NameLookup, export_chunks, EXPORT_BATCH_SIZE
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE / 1e6
+
+
+async def run(name, match, format, user_id=None):
+    lookup = NameLookup()
+    before = peak = rss_mb()
+    rows = size = 0
+    started = time.perf_counter()
+    with open(os.devnull, "wb") as sink:
+        async for chunk in export_chunks(match, format, user_id=user_id, lookup=lookup):
+            sink.write(chunk)
+            size += len(chunk)
+            rows += chunk.count(b"\n")
+            peak = max(peak, rss_mb())
+    elapsed = time.perf_counter() - started
+    if format == "csv":
+        rows -= 1
+    print(f"{name:<14} {format:<6} rows={rows} {rows / elapsed:8.0f} rows/s {size / elapsed / 1e6:6.1f} MB/s "
+          f"size={size / 1e6:.1f}MB lookups={lookup.queries} rss={before:.0f}->{peak:.0f}MB")
+    return peak - before
+
+
+async def main(args):
+    total = await db["transactions"].estimated_document_count()
+    if not total:
+        sys.exit("no transactions; seed the database with benchmarks/seed.py")
+    print(f"{total} transactions, batch size {EXPORT_BATCH_SIZE}")
+    growth = []
+    for format in ("csv", "ndjson"):
+        growth.append(await run("admin export", None, format))
+
+    busiest = await db["transactions"].aggregate([
+        {"$sortByCount": "$buyer"},
+        {"$limit": 1},
+    ]).to_list(length=1)
+    if busiest:
+        user_id = busiest[0]["_id"]
+        grid_ids = await db["user_grid"].distinct("_id", {"user": user_id})
+        for format in ("csv", "ndjson"):
+            growth.append(await run("user export", history_match(user_id, grid_ids), format, user_id))
+
+    if args.max_growth_mb is not None and max(growth) > args.max_growth_mb:
+        print(f"FAILED RSS grew by {max(growth):.0f}MB during an export")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-growth-mb", type=float, default=None)
+    asyncio.run(main(parser.parse_args()))
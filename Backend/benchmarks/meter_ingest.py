@@ -0,0 +1,115 @@
+"""Maximum meter-reading ingest rate through the write-behind buffer.
+
+    python benchmarks/meter_ingest.py --grids 1000 --requests 2000 --per-request 100
+
+Seeds grids in a scratch database (MONGO_DB, default sorbet_bench) and
+pushes --requests batches of --per-request readings through meter_buffer
+with --concurrency callers at a time, each waiting for its group commit
+like POST /grid/readings does. The sustained readings/s printed here is
+the ingest ceiling for that deployment; tune METER_FLUSH_SIZE and
+METER_FLUSH_INTERVAL_MS against it.
+
+Production runs on a replica set, where every flush waits for the
+majority, so the script refuses a standalone server unless
+--allow-standalone is given. It prints the server version and replica
+set first, and the average readings per flush with the settings last.
+The same is saved to benchmarks/results/meter-ingest-<timestamp>.json,
+next to the benchmarks/run.py results, so a run is recorded with its
+setup.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import db
+from meter_readings import (
+    meter_buffer, make_reading, ensure_reading_collection, METER_FLUSH_SIZE, METER_FLUSH_INTERVAL_MS,
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+async def describe_server(allow_standalone):
+    hello = await db.command("hello")
+    version = (await db.command("buildInfo"))["version"]
+    if "setName" not in hello:
+        if not allow_standalone:
+            sys.exit("not a replica set member; rerun with --allow-standalone to measure anyway")
+        return f"mongod {version}, standalone"
+    return f"mongod {version}, replica set {hello['setName']} ({len(hello.get('hosts', []))} members)"
+
+
+async def main(args):
+    server = await describe_server(args.allow_standalone)
+    print(server)
+    await ensure_reading_collection()
+    grids = db["user_grid"]
+    grid_ids = (await grids.insert_many([
+        {"grid name": f"meter bench {i}", "units": 0, "units_for_sell": 0} for i in range(args.grids)
+    ])).inserted_ids
+
+    queue = asyncio.Queue()
+    for _ in range(args.requests):
+        queue.put_nowait(None)
+    latencies = []
+
+    async def caller():
+        while not queue.empty():
+            queue.get_nowait()
+            readings = [make_reading(random.choice(grid_ids), random.randint(0, 1000)) for _ in range(args.per_request)]
+            start = time.perf_counter()
+            await meter_buffer.add(readings)
+            latencies.append(time.perf_counter() - start)
+
+    meter_buffer.start()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(caller() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await meter_buffer.stop()
+        await grids.delete_many({"_id": {"$in": grid_ids}})
+        await db["meter_readings"].delete_many({"grid": {"$in": grid_ids}})
+
+    total = args.requests * args.per_request
+    latencies.sort()
+    print(f"readings={total} batches={meter_buffer.batches} elapsed={elapsed:.2f}s")
+    print(f"ingest rate: {total / elapsed:.0f} readings/s, {total / meter_buffer.batches:.0f} readings per flush "
+          f"(METER_FLUSH_SIZE={METER_FLUSH_SIZE}, METER_FLUSH_INTERVAL_MS={METER_FLUSH_INTERVAL_MS}, "
+          f"concurrency={args.concurrency}, per request={args.per_request})")
+    p50, p99 = latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"commit wait ms: p50={p50:.1f} p99={p99:.1f}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, "meter-ingest-" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w") as f:
+        json.dump({
+            "server": server,
+            "args": vars(args),
+            "settings": {"METER_FLUSH_SIZE": METER_FLUSH_SIZE, "METER_FLUSH_INTERVAL_MS": METER_FLUSH_INTERVAL_MS},
+            "readings": total,
+            "batches": meter_buffer.batches,
+            "elapsed_s": elapsed,
+            "readings_per_s": total / elapsed,
+            "commit_wait_p50_ms": p50,
+            "commit_wait_p99_ms": p99,
+        }, f, indent=2)
+    print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--per-request", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--allow-standalone", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,96 @@
+"""Matching engine throughput and latency with a deep resting book.
+
+    python benchmarks/order_book.py --resting 100000 --orders 50000
+    python benchmarks/order_book.py --resting 100000 --orders 50000 --persist
+
+Rests --resting asks spread over --regions regions at random prices. Then
+it submits --orders crossing bids one at a time through OrderBook.add and
+prints orders matched per second and the p50/p99/max latency of a single
+match. Matching is pure Python in memory, so no database is needed.
+
+With --persist the resulting fills are also written through FillWriter
+in ORDER_FLUSH_SIZE batches against a scratch database (MONGO_DB,
+default sorbet_bench), and the commit rate is printed. Fill writes use
+Mongo transactions, so this needs a replica set.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from order_book import Order, OrderBook, FillWriter, ORDER_FLUSH_SIZE
+
+
+def build_book(args, sellers):
+    book = OrderBook()
+    now = datetime.now(timezone.utc)
+    for _ in range(args.resting):
+        seller, grid = random.choice(sellers)
+        book.add(Order(
+            ObjectId(), "ask", seller, f"r{random.randrange(args.regions)}",
+            round(random.uniform(5, 15), 2), random.randint(1, 20), now,
+            user_name="bench seller", grid=grid, grid_name="bench grid",
+        ))
+    return book
+
+
+async def main(args):
+    random.seed(args.seed)
+    sellers = [(ObjectId(), ObjectId()) for _ in range(1000)]
+    start = time.perf_counter()
+    book = build_book(args, sellers)
+    print(f"rested {len(book.orders)} asks in {args.regions} regions in {time.perf_counter() - start:.2f}s")
+
+    now = datetime.now(timezone.utc)
+    latencies, fills = [], []
+    started = time.perf_counter()
+    for _ in range(args.orders):
+        order = Order(
+            ObjectId(), "bid", ObjectId(), f"r{random.randrange(args.regions)}",
+            round(random.uniform(8, 16), 2), random.randint(1, 10), now, user_name="bench buyer",
+        )
+        t0 = time.perf_counter()
+        fills += book.add(order)
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    stats = book.stats()
+    print(f"orders={args.orders} matched={stats['matched']} fills={stats['fills']} "
+          f"resting={stats['resting']} elapsed={elapsed:.2f}s")
+    print(f"throughput: {args.orders / elapsed:.0f} orders/s, {stats['fills'] / elapsed:.0f} fills/s")
+    print(f"match latency us: p50={latencies[len(latencies) // 2] * 1e6:.1f} "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1e6:.1f} max={latencies[-1] * 1e6:.1f}")
+
+    if args.persist:
+        from database import db
+        writer = FillWriter(book)
+        for fill in fills:
+            fill["time"] = now
+        started = time.perf_counter()
+        try:
+            for i in range(0, len(fills), ORDER_FLUSH_SIZE):
+                await writer.write(fills[i:i + ORDER_FLUSH_SIZE])
+            elapsed = time.perf_counter() - started
+            print(f"persisted {len(fills)} fills in {elapsed:.2f}s: {len(fills) / elapsed:.0f} fills/s")
+        finally:
+            await db["transactions"].delete_many({"_id": {"$in": [f["transaction_id"] for f in fills]}})
+            users = {f["bid"].user for f in fills} | {f["ask"].user for f in fills}
+            await db["monthly_energy"].delete_many({"user": {"$in": list(users)}})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resting", type=int, default=100000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--persist", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,154 @@
+"""Admission control under overload: writes are shed fast while reads keep going.
+
+    MONGO_DB=sorbet_bench uvicorn main:app &
+    MONGO_DB=sorbet_bench python benchmarks/overload.py --spike-concurrency 500 --duration 20
+
+Expects a database seeded by benchmarks/seed.py. The script runs in two
+phases:
+1. Steady reads (browse pool, history) alone, as a baseline.
+2. The same reads while --spike-concurrency clients flood buy, sell_units
+   and login.
+
+For each workload it prints the status mix, and the latency of admitted
+(2xx/4xx) and shed (429/503) responses. Read p50/p99 is shown for both
+phases, and /admission is printed at the end.
+
+It exits with status 1 if any of these happen:
+- a shed response lacks Retry-After
+- a shed response took longer than the largest queue wait plus --slack-ms
+- anything fails in another way (5xx other than 503, or a client timeout)
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+
+from seed import BENCH_PASSWORD, bench_email
+from run import login_tokens, percentile
+
+
+class Recorder:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name, status, latency, retry_after):
+        self.results.setdefault(name, []).append((status, latency, retry_after))
+
+    def report(self, wait_limit, slack):
+        failures = []
+        for name, results in sorted(self.results.items()):
+            statuses = {}
+            for status, _, _ in results:
+                statuses[status] = statuses.get(status, 0) + 1
+            shed = sorted(l for s, l, _ in results if s in (429, 503))
+            served = sorted(l for s, l, _ in results if s not in (429, 503) and isinstance(s, int) and s < 500)
+            mix = " ".join(f"{s}={n}" for s, n in sorted(statuses.items(), key=lambda item: str(item[0])))
+            print(f"{name:<12} {mix}")
+            print(f"{'':<12} served p50={percentile(served, 0.5):7.1f} p99={percentile(served, 0.99):7.1f} ms   "
+                  f"shed p50={percentile(shed, 0.5):7.1f} p99={percentile(shed, 0.99):7.1f} ms")
+            if any(s in (429, 503) and not r for s, _, r in results):
+                failures.append(f"{name}: shed response without Retry-After")
+            if shed and shed[-1] > wait_limit + slack:
+                failures.append(f"{name}: shed after {shed[-1] * 1000:.0f} ms")
+            if any(not isinstance(s, int) or (s >= 500 and s != 503) for s, _, _ in results):
+                failures.append(f"{name}: errors other than 503")
+        return failures
+
+
+async def hammer(session, recorder, name, make_request, concurrency, deadline, timeout):
+    async def worker():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                async with make_request(session, timeout=timeout) as resp:
+                    await resp.read()
+                    recorder.add(name, resp.status, time.perf_counter() - start, resp.headers.get("Retry-After"))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                recorder.add(name, type(e).__name__, time.perf_counter() - start, None)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def main(args):
+    base = args.base_url.rstrip("/")
+    connector = aiohttp.TCPConnector(limit=args.spike_concurrency + args.read_concurrency + 10)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tokens = await login_tokens(session, base, random.sample(range(args.users), min(args.tokens, args.users)))
+        if not tokens:
+            sys.exit("could not log in any bench user; seed the database with benchmarks/seed.py")
+        async with session.get(f"{base}/energypool/?limit=1000", headers={"Authorization": f"Bearer {tokens[0]}"}) as resp:
+            pool = [seller["grid_id"] for seller in await resp.json()]
+        async with session.get(f"{base}/admission") as resp:
+            groups = await resp.json()
+        wait_limit = max(group["wait_ms"] for group in groups.values()) / 1000
+
+        def auth():
+            return {"Authorization": f"Bearer {random.choice(tokens)}"}
+
+        reads = {
+            "browse_pool": lambda s, **kw: s.get(f"{base}/energypool/?limit=100", headers=auth(), **kw),
+            "history": lambda s, **kw: s.get(f"{base}/energypool/transaction_history?limit=50", headers=auth(), **kw),
+        }
+        writes = {
+            "buy": lambda s, **kw: s.post(f"{base}/energypool/buy", headers=auth(), json={
+                "grid_id": random.choice(pool), "units": 1}, **kw),
+            "sell_units": lambda s, **kw: s.post(f"{base}/grid/sell_units", headers=auth(), json={"units": 1}, **kw),
+            "login": lambda s, **kw: s.post(f"{base}/user/login", json={
+                "email": bench_email(random.randrange(args.users)), "password": BENCH_PASSWORD}, **kw),
+        }
+
+        phases = {}
+        for phase, spike in (("baseline", False), ("spike", True)):
+            recorder = Recorder()
+            deadline = time.perf_counter() + args.duration
+            jobs = [
+                hammer(session, recorder, name, make, max(1, args.read_concurrency // len(reads)), deadline, timeout)
+                for name, make in reads.items()
+            ]
+            if spike:
+                jobs += [
+                    hammer(session, recorder, name, make, max(1, args.spike_concurrency // len(writes)), deadline, timeout)
+                    for name, make in writes.items()
+                ]
+            await asyncio.gather(*jobs)
+            print(f"\n== {phase} ({args.duration:.0f}s)")
+            phases[phase] = (recorder, recorder.report(wait_limit, args.slack_ms / 1000))
+
+        print("\nread latency, baseline -> spike:")
+        for name in reads:
+            before = sorted(l for _, l, _ in phases["baseline"][0].results.get(name, []))
+            during = sorted(l for _, l, _ in phases["spike"][0].results.get(name, []))
+            print(f"{name:<12} p50 {percentile(before, 0.5):7.1f} -> {percentile(during, 0.5):7.1f} ms   "
+                  f"p99 {percentile(before, 0.99):7.1f} -> {percentile(during, 0.99):7.1f} ms")
+
+        async with session.get(f"{base}/admission") as resp:
+            print("\n/admission:")
+            for name, group in (await resp.json()).items():
+                print(f"{name:<12} {group}")
+
+    failures = phases["baseline"][1] + phases["spike"][1]
+    for failure in failures:
+        print(f"FAILED {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=10000, help="users seeded by seed.py")
+    parser.add_argument("--tokens", type=int, default=50, help="users to log in for authenticated workloads")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--read-concurrency", type=int, default=20)
+    parser.add_argument("--spike-concurrency", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--slack-ms", type=float, default=1000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,59 @@
+"""Login (bcrypt verify) throughput versus password pool size.
+
+    python benchmarks/password_pool.py --sizes 1 2 4 8 --logins 64
+
+Runs the same verify_and_update call the /user/login handler makes, through
+PasswordPool instances of each size, with every login in flight at once.
+Also reports how long the event loop was blocked, which should stay near
+zero whatever the pool size.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordPool, PasswordPoolSaturated, pwd_context
+
+
+async def loop_lag(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append(time.perf_counter() - start - 0.005)
+
+
+async def run_size(size, logins, stored_hash):
+    pool = PasswordPool(workers=size, queue_limit=logins)
+    stop, lag = asyncio.Event(), []
+    lag_task = asyncio.create_task(loop_lag(stop, lag))
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(pool.run(pwd_context.verify_and_update, "password", stored_hash) for _ in range(logins)),
+        return_exceptions=True,
+    )
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    pool.executor.shutdown()
+    rejected = sum(isinstance(r, PasswordPoolSaturated) for r in results)
+    print(
+        f"workers={size:<3} logins/s={(logins - rejected) / elapsed:8.1f} "
+        f"rejected={rejected} max loop lag={max(lag, default=0) * 1000:.1f}ms"
+    )
+
+
+async def main(args):
+    stored_hash = pwd_context.hash("password")
+    print(f"bcrypt rounds={pwd_context.to_dict().get('bcrypt__default_rounds')} cpus={os.cpu_count()}")
+    for size in args.sizes:
+        await run_size(size, args.logins, stored_hash)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--logins", type=int, default=64)
+    asyncio.run(main(parser.parse_args()))
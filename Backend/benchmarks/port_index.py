@@ -0,0 +1,97 @@
+"""Nearby free-port lookups against the in-memory port index.
+
+    python benchmarks/port_index.py --stations 50000 --lookups 20000
+
+Indexes --stations stations at random points in the same box as seed.py,
+each with 1-6 ports of the seed.py port types, and holds --held of the
+ports. Then it runs --lookups nearby() calls at random points, half of
+them for a random port type, and prints lookups per second and the
+p50/p99/max latency of one lookup. The first --check lookups are also
+answered by a brute-force scan over every station, and the script exits
+with status 1 if the two disagree. Everything is in memory, so no
+database is needed.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from stations import PortIndex, distance_km
+
+PORT_TYPES = ["Type 2", "CCS2", "3-pin"]
+
+
+def build_index(args):
+    index = PortIndex()
+    now = time.time()
+    for i in range(args.stations):
+        lat, lng = random.uniform(8.0, 13.0), random.uniform(74.5, 77.5)
+        station = index.upsert_station({
+            "_id": ObjectId(),
+            "grid name": f"Bench Station {i}",
+            "user": ObjectId(),
+            "location": {"latitude": lat, "longitude": lng},
+            "station": True,
+            "ports": [random.choice(PORT_TYPES) for _ in range(random.randint(1, 6))],
+        })
+        for port in range(len(station.expires)):
+            if random.random() < args.held:
+                station.hold(port, now + 900)
+    return index
+
+
+def brute_force(index, lat, lng, port_type, radius_km, limit, now):
+    found = []
+    for station in index.stations.values():
+        free = station.free(port_type, now) if port_type else sum(e <= now for e in station.expires)
+        distance = distance_km(lat, lng, station.latitude, station.longitude)
+        if free and distance <= radius_km:
+            found.append(round(distance, 3))
+    return sorted(found)[:limit]
+
+
+def main(args):
+    random.seed(args.seed)
+    started = time.perf_counter()
+    index = build_index(args)
+    stats = index.stats()
+    print(f"indexed {stats['stations']} stations, {stats['ports']} ports ({stats['held_ports']} held) "
+          f"in {stats['cells']} cells in {time.perf_counter() - started:.2f}s")
+
+    now = time.time()
+    latencies, mismatches = [], 0
+    for i in range(args.lookups):
+        lat, lng = random.uniform(8.0, 13.0), random.uniform(74.5, 77.5)
+        port_type = random.choice(PORT_TYPES) if i % 2 else None
+        t0 = time.perf_counter()
+        result = index.nearby(lat, lng, port_type, args.radius_km, args.limit, now)
+        latencies.append(time.perf_counter() - t0)
+        if i < args.check:
+            expected = brute_force(index, lat, lng, port_type, args.radius_km, args.limit, now)
+            if [station["distance_km"] for station in result] != expected:
+                mismatches += 1
+
+    elapsed = sum(latencies)
+    latencies.sort()
+    print(f"lookups={args.lookups} limit={args.limit} radius={args.radius_km}km: {args.lookups / elapsed:.0f} lookups/s")
+    print(f"lookup latency us: p50={latencies[len(latencies) // 2] * 1e6:.1f} "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1e6:.1f} max={latencies[-1] * 1e6:.1f}")
+    if mismatches:
+        print(f"FAILED {mismatches} of {min(args.check, args.lookups)} lookups differ from a full scan")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stations", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--held", type=float, default=0.5, help="fraction of ports held")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--radius-km", type=float, default=50)
+    parser.add_argument("--check", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+"""Scripted workloads against a running backend, with results saved for comparison.
+
+    MONGO_DB=sorbet_bench uvicorn main:app --workers 4 &
+    MONGO_DB=sorbet_bench python benchmarks/run.py --requests 2000 --concurrency 50
+    MONGO_DB=sorbet_bench python benchmarks/run.py --compare benchmarks/results/<earlier>.json
+
+Expects a database seeded by benchmarks/seed.py. For each workload (login,
+browse pool, buy, history, monthly summary) it reports p50/p95/p99 latency,
+throughput, errors and the Mongo operations the server executed, read
+from serverStatus opcounters before and after the workload (so run it
+against a mongod nothing else is using). Results go to
+benchmarks/results/<timestamp>.json; --compare prints the change against
+an earlier run.
+
+Admission control rate-limits each client, and every request here comes
+from one address with a few tokens. To measure raw capacity, start the
+server with the rate limits off, e.g. ADMISSION_AUTH_RATE=0
+ADMISSION_PURCHASE_RATE=0. benchmarks/overload.py exercises the limits
+themselves.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+
+from database import connect
+from seed import BENCH_PASSWORD, bench_email
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] * 1000 if values else 0.0
+
+
+async def opcounters():
+    status = await connect().admin.command("serverStatus")
+    return dict(status["opcounters"])
+
+
+async def login_tokens(session, base, users):
+    tokens = []
+    for i in users:
+        while True:
+            async with session.post(f"{base}/user/login", json={"email": bench_email(i), "password": BENCH_PASSWORD}) as resp:
+                # Logins from one address are rate limited; wait as told
+                if resp.status in (429, 503):
+                    await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
+                    continue
+                if resp.status == 200:
+                    tokens.append((await resp.json())["token"])
+                break
+    return tokens
+
+
+def workloads(base, tokens, user_count, pool):
+    def auth():
+        return {"Authorization": f"Bearer {random.choice(tokens)}"}
+
+    return {
+        "login": lambda s: s.post(f"{base}/user/login", json={
+            "email": bench_email(random.randrange(user_count)), "password": BENCH_PASSWORD,
+        }),
+        "browse_pool": lambda s: s.get(f"{base}/energypool/?limit=100", headers=auth()),
+        "buy": lambda s: s.post(f"{base}/energypool/buy", headers=auth(), json={
+            "grid_id": random.choice(pool), "units": 1,
+        }),
+        "history": lambda s: s.get(f"{base}/energypool/transaction_history?limit=50", headers=auth()),
+        "monthly_summary": lambda s: s.get(f"{base}/energypool/monthly_energy_summary", headers=auth()),
+    }
+
+
+async def run_workload(session, make_request, requests, concurrency):
+    latencies, errors = [], 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            async with make_request(session) as resp:
+                await resp.read()
+                if resp.status >= 400:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)["workloads"]
+    print(f"\nchange against {previous_path}:")
+    for name, result in current.items():
+        old = previous.get(name)
+        if not old:
+            continue
+        print(f"{name:<16} throughput {result['throughput'] / old['throughput'] - 1:+7.1%}  "
+              f"p95 {result['p95_ms'] / old['p95_ms'] - 1:+7.1%}  "
+              f"mongo ops/req {result['mongo_ops_per_request'] - old['mongo_ops_per_request']:+.2f}")
+
+
+async def main(args):
+    base = args.base_url.rstrip("/")
+    selected = args.workloads
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tokens = await login_tokens(session, base, random.sample(range(args.users), min(args.tokens, args.users)))
+        if not tokens:
+            sys.exit("could not log in any bench user; seed the database with benchmarks/seed.py")
+        async with session.get(f"{base}/energypool/?limit=1000", headers={"Authorization": f"Bearer {tokens[0]}"}) as resp:
+            pool = [seller["grid_id"] for seller in await resp.json()]
+
+        results = {}
+        for name, make_request in workloads(base, tokens, args.users, pool).items():
+            if selected and name not in selected:
+                continue
+            before = await opcounters()
+            result = await run_workload(session, make_request, args.requests, args.concurrency)
+            after = await opcounters()
+            ops = {op: after[op] - before.get(op, 0) for op in after}
+            result["mongo_ops"] = ops
+            result["mongo_ops_per_request"] = sum(ops.values()) / max(result["requests"], 1)
+            results[name] = result
+            print(f"{name:<16} {result['throughput']:8.1f} req/s  p50={result['p50_ms']:7.1f}  "
+                  f"p95={result['p95_ms']:7.1f}  p99={result['p99_ms']:7.1f} ms  "
+                  f"errors={result['errors']}  mongo ops/req={result['mongo_ops_per_request']:.2f}")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(path, "w") as f:
+        json.dump({"args": vars(args), "workloads": results}, f, indent=2)
+    print(f"saved {path}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=10000, help="users seeded by seed.py")
+    parser.add_argument("--tokens", type=int, default=50, help="users to log in for authenticated workloads")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--workloads", nargs="*", default=None)
+    parser.add_argument("--compare", default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,109 @@
+"""Seed a database with synthetic users, grids and transactions.
+
+    MONGO_URI=mongodb://localhost:27017/?replicaSet=rs0 MONGO_DB=sorbet_bench \\
+        python benchmarks/seed.py --users 10000 --grids 5000 --transactions 2000000
+
+Point MONGO_URI at a local mongod (a single-node replica set, so purchases
+can use transactions). Every user gets the password "benchpass" and the
+email bench<N>@example.com; the password is hashed once and shared, so
+seeding doesn't spend minutes in bcrypt. Transactions are spread over the
+last --days days and written in insert_many batches, then the monthly
+rollups are rebuilt from them.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from database import db
+from indexes import ensure_indexes
+from passwords import pwd_context
+from backfill_monthly_energy import rebuild_monthly_energy
+from archive import archive_names
+
+BENCH_PASSWORD = "benchpass"
+BATCH_SIZE = 10000
+
+
+def bench_email(i):
+    return f"bench{i}@example.com"
+
+
+async def insert_batched(collection, docs):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= BATCH_SIZE:
+            await collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await collection.insert_many(batch, ordered=False)
+
+
+async def seed(args):
+    random.seed(args.seed)
+    if args.drop:
+        for name in ("users", "user_grid", "transactions", "monthly_energy", "counters",
+                     "transaction_periods", "archive_state", *await archive_names()):
+            await db[name].drop()
+    await ensure_indexes()
+
+    password = pwd_context.hash(BENCH_PASSWORD)
+    user_ids = [ObjectId() for _ in range(args.users)]
+    await insert_batched(db["users"], (
+        {"_id": uid, "name": f"Bench User {i}", "email": bench_email(i), "mobile": "0000000000", "password": password}
+        for i, uid in enumerate(user_ids)
+    ))
+
+    grid_ids = [ObjectId() for _ in range(args.grids)]
+
+    def grid(i, gid):
+        lat, lng = random.uniform(8.0, 13.0), random.uniform(74.5, 77.5)
+        return {
+            "_id": gid,
+            "grid name": f"Bench Grid {i}",
+            "user": user_ids[i % len(user_ids)],
+            "location": {"latitude": lat, "longitude": lng},
+            "geo": {"type": "Point", "coordinates": [lng, lat]},
+            "units": random.randint(0, 500),
+            "available": True,
+            "units_for_sell": random.choice([0, 0, random.randint(1, 10000)]),
+            "station": i % 4 == 0,
+            "ports": random.sample(["Type 2", "CCS2", "3-pin"], k=random.randint(1, 3)) if i % 4 == 0 else [],
+        }
+
+    await insert_batched(db["user_grid"], (grid(i, gid) for i, gid in enumerate(grid_ids)))
+
+    now = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    await insert_batched(db["transactions"], (
+        {
+            "buyer": random.choice(user_ids),
+            "grid": random.choice(grid_ids),
+            "units": random.randint(1, 50),
+            "time": now - timedelta(seconds=random.randint(0, args.days * 86400)),
+            "status": "completed",
+        }
+        for _ in range(args.transactions)
+    ))
+    print(f"inserted {args.transactions} transactions in {time.perf_counter() - start:.1f}s")
+    rollups = await rebuild_monthly_energy()
+    print(f"seeded users={args.users} grids={args.grids} rollups={rollups}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--grids", type=int, default=5000)
+    parser.add_argument("--transactions", type=int, default=1000000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--drop", action="store_true", help="drop the seeded collections first")
+    asyncio.run(seed(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""Requests/s for the GET /energypool/ listing with the snapshot cold and warm.
+
+    python benchmarks/sell_pool_cache.py --grids 5000 --requests 200
+
+Seeds listed grids into a scratch database (MONGO_DB, default
+sorbet_bench) and times the work the handler does per request:
+  cold - the version moved, so the snapshot is rebuilt from Mongo
+  warm - the snapshot is current, only the per-user view is filtered
+  304  - the client's ETag still matches, nothing is built at all
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("MONGO_DB", "sorbet_bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from database import db
+from sell_pool import sell_pool
+
+
+async def timed(label, requests, fn):
+    start = time.perf_counter()
+    for _ in range(requests):
+        await fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<5} {requests / elapsed:10.1f} req/s  {elapsed / requests * 1000:8.3f} ms/req")
+
+
+async def main(args):
+    grids, users = db["user_grid"], db["users"]
+    sellers = [ObjectId() for _ in range(max(1, args.grids // 10))]
+    await users.insert_many([{"_id": uid, "name": f"seller {i}"} for i, uid in enumerate(sellers)])
+    await grids.insert_many([
+        {"grid name": f"grid {i}", "user": sellers[i % len(sellers)], "units_for_sell": 1 + i % 50,
+         "location": {"latitude": 10.0, "longitude": 76.0}}
+        for i in range(args.grids)
+    ])
+    viewer = str(sellers[0])
+
+    async def cold():
+        sell_pool.version = None
+        version = await sell_pool.current_version()
+        await sell_pool.get(version)
+        sell_pool.view(viewer, args.limit)
+
+    async def warm():
+        version = await sell_pool.current_version()
+        await sell_pool.get(version)
+        sell_pool.view(viewer, args.limit)
+
+    async def not_modified():
+        await sell_pool.current_version()
+
+    try:
+        await sell_pool.bump()
+        print(f"grids={args.grids} limit={args.limit}")
+        await timed("cold", args.requests, cold)
+        await timed("warm", args.requests, warm)
+        await timed("304", args.requests, not_modified)
+        print(sell_pool.stats())
+    finally:
+        await grids.delete_many({"user": {"$in": sellers}})
+        await users.delete_many({"_id": {"$in": sellers}})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grids", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=None)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,84 @@
+"""Serialization time for a 10k-row response, before and after.
+
+    python benchmarks/serialization.py --rows 10000
+
+before: the old path - convert_id on every document, then FastAPI's
+        jsonable_encoder and JSONResponse (stdlib json)
+after:  the typed path - response model validation in pydantic-core, then
+        BSONJSONResponse (orjson)
+raw:    the untyped listing path - listing.list_documents returns the Mongo
+        page as BSONJSONResponse(page) itself, so neither a model nor
+        jsonable_encoder runs
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from models import GridOut
+from serialization import BSONJSONResponse
+
+
+def grid_docs(rows):
+    return [{
+        "_id": ObjectId(),
+        "grid name": f"Grid {i}",
+        "user": ObjectId(),
+        "location": {"latitude": 9.9 + i * 1e-5, "longitude": 76.2},
+        "units": i % 500,
+        "available": True,
+        "units_for_sell": i % 50,
+        "station": i % 4 == 0,
+        "ports": ["Type 2", "CCS2"] if i % 4 == 0 else [],
+        "last_reading_at": datetime.now(timezone.utc),
+    } for i in range(rows)]
+
+
+def convert_id(doc):
+    doc["_id"] = str(doc["_id"])
+    doc["user"] = str(doc["user"])
+    return doc
+
+
+def best_of(fn, make_input, repeat):
+    times = []
+    for _ in range(repeat):
+        data = make_input()
+        start = time.perf_counter()
+        body = fn(data)
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000, len(body)
+
+
+def before(docs):
+    return JSONResponse(jsonable_encoder([convert_id(doc) for doc in docs])).body
+
+
+grids_adapter = TypeAdapter(list[GridOut])
+
+
+def after(docs):
+    return BSONJSONResponse(grids_adapter.dump_python(grids_adapter.validate_python(docs), mode="json", by_alias=True)).body
+
+
+def raw(docs):
+    # What GET /grid/ and GET /user/ return; a plain `return docs` would go
+    # through jsonable_encoder first and fail on ObjectId
+    return BSONJSONResponse(docs).body
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for label, fn in (("before", before), ("after", after), ("raw", raw)):
+        ms, size = best_of(fn, lambda: grid_docs(args.rows), args.repeat)
+        print(f"{label:<7} {ms:8.1f} ms  {size / 1024:8.0f} KiB")
@@ -0,0 +1,75 @@
+"""Open many WebSocket subscribers and measure event fan-out.
+
+    python benchmarks/subscribers.py --token <jwt> --subscribers 2000 --trigger 20
+
+Connects --subscribers clients to /energypool/ws on a running backend. With
+--trigger N it then moves one unit into the caller's sell pool N times
+(POST /grid/sell_units) and reports how long it took each change to reach
+every subscriber. Without it, the clients just sit idle for --duration
+seconds so the server's memory per idle connection can be observed.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+
+
+async def subscriber(session, url, received, connected):
+    async with session.ws_connect(url, heartbeat=30) as ws:
+        connected.append(1)
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            now = time.perf_counter()
+            for event in msg.json():
+                if event.get("type") == "listing":
+                    received.append(now)
+
+
+async def main(args):
+    base = args.base_url.rstrip("/")
+    ws_url = base.replace("http", "ws", 1) + f"/energypool/ws?token={args.token}"
+    received, connected = [], []
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(subscriber(session, ws_url, received, connected))
+                 for _ in range(args.subscribers)]
+        while len(connected) < args.subscribers and time.perf_counter() - start < 60:
+            await asyncio.sleep(0.05)
+        print(f"connected {len(connected)}/{args.subscribers} in {time.perf_counter() - start:.2f}s")
+
+        if args.trigger:
+            fanout = []
+            headers = {"Authorization": f"Bearer {args.token}"}
+            for _ in range(args.trigger):
+                received.clear()
+                sent = time.perf_counter()
+                async with session.post(f"{base}/grid/sell_units", json={"units": 1}, headers=headers) as resp:
+                    await resp.read()
+                while len(received) < len(connected) and time.perf_counter() - sent < 10:
+                    await asyncio.sleep(0.005)
+                if received:
+                    fanout.append((max(received) - sent) * 1000)
+            print(f"fan-out to all subscribers ms: median={statistics.median(fanout):.1f} max={max(fanout):.1f}")
+        else:
+            await asyncio.sleep(args.duration)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        async with session.get(f"{base}/energypool/events/stats") as resp:
+            print(await resp.json())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--trigger", type=int, default=0)
+    parser.add_argument("--duration", type=float, default=30)
+    asyncio.run(main(parser.parse_args()))
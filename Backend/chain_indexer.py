@@ -0,0 +1,304 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pymongo import UpdateOne
+from web3 import Web3
+from database import db
+from background import BackgroundLoop
+
+
+POWERSHARE_RPC_URL = os.getenv("POWERSHARE_RPC_URL")
+POWERSHARE_CONTRACT_ADDRESS = os.getenv("POWERSHARE_CONTRACT_ADDRESS")
+POWERSHARE_START_BLOCK = int(os.getenv("POWERSHARE_START_BLOCK", "0"))
+INDEXER_BATCH_BLOCKS = int(os.getenv("INDEXER_BATCH_BLOCKS", "2000"))
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS", "2"))
+INDEXER_POLL_SECONDS = float(os.getenv("INDEXER_POLL_SECONDS", "5"))
+INDEXER_REORG_DEPTH = int(os.getenv("INDEXER_REORG_DEPTH", "64"))
+# The frontend records a purchase after the token transfer is mined; the
+# window is applied both ways to absorb clock skew between app and chain
+INDEXER_MATCH_WINDOW_SECONDS = int(os.getenv("INDEXER_MATCH_WINDOW_SECONDS", "600"))
+# Same as TOKEN_DECIMALS in the frontend: 1 unit = 1 token
+TOKEN_DECIMALS = 18
+
+User_Collection = db["users"]
+Transaction_Collection = db["transactions"]
+Event_Collection = db["chain_events"]
+Checkpoint_Collection = db["chain_checkpoints"]
+
+# The Transfer event of frontend/src/app/lib/PowerShareAbi.json; purchases
+# settle on chain as a token transfer from the buyer to the seller
+TRANSFER_EVENT_ABI = [{
+    "anonymous": False,
+    "name": "Transfer",
+    "type": "event",
+    "inputs": [
+        {"indexed": True, "name": "from", "type": "address"},
+        {"indexed": True, "name": "to", "type": "address"},
+        {"indexed": False, "name": "value", "type": "uint256"},
+    ],
+}]
+TRANSFER_TOPIC = Web3.to_hex(Web3.keccak(text="Transfer(address,address,uint256)"))
+
+
+def candidates_pipeline(buyers, start, end):
+    """Unsettled purchases of buyers between start and end, oldest first, with the seller of their grid."""
+    return [
+        {"$match": {
+            "buyer": {"$in": buyers},
+            "settlement": {"$exists": False},
+            "time": {"$gte": start, "$lte": end},
+        }},
+        {"$sort": {"time": 1, "_id": 1}},
+        {"$lookup": {
+            "from": "user_grid",
+            "localField": "grid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"_id": 0, "user": 1}}],
+            "as": "grid_doc",
+        }},
+        {"$project": {"buyer": 1, "units": 1, "time": 1, "seller": {"$first": "$grid_doc.user"}}},
+    ]
+
+
+class ChainIndexer(BackgroundLoop):
+    """Follows PowerShare Transfer events and settles the matching purchases.
+
+    Each step reads one range of up to INDEXER_BATCH_BLOCKS blocks, stopping
+    INDEXER_CONFIRMATIONS blocks behind the head, with a single eth_getLogs
+    call. Its events are upserted into chain_events and matched to unsettled
+    transactions by buyer wallet, seller wallet and units; the matches are
+    written with one bulk_write. The checkpoint in chain_checkpoints keeps
+    the last processed block and the hashes of the last INDEXER_REORG_DEPTH
+    range ends. When the chain no longer has the checkpoint's hash, the
+    indexer rolls back to the newest range end that is still canonical:
+    events above it are deleted and their settlements removed.
+
+    web3 calls are blocking, so they run in a worker thread. Any Web3
+    instance works, including one on EthereumTesterProvider.
+    """
+
+    def __init__(self, w3=None, address=None, start_block=None):
+        super().__init__()
+        self.w3 = w3
+        self.address = address or POWERSHARE_CONTRACT_ADDRESS
+        self.start_block = POWERSHARE_START_BLOCK if start_block is None else start_block
+        self.contract = None
+        self.batch_blocks = INDEXER_BATCH_BLOCKS
+        self.head = None
+        self.block = None
+        self.blocks = 0
+        self.events = 0
+        self.matched = 0
+        self.reorgs = 0
+        self.busy = 0.0
+
+    @property
+    def configured(self):
+        return self.address is not None and (self.w3 is not None or POWERSHARE_RPC_URL is not None)
+
+    def connect(self):
+        if self.w3 is None:
+            self.w3 = Web3(Web3.HTTPProvider(POWERSHARE_RPC_URL))
+        if self.contract is None:
+            self.address = Web3.to_checksum_address(self.address)
+            self.contract = self.w3.eth.contract(address=self.address, abi=TRANSFER_EVENT_ABI)
+
+    # Blocking chain reads, called through asyncio.to_thread
+
+    def block_hash(self, number):
+        return Web3.to_hex(self.w3.eth.get_block(number)["hash"])
+
+    def fetch(self, start, end):
+        logs = self.w3.eth.get_logs({
+            "address": self.address,
+            "fromBlock": start,
+            "toBlock": end,
+            "topics": [TRANSFER_TOPIC],
+        })
+        transfer = self.contract.events.Transfer()
+        block_times = {}
+        events = []
+        for log in logs:
+            event = transfer.process_log(log)
+            number = event["blockNumber"]
+            if number not in block_times:
+                block_times[number] = datetime.fromtimestamp(self.w3.eth.get_block(number)["timestamp"], timezone.utc)
+            events.append({
+                "_id": f"{Web3.to_hex(event['transactionHash'])}:{event['logIndex']}",
+                "block_number": number,
+                "block_hash": Web3.to_hex(event["blockHash"]),
+                "block_time": block_times[number],
+                "from": event["args"]["from"],
+                "to": event["args"]["to"],
+                "value": str(event["args"]["value"]),
+            })
+        return events, self.block_hash(end)
+
+    # Mongo side
+
+    async def load_checkpoint(self):
+        checkpoint = await Checkpoint_Collection.find_one({"_id": self.address})
+        if checkpoint is None:
+            checkpoint = {"_id": self.address, "block": self.start_block - 1, "hashes": []}
+        return checkpoint
+
+    async def find_fork(self, checkpoint):
+        """The newest checkpointed block still on the canonical chain, or None if the last one is."""
+        hashes = checkpoint["hashes"]
+        if not hashes or await asyncio.to_thread(self.block_hash, hashes[-1]["block"]) == hashes[-1]["hash"]:
+            return None
+        for checkpointed in reversed(hashes[:-1]):
+            if await asyncio.to_thread(self.block_hash, checkpointed["block"]) == checkpointed["hash"]:
+                return checkpointed["block"]
+        print(f"No checkpoint of {self.address} survived the reorg; reindexing from block {self.start_block}")
+        return self.start_block - 1
+
+    async def rollback(self, block):
+        self.reorgs += 1
+        await Event_Collection.delete_many({"contract": self.address, "block_number": {"$gt": block}})
+        await Transaction_Collection.update_many(
+            {"settlement.contract": self.address, "settlement.block_number": {"$gt": block}},
+            {"$unset": {"settlement": ""}},
+        )
+        await Checkpoint_Collection.update_one(
+            {"_id": self.address},
+            {"$set": {"block": block}, "$pull": {"hashes": {"block": {"$gt": block}}}},
+        )
+
+    async def users_by_wallet(self, addresses):
+        # Wallets are saved as the frontend sent them, checksummed or not
+        variants = set(addresses) | {a.lower() for a in addresses}
+        users = {}
+        async for user in User_Collection.find({"walletAddress": {"$in": list(variants)}}, {"walletAddress": 1}):
+            users[Web3.to_checksum_address(user["walletAddress"])] = user["_id"]
+        return users
+
+    async def reconcile(self, events):
+        """Pair new events with unsettled transactions; returns {event _id: transaction _id}."""
+        settled = set(await Event_Collection.distinct(
+            "_id", {"_id": {"$in": [e["_id"] for e in events]}, "transaction": {"$ne": None}}))
+        events = [e for e in events if e["_id"] not in settled]
+        if not events:
+            return {}
+        users = await self.users_by_wallet({e["from"] for e in events} | {e["to"] for e in events})
+        buyers = list({users[e["from"]] for e in events if e["from"] in users})
+        if not buyers:
+            return {}
+        window = timedelta(seconds=INDEXER_MATCH_WINDOW_SECONDS)
+        candidates = await Transaction_Collection.aggregate(candidates_pipeline(
+            buyers,
+            min(e["block_time"] for e in events) - window,
+            max(e["block_time"] for e in events) + window,
+        )).to_list(length=None)
+        queues = {}
+        for tx in candidates:
+            tx_time = tx["time"]
+            if tx_time.tzinfo is None:
+                tx_time = tx_time.replace(tzinfo=timezone.utc)
+            queues.setdefault((tx["buyer"], tx.get("seller"), tx["units"]), []).append((tx_time, tx["_id"]))
+        scale = 10 ** TOKEN_DECIMALS
+        matches = {}
+        for event in events:
+            units, remainder = divmod(int(event["value"]), scale)
+            queue = queues.get((users.get(event["from"]), users.get(event["to"]), units))
+            if remainder or not queue:
+                continue
+            # The oldest purchase recorded around the time this transfer was mined
+            for i, (tx_time, tx_id) in enumerate(queue):
+                if abs(tx_time - event["block_time"]) <= window:
+                    matches[event["_id"]] = tx_id
+                    del queue[i]
+                    break
+        return matches
+
+    async def apply(self, events, end, end_hash):
+        matches = await self.reconcile(events) if events else {}
+        if events:
+            await Event_Collection.bulk_write([
+                # A replayed range must not clear a match made the first time round
+                UpdateOne(
+                    {"_id": e["_id"]},
+                    {"$set": {**e, "contract": self.address, "transaction": matches[e["_id"]]}}
+                    if e["_id"] in matches else
+                    {"$set": {**e, "contract": self.address}, "$setOnInsert": {"transaction": None}},
+                    upsert=True,
+                )
+                for e in events
+            ], ordered=False)
+        by_id = {e["_id"]: e for e in events}
+        if matches:
+            await Transaction_Collection.bulk_write([
+                UpdateOne(
+                    {"_id": tx_id, "settlement": {"$exists": False}},
+                    {"$set": {"settlement": {
+                        "contract": self.address,
+                        "event": event_id,
+                        "block_number": by_id[event_id]["block_number"],
+                        "block_hash": by_id[event_id]["block_hash"],
+                    }}},
+                )
+                for event_id, tx_id in matches.items()
+            ], ordered=False)
+        # Written last: a crash before this replays the range, and the writes above are idempotent
+        await Checkpoint_Collection.update_one(
+            {"_id": self.address},
+            {
+                "$set": {"block": end},
+                "$push": {"hashes": {"$each": [{"block": end, "hash": end_hash}], "$slice": -INDEXER_REORG_DEPTH}},
+            },
+            upsert=True,
+        )
+        return len(matches)
+
+    async def step(self):
+        """Process one block range; returns True once caught up with the confirmed head."""
+        self.connect()
+        checkpoint = await self.load_checkpoint()
+        fork = await self.find_fork(checkpoint)
+        if fork is not None:
+            print(f"Chain reorg below block {checkpoint['block']}; rolling back to {fork}")
+            await self.rollback(fork)
+            checkpoint = await self.load_checkpoint()
+        self.block = checkpoint["block"]
+        self.head = await asyncio.to_thread(lambda: self.w3.eth.block_number)
+        start, safe = checkpoint["block"] + 1, self.head - INDEXER_CONFIRMATIONS
+        if start > safe:
+            return True
+        end = min(start + self.batch_blocks - 1, safe)
+        started = time.perf_counter()
+        try:
+            events, end_hash = await asyncio.to_thread(self.fetch, start, end)
+        except Exception:
+            # Usually a provider limit on log results; retry with a smaller range
+            self.batch_blocks = max(1, self.batch_blocks // 2)
+            raise
+        matched = await self.apply(events, end, end_hash)
+        self.busy += time.perf_counter() - started
+        self.batch_blocks = min(self.batch_blocks * 2, INDEXER_BATCH_BLOCKS)
+        self.block = end
+        self.blocks += end - start + 1
+        self.events += len(events)
+        self.matched += matched
+        return end >= safe
+
+    async def run_once(self):
+        if await self.step():
+            await asyncio.sleep(INDEXER_POLL_SECONDS)
+
+    def stats(self):
+        return {
+            "running": self.task is not None,
+            "block": self.block,
+            "head": self.head,
+            "lag": self.head - self.block if self.head is not None and self.block is not None else None,
+            "blocks": self.blocks,
+            "events": self.events,
+            "matched": self.matched,
+            "reorgs": self.reorgs,
+            "blocks_per_second": self.blocks / self.busy if self.busy else 0.0,
+            "events_per_second": self.events / self.busy if self.busy else 0.0,
+        }
+
+
+chain_indexer = ChainIndexer()
@@ -1,23 +1,132 @@
 import os
-from pymongo.mongo_client import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
+from metrics import command_metrics
 
 
 load_dotenv()
 
 uri = os.getenv("MONGO_URI")
+DB_NAME = os.getenv("MONGO_DB", "sorbet")
 
+CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_MS", "60000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+}
 
-client = MongoClient(uri, server_api=ServerApi('1'))
 
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters reported by the /ready endpoint."""
 
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failed = 0
 
-db = client["sorbet"]
+    def stats(self):
+        return {
+            "open": self.created - self.closed,
+            "in_use": self.checked_out,
+            "created": self.created,
+            "closed": self.closed,
+            "checkout_failed": self.checkout_failed,
+            "max_pool_size": CLIENT_OPTIONS["maxPoolSize"],
+        }
 
+    def connection_created(self, event):
+        self.created += 1
 
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failed += 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+
+pool_stats = PoolStats()
+
+client = None
+
+
+def connect():
+    """Create the client if there is none yet; no I/O happens until the first query."""
+    global client
+    if client is None:
+        client = AsyncIOMotorClient(
+            uri,
+            server_api=ServerApi('1'),
+            event_listeners=[pool_stats, command_metrics],
+            **CLIENT_OPTIONS,
+        )
+    return client
+
+
+def use_client(new_client):
+    """Swap in another client, e.g. an in-process stand-in such as
+    mongomock_motor.AsyncMongoMockClient() for tests."""
+    global client
+    close()
+    client = new_client
+
+
+def close():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+
+def get_db():
+    return connect()[DB_NAME]
+
+
+class LazyCollection:
+    """Collection handle that resolves against the current client on each use,
+    so routers can keep module-level handles while the client lives in the lifespan."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_db()[self.name], attr)
+
+
+class LazyDatabase:
+    def __getitem__(self, name):
+        return LazyCollection(name)
+
+    def __getattr__(self, attr):
+        return getattr(get_db(), attr)
+
+
+db = LazyDatabase()
+
+
+async def ping():
+    try:
+        await connect().admin.command('ping')
+        return True
+    except Exception as e:
+        print(e)
+        return False
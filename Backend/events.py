@@ -0,0 +1,207 @@
+import os
+import asyncio
+from collections import OrderedDict
+from database import db
+from background import BackgroundLoop
+
+
+SUBSCRIBER_MAX_PENDING = int(os.getenv("SUBSCRIBER_MAX_PENDING", "1000"))
+SUBSCRIBER_COALESCE_MS = int(os.getenv("SUBSCRIBER_COALESCE_MS", "50"))
+GRID_OWNER_CACHE_SIZE = int(os.getenv("GRID_OWNER_CACHE_SIZE", "10000"))
+
+Grid_Collection = db["user_grid"]
+
+LISTING_FIELDS = {"grid name", "location", "geo", "units_for_sell", "user"}
+
+
+def listing_event(grid):
+    return {
+        "type": "listing",
+        "grid_id": str(grid["_id"]),
+        "grid_name": grid.get("grid name"),
+        "location": grid.get("location"),
+        "units_for_sell": grid.get("units_for_sell", 0),
+        "user": str(grid.get("user")),
+    }
+
+
+def my_grid_event(grid):
+    return {
+        "type": "my_grid",
+        "grid_id": str(grid["_id"]),
+        "units": grid.get("units", 0),
+        "units_for_sell": grid.get("units_for_sell", 0),
+        "station": grid.get("station", False),
+        "ports": grid.get("ports", []),
+    }
+
+
+def units_sold_event(tx):
+    return {
+        "type": "units_sold",
+        "transaction_id": str(tx["_id"]),
+        "grid_id": str(tx["grid"]),
+        "units": tx.get("units", 0),
+    }
+
+
+class Subscriber:
+    """One connected client.
+
+    Pending events are coalesced by key (a grid's newer state replaces its
+    older one), so a burst costs one message per grid. If the client falls
+    so far behind that more than SUBSCRIBER_MAX_PENDING keys pile up, they
+    are dropped for a single resync event telling it to refetch over REST.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.pending = {}
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def push(self, key, event):
+        if "resync" in self.pending:
+            return
+        self.pending[key] = event
+        if len(self.pending) > SUBSCRIBER_MAX_PENDING:
+            self.dropped += len(self.pending)
+            self.pending = {"resync": {"type": "resync"}}
+        self.ready.set()
+
+    async def next_batch(self, timeout=None):
+        """Wait for events and return them as a list; an empty list on timeout."""
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+        # Let the rest of a burst arrive and coalesce before sending
+        await asyncio.sleep(SUBSCRIBER_COALESCE_MS / 1000)
+        batch, self.pending = list(self.pending.values()), {}
+        self.ready.clear()
+        return batch
+
+
+class EventHub(BackgroundLoop):
+    """Tails a change stream on the database and fans events out to subscribers.
+
+    One watcher task per worker serves every connection, so idle clients cost
+    only their Subscriber object; events written by any worker arrive through
+    Mongo. In-process caches that follow the database register as listeners
+    instead of opening a change stream of their own.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.subscribers = set()
+        self.by_user = {}
+        self.listeners = []
+        self.resume_token = None
+        self.events = 0
+        # Grid owners for transactions written before they carried their seller
+        self.grid_owners = OrderedDict()
+        self.owner_lookups = 0
+
+    def add_listener(self, listener):
+        """Hand listener every change matching its listener.changes filters.
+
+        listener.handle_change(change) is awaited for each of them, and
+        listener.load() after the stream's history was lost, to rebuild
+        from scratch. Register before start().
+        """
+        self.listeners.append(listener)
+
+    def subscribe(self, user_id):
+        sub = Subscriber(user_id)
+        self.subscribers.add(sub)
+        self.by_user.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+        owners = self.by_user.get(sub.user_id)
+        if owners is not None:
+            owners.discard(sub)
+            if not owners:
+                del self.by_user[sub.user_id]
+
+    def publish(self, key, event, user_id=None):
+        """Queue an event for everyone, or only for user_id's connections."""
+        self.events += 1
+        targets = self.subscribers if user_id is None else self.by_user.get(user_id, ())
+        for sub in targets:
+            sub.push(key, event)
+
+    def remember_owner(self, grid_id, owner):
+        self.grid_owners[grid_id] = owner
+        self.grid_owners.move_to_end(grid_id)
+        if len(self.grid_owners) > GRID_OWNER_CACHE_SIZE:
+            self.grid_owners.popitem(last=False)
+
+    async def seller_of(self, transaction):
+        if "seller" in transaction:
+            return transaction["seller"]
+        grid_id = transaction.get("grid")
+        if grid_id not in self.grid_owners:
+            self.owner_lookups += 1
+            grid = await Grid_Collection.find_one({"_id": grid_id}, {"user": 1})
+            if not grid:
+                return None
+            self.remember_owner(grid_id, grid.get("user"))
+        self.grid_owners.move_to_end(grid_id)
+        return self.grid_owners[grid_id]
+
+    async def handle_change(self, change):
+        for listener in self.listeners:
+            await listener.handle_change(change)
+        doc = change.get("fullDocument")
+        if not doc or change["ns"]["coll"] not in ("user_grid", "transactions"):
+            return
+        if change["ns"]["coll"] == "user_grid":
+            grid_id = str(doc["_id"])
+            self.remember_owner(doc["_id"], doc.get("user"))
+            updated = change.get("updateDescription", {}).get("updatedFields")
+            # Meter readings only move units; don't broadcast those to everyone
+            if updated is None or LISTING_FIELDS.intersection(updated):
+                self.publish(("listing", grid_id), listing_event(doc))
+            self.publish(("my_grid", grid_id), my_grid_event(doc), user_id=doc.get("user"))
+        elif change["ns"]["coll"] == "transactions":
+            seller = await self.seller_of(doc)
+            if seller:
+                self.publish(("units_sold", str(doc["_id"])), units_sold_event(doc), user_id=seller)
+
+    def pipeline(self):
+        changes = [{
+            "ns.coll": {"$in": ["user_grid", "transactions"]},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }]
+        for listener in self.listeners:
+            changes += listener.changes
+        return [{"$match": {"$or": changes}}]
+
+    async def run_once(self):
+        # Change streams need a replica set; a standalone server fails here and is retried
+        async with db.watch(self.pipeline(), full_document="updateLookup", resume_after=self.resume_token) as stream:
+            self.retry_delay = 1
+            async for change in stream:
+                await self.handle_change(change)
+                self.resume_token = stream.resume_token
+
+    async def failed(self, error):
+        if getattr(error, "code", None) == 286:  # ChangeStreamHistoryLost
+            self.resume_token = None
+            for listener in self.listeners:
+                await listener.load()
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "users": len(self.by_user),
+            "events": self.events,
+            "grid_owners": len(self.grid_owners),
+            "owner_lookups": self.owner_lookups,
+            "dropped": sum(sub.dropped for sub in self.subscribers),
+        }
+
+
+hub = EventHub()
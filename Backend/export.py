@@ -0,0 +1,134 @@
+import os
+import io
+import csv
+import math
+import orjson
+from auth import TTLCache
+from database import db
+from history import as_ist, ist_isoformat
+from archive import sources
+
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_NAME_CACHE_SIZE = int(os.getenv("EXPORT_NAME_CACHE_SIZE", "10000"))
+
+Grid_Collection = db["user_grid"]
+User_Collection = db["users"]
+
+EXPORT_COLUMNS = (
+    "transaction_id", "time", "role", "buyer_id", "buyer_name", "grid_id", "grid_name",
+    "seller_id", "seller_name", "units", "price", "status",
+)
+
+
+class NameLookup:
+    """Grid and user names for one export, fetched once per chunk with $in.
+
+    Both caches are LRU-bounded to EXPORT_NAME_CACHE_SIZE entries, so a
+    long export keeps its hot names without holding every name it has seen.
+    """
+
+    def __init__(self, size=EXPORT_NAME_CACHE_SIZE):
+        self.grids = TTLCache(size)
+        self.users = TTLCache(size)
+        self.queries = 0
+
+    async def fill(self, cache, collection, ids, projection):
+        missing = [i for i in ids if i is not None and cache.get(i) is None]
+        if not missing:
+            return
+        self.queries += 1
+        found = {doc["_id"]: doc async for doc in collection.find({"_id": {"$in": missing}}, projection)}
+        for i in missing:
+            # Remember deleted ones too, as an empty doc, so they aren't looked up again
+            cache.set(i, found.get(i, {}), math.inf)
+
+    async def resolve(self, transactions):
+        await self.fill(self.grids, Grid_Collection, {tx.get("grid") for tx in transactions}, {"grid name": 1, "user": 1})
+        sellers = {(self.grids.get(tx.get("grid")) or {}).get("user") for tx in transactions}
+        buyers = {tx.get("buyer") for tx in transactions}
+        await self.fill(self.users, User_Collection, buyers | sellers, {"name": 1})
+
+
+def export_query(match=None, start=None, end=None):
+    """match narrowed to [start, end); naive datetimes are taken as IST, like the rest of the app."""
+    time_range = {}
+    if start is not None:
+        time_range["$gte"] = as_ist(start)
+    if end is not None:
+        time_range["$lt"] = as_ist(end)
+    query = dict(match or {})
+    if time_range:
+        query = {"$and": [query, {"time": time_range}]} if query else {"time": time_range}
+    return query
+
+
+def export_row(tx, lookup, user_id=None):
+    grid = lookup.grids.get(tx.get("grid")) or {}
+    seller = grid.get("user")
+    role = None
+    if user_id is not None:
+        # Same rule as the transaction history: buying from an own grid counts as bought
+        role = "bought" if tx.get("buyer") == user_id else "sold"
+    return {
+        "transaction_id": str(tx["_id"]),
+        "time": ist_isoformat(tx.get("time")),
+        "role": role,
+        "buyer_id": str(tx["buyer"]) if tx.get("buyer") else None,
+        "buyer_name": (lookup.users.get(tx.get("buyer")) or {}).get("name"),
+        "grid_id": str(tx["grid"]) if tx.get("grid") else None,
+        "grid_name": grid.get("grid name"),
+        "seller_id": str(seller) if seller else None,
+        "seller_name": (lookup.users.get(seller) or {}).get("name"),
+        "units": tx.get("units", 0),
+        "price": tx.get("price"),
+        "status": tx.get("status"),
+    }
+
+
+def encode_csv(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+    if header:
+        writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def encode_ndjson(rows, header=False):
+    return b"".join(orjson.dumps(row) + b"\n" for row in rows)
+
+
+ENCODERS = {
+    "csv": (encode_csv, "text/csv"),
+    "ndjson": (encode_ndjson, "application/x-ndjson"),
+}
+
+
+async def export_chunks(match, format, start=None, end=None, user_id=None, lookup=None):
+    """Encoded chunks of the transactions matching match in [start, end), oldest first.
+
+    Archived months are read from their archive collections, then the hot
+    set. Each chunk is one cursor batch of EXPORT_BATCH_SIZE transactions
+    with its names resolved in at most two queries, so memory stays at one
+    batch whatever the export size.
+    """
+    encode = ENCODERS[format][0]
+    lookup = lookup or NameLookup()
+    start, end = (as_ist(start) if start else None), (as_ist(end) if end else None)
+    first = True
+    for collection, since in await sources(start, end):
+        if since is not None and (start is None or since > start):
+            query = export_query(match, since, end)
+        else:
+            query = export_query(match, start, end)
+        cursor = collection.find(query).sort("time", 1).batch_size(EXPORT_BATCH_SIZE)
+        while True:
+            batch = await cursor.to_list(length=EXPORT_BATCH_SIZE)
+            if not batch:
+                break
+            await lookup.resolve(batch)
+            yield encode([export_row(tx, lookup, user_id) for tx in batch], header=first)
+            first = False
+    if first and format == "csv":
+        yield encode([], header=True)
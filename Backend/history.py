@@ -0,0 +1,104 @@
+from datetime import timezone
+from pymongo import UpdateOne
+import pytz
+
+
+IST = pytz.timezone('Asia/Kolkata')
+
+
+def as_ist(dt):
+    """A datetime from a query parameter; naive ones are taken as IST."""
+    return dt if dt.tzinfo else IST.localize(dt)
+
+
+def history_match(user_id, grid_ids, since=None):
+    # Bought and sold transactions form one stream; a purchase from an own grid counts as bought
+    match = {"$or": [{"buyer": user_id}, {"grid": {"$in": grid_ids}}]}
+    if since is not None:
+        match["time"] = {"$gte": since}
+    return match
+
+
+def totals_pipeline(user_id, grid_ids, since=None):
+    is_buyer = {"$eq": ["$buyer", user_id]}
+    return [
+        {"$match": history_match(user_id, grid_ids, since)},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "bought": {"$sum": {"$cond": [is_buyer, "$units", 0]}},
+            "sold": {"$sum": {"$cond": [is_buyer, 0, "$units"]}},
+        }},
+    ]
+
+
+def page_pipeline(user_id, grid_ids, limit=None, before_key=None, since=None):
+    """Newest first, with grid and buyer names resolved in the same round trip."""
+    match = history_match(user_id, grid_ids, since)
+    if before_key is not None:
+        before_time, before_id = before_key
+        match = {"$and": [match, {"$or": [
+            {"time": {"$lt": before_time}},
+            {"time": before_time, "_id": {"$lt": before_id}},
+        ]}]}
+    pipeline = [{"$match": match}, {"$sort": {"time": -1, "_id": -1}}]
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$lookup": {
+            "from": "user_grid",
+            "localField": "grid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"_id": 0, "grid name": 1}}],
+            "as": "grid_doc",
+        }},
+        {"$lookup": {
+            "from": "users",
+            "localField": "buyer",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"_id": 0, "name": 1}}],
+            "as": "buyer_doc",
+        }},
+        {"$project": {
+            "time": 1,
+            "units": {"$ifNull": ["$units", 0]},
+            "status": 1,
+            "grid_name": {"$first": "$grid_doc.grid name"},
+            "user_name": {"$first": "$buyer_doc.name"},
+            "role": {"$cond": [{"$eq": ["$buyer", user_id]}, "bought", "sold"]},
+        }},
+    ]
+    return pipeline
+
+
+def ist_isoformat(tx_time):
+    """A stored transaction time (naive UTC as read back from Mongo) as an IST ISO string."""
+    if not tx_time:
+        return None
+    if tx_time.tzinfo is None:
+        tx_time = tx_time.replace(tzinfo=timezone.utc)
+    return tx_time.astimezone(IST).isoformat()
+
+
+def format_transaction(tx):
+    """One history row as the frontend expects it, with the time in IST."""
+    time_str = ist_isoformat(tx.get("time"))
+    return {
+        "transaction_id": str(tx["_id"]),
+        "user_name": tx.get("user_name"),
+        "grid_name": tx.get("grid_name"),
+        "units": tx["units"],
+        "time": time_str,
+        "status": tx.get("status"),
+        "role": tx["role"]
+    }
+
+
+def monthly_energy_updates(buyer_id, seller_id, units, tx_time):
+    tx_time_ist = tx_time.astimezone(IST)
+    bucket = {"year": tx_time_ist.year, "month": tx_time_ist.month}
+    updates = [UpdateOne({"user": buyer_id, **bucket}, {"$inc": {"bought": units, "sold": 0}}, upsert=True)]
+    # Buying from an own grid counts as bought only, same as the transaction history
+    if seller_id and seller_id != buyer_id:
+        updates.append(UpdateOne({"user": seller_id, **bucket}, {"$inc": {"bought": 0, "sold": units}}, upsert=True))
+    return updates
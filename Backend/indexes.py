@@ -0,0 +1,69 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING, GEOSPHERE
+from database import db
+from meter_readings import ensure_reading_collection
+
+
+# Every index the routers rely on, created idempotently at startup
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("walletAddress", ASCENDING)], name="wallet_address", sparse=True),
+    ],
+    "user_grid": [
+        IndexModel([("user", ASCENDING)], name="user"),
+        IndexModel(
+            [("units_for_sell", ASCENDING)],
+            name="units_for_sell_listed",
+            partialFilterExpression={"units_for_sell": {"$gt": 0}},
+        ),
+        IndexModel([("geo", GEOSPHERE)], name="geo_2dsphere"),
+        # Loads the charging-station index at startup
+        IndexModel([("station", ASCENDING)], name="station", partialFilterExpression={"station": True}),
+    ],
+    "transactions": [
+        IndexModel([("buyer", ASCENDING), ("time", DESCENDING)], name="buyer_time"),
+        IndexModel([("grid", ASCENDING), ("time", DESCENDING)], name="grid_time"),
+        # Admin exports scan a time range across all users
+        IndexModel([("time", ASCENDING)], name="time"),
+        IndexModel(
+            [("settlement.contract", ASCENDING), ("settlement.block_number", ASCENDING)],
+            name="settlement_block",
+            partialFilterExpression={"settlement": {"$exists": True}},
+        ),
+    ],
+    "monthly_energy": [
+        IndexModel(
+            [("user", ASCENDING), ("year", ASCENDING), ("month", ASCENDING)],
+            name="user_year_month_unique",
+            unique=True,
+        ),
+    ],
+    "transaction_periods": [
+        # $merge from the archiver matches on these, so they must be unique
+        IndexModel([("user", ASCENDING), ("period", ASCENDING)], name="user_period_unique", unique=True),
+    ],
+    "dashboard_summary": [
+        # Summaries are read by _id; meter flushes find them by grid
+        IndexModel([("grid_id", ASCENDING)], name="grid_id"),
+    ],
+    "orders": [
+        # Open orders in arrival order rebuild the book at startup
+        IndexModel([("status", ASCENDING), ("time", ASCENDING), ("_id", ASCENDING)], name="status_time"),
+        IndexModel([("user", ASCENDING), ("status", ASCENDING), ("time", DESCENDING)], name="user_status_time"),
+    ],
+    "port_holds": [
+        # _id is (grid, port); expired holds free the port before this removes them
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+        IndexModel([("hold", ASCENDING)], name="hold"),
+        IndexModel([("user", ASCENDING), ("expires_at", ASCENDING)], name="user_expires_at"),
+    ],
+    "chain_events": [
+        IndexModel([("contract", ASCENDING), ("block_number", ASCENDING)], name="contract_block"),
+    ],
+}
+
+
+async def ensure_indexes():
+    await ensure_reading_collection()
+    for collection_name, models in INDEXES.items():
+        await db[collection_name].create_indexes(models)
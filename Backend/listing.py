@@ -0,0 +1,59 @@
+import orjson
+from bson import ObjectId
+from fastapi import HTTPException, status
+from fastapi.responses import StreamingResponse
+from serialization import bson_default, BSONJSONResponse
+
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def parse_fields(fields, allowed):
+    """Turn a comma separated fields= value into a Mongo projection."""
+    if not fields:
+        return {name: 1 for name in allowed}
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(unknown)}"
+        )
+    return {name: 1 for name in requested}
+
+
+async def list_documents(collection, limit, cursor, fields, format, allowed):
+    """Keyset-paginated listing on _id with a sparse projection.
+
+    format="ndjson" streams one document per line straight from the cursor,
+    so exporting the whole collection runs in constant memory; limit is
+    optional there. Otherwise a JSON page of limit (default
+    DEFAULT_PAGE_SIZE) documents is returned with the next cursor in the
+    X-Next-Cursor header. Both are Response objects, so FastAPI's
+    jsonable_encoder (which cannot encode ObjectId) never sees the documents.
+    """
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    query = {"_id": {"$gt": ObjectId(cursor)}} if cursor else {}
+    projection = parse_fields(fields, allowed)
+    docs = collection.find(query, projection).sort("_id", 1)
+
+    if format == "ndjson":
+        if limit is not None:
+            docs = docs.limit(limit)
+
+        async def stream():
+            async for doc in docs.batch_size(500):
+                yield orjson.dumps(doc, default=bson_default) + b"\n"
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    limit = limit or DEFAULT_PAGE_SIZE
+    page = await docs.limit(limit).to_list(length=limit)
+    headers = {}
+    if len(page) == limit:
+        headers["X-Next-Cursor"] = str(page[-1]["_id"])
+    return BSONJSONResponse(page, headers=headers)
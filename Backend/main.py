@@ -1,8 +1,59 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import Users, Grids, Energypool
+from fastapi.middleware.gzip import GZipMiddleware
+from database import connect, close, ping, pool_stats
+from background import StartupStep
+from indexes import ensure_indexes
+from events import hub
+from meter_readings import meter_buffer
+from chain_indexer import chain_indexer
+from order_book import order_book, fill_writer
+from archive import archiver
+from stations import port_index
+from metrics import MetricsMiddleware, sampled, render
+from auth import auth_cache_stats
+from admission import admission_stats
+from passwords import password_pool
+from sell_pool import sell_pool
+from serialization import BSONJSONResponse
+from routers import Users, Grids, Energypool, Dashboard, Orders, Stations
 
-app = FastAPI()
+
+startup_steps = [
+    StartupStep("ensure_indexes", ensure_indexes),
+    StartupStep("order_book.load", order_book.load),
+    StartupStep("port_index.load", port_index.load),
+]
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect()
+    # Each step is retried on its own, so a failed index build doesn't leave
+    # the order book empty; /ready reports 503 until all of them succeeded
+    for step in startup_steps:
+        await step.first()
+    hub.add_listener(port_index)
+    hub.start()
+    meter_buffer.start()
+    fill_writer.start()
+    # Only runs when POWERSHARE_RPC_URL and POWERSHARE_CONTRACT_ADDRESS are set
+    chain_indexer.start()
+    # Only runs when ARCHIVE_AFTER_DAYS is set
+    archiver.start()
+    yield
+    await archiver.stop()
+    await chain_indexer.stop()
+    await fill_writer.stop()
+    await meter_buffer.stop()
+    await hub.stop()
+    for step in startup_steps:
+        await step.stop()
+    close()
+
+app = FastAPI(lifespan=lifespan, default_response_class=BSONJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -10,13 +61,80 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods (GET, POST, PUT, DELETE, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# Large listings and histories compress well; small responses aren't worth it
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Outermost, so the timings include CORS handling and compression
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(Users.router)
 app.include_router(Grids.router)
 app.include_router(Energypool.router)
+app.include_router(Dashboard.router)
+app.include_router(Orders.router)
+app.include_router(Stations.router)
 
 @app.get("/")
 async def root():
     return {"message" : "Hello from the backend"}
 
+@app.get("/ready")
+async def ready(response: Response):
+    ok = await ping()
+    pending = [step.name for step in startup_steps if not step.done]
+    if not ok or pending:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ok and not pending, "startup_pending": pending, "pool": pool_stats.stats()}
+
+@app.get("/admission")
+async def admission():
+    """Concurrency, queue and rate limiter state of each write route group."""
+    return admission_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text format; besides the request and Mongo metrics, reads each component's stats()."""
+    auth = auth_cache_stats()
+    pool = pool_stats.stats()
+    passwords = password_pool.stats()
+    groups = admission_stats()
+    extra = [
+        sampled("auth_cache_hits_total", "Auth cache hits.",
+                {(name,): cache["hits"] for name, cache in auth.items()}, "counter", ("cache",)),
+        sampled("auth_cache_misses_total", "Auth cache misses.",
+                {(name,): cache["misses"] for name, cache in auth.items()}, "counter", ("cache",)),
+        sampled("sell_pool_cache_hits_total", "Sell pool snapshot hits.", sell_pool.hits, "counter"),
+        sampled("sell_pool_cache_misses_total", "Sell pool snapshot rebuilds.", sell_pool.misses, "counter"),
+        sampled("sell_pool_not_modified_total", "Sell pool 304 responses.", sell_pool.not_modified, "counter"),
+        sampled("event_subscribers", "Connected event subscribers.", len(hub.subscribers)),
+        sampled("meter_readings_buffered", "Meter readings waiting for group commit.", len(meter_buffer.readings)),
+        sampled("meter_readings_flushed_total", "Meter readings committed.", meter_buffer.flushed, "counter"),
+        sampled("order_book_resting_orders", "Orders resting on the book.", len(order_book.orders)),
+        sampled("order_book_fills_total", "Order book fills.", order_book.fills, "counter"),
+        sampled("order_book_fills_pending", "Fills waiting for group commit.", len(fill_writer.fills)),
+        sampled("chain_indexer_blocks_total", "Blocks scanned for PowerShare events.", chain_indexer.blocks, "counter"),
+        sampled("chain_indexer_events_total", "PowerShare events indexed.", chain_indexer.events, "counter"),
+        sampled("chain_indexer_matched_total", "PowerShare events settled against a transaction.", chain_indexer.matched, "counter"),
+        sampled("chain_indexer_reorgs_total", "Chain reorgs rolled back.", chain_indexer.reorgs, "counter"),
+        sampled("port_index_stations", "Charging stations in the port index.", len(port_index.stations)),
+        sampled("port_holds_total", "Ports reserved.", port_index.reserved, "counter"),
+        sampled("port_hold_conflicts_total", "Reservations that lost a port to another worker.", port_index.conflicts, "counter"),
+        sampled("archive_transactions_copied_total", "Transactions copied into archive collections.", archiver.copied, "counter"),
+        sampled("archive_transactions_deleted_total", "Archived transactions deleted from the hot set.", archiver.deleted, "counter"),
+        sampled("admission_in_flight", "Requests holding an admission slot.",
+                {(name,): group["in_flight"] for name, group in groups.items()}, labels=("group",)),
+        sampled("admission_queued", "Requests waiting for an admission slot.",
+                {(name,): group["queued"] for name, group in groups.items()}, labels=("group",)),
+        sampled("admission_rejected_total", "Requests shed by admission control.",
+                {(name, reason): group[reason] for name, group in groups.items()
+                 for reason in ("rate_limited", "queue_full", "timed_out")},
+                "counter", ("group", "reason")),
+        sampled("password_pool_pending", "Password hash calls running or queued.", passwords["pending"]),
+        sampled("password_pool_rejected_total", "Password hash calls rejected as saturated.", passwords["rejected"], "counter"),
+        sampled("mongo_pool_connections_open", "Open Mongo connections.", pool["open"]),
+        sampled("mongo_pool_connections_in_use", "Checked out Mongo connections.", pool["in_use"]),
+    ]
+    return render(extra)
@@ -0,0 +1,188 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+from pymongo import monitoring
+
+
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "20"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self.series.items()]
+        for label_values, counts, total, count in items:
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.series.items())
+        for label_values, value in items:
+            lines.append(f"{self.name}{{{format_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def sampled(name, help, value, kind="gauge", labels=()):
+    """Lines for a value read from some component's stats(); value may be a
+    number, or a dict of label values -> number when labels are given."""
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    if not labels:
+        return lines + [f"{name} {value}"]
+    for label_values, sample in value.items():
+        lines.append(f"{name}{{{format_labels(labels, label_values)}}} {sample}")
+    return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "route"))
+http_requests = Counter(
+    "http_requests_total", "Requests by route and status.", ("method", "route", "status"))
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Mongo command latency by command and route.", ("command", "route"))
+mongo_command_failures = Counter(
+    "mongo_command_failures_total", "Failed Mongo commands by command and route.", ("command", "route"))
+mongo_commands_per_request = Histogram(
+    "mongo_commands_per_request", "Mongo commands issued by one request.", ("route",), COUNT_BUCKETS)
+n_plus_one_requests = Counter(
+    "n_plus_one_requests_total", f"Requests issuing more than {N_PLUS_ONE_THRESHOLD} Mongo commands.", ("route",))
+
+REGISTRY = [
+    http_request_duration, http_requests,
+    mongo_command_duration, mongo_command_failures,
+    mongo_commands_per_request, n_plus_one_requests,
+]
+
+
+class RequestStats:
+    __slots__ = ("scope", "commands")
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.commands = 0
+
+    @property
+    def route(self):
+        # The router stores the matched route in the shared scope before calling the endpoint
+        route = self.scope.get("route")
+        return route.path if route is not None else "unmatched"
+
+
+# Motor copies the context into its executor threads, so the command
+# listener sees the stats object of the request that issued the command
+current_request = ContextVar("current_request", default=None)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event, failed=False)
+
+    def failed(self, event):
+        self.record(event, failed=True)
+
+    def record(self, event, failed):
+        stats = current_request.get()
+        route = stats.route if stats is not None else "background"
+        if stats is not None:
+            stats.commands += 1
+        mongo_command_duration.observe((event.command_name, route), event.duration_micros / 1e6)
+        if failed:
+            mongo_command_failures.inc((event.command_name, route))
+
+
+command_metrics = CommandMetrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and counting its Mongo commands."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route, method = stats.route, scope["method"]
+            http_request_duration.observe((method, route), elapsed)
+            http_requests.inc((method, route, status_code))
+            mongo_commands_per_request.observe((route,), stats.commands)
+            if stats.commands > N_PLUS_ONE_THRESHOLD:
+                n_plus_one_requests.inc((route,))
+                print(f"Possible N+1: {method} {route} issued {stats.commands} Mongo commands")
+
+
+def render(extra=()):
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    for gauge_lines in extra:
+        lines += gauge_lines
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,11 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, BeforeValidator
+from typing import Annotated, Literal
+from datetime import datetime
 from bson import ObjectId
 
+# ObjectId read from Mongo, sent to clients as its hex string
+PyObjectId = Annotated[str, BeforeValidator(lambda v: str(v) if isinstance(v, ObjectId) else v)]
+
 class UserModel(BaseModel):
     name : str
     email : EmailStr
@@ -24,7 +29,208 @@ class UserGrid(BaseModel):
     units_for_sell: int = 0
     station: bool = False
     ports: list[str] = []
-    
 
-    
-    
\ No newline at end of file
+class PurchaseLine(BaseModel):
+    grid_id: str
+    units: int = Field(gt=0)
+
+class BulkPurchase(BaseModel):
+    lines: list[PurchaseLine] = Field(default=[], max_length=100)
+    total_units: int | None = Field(default=None, gt=0)
+    strategy: Literal["oldest", "cheapest", "nearest"] = "oldest"
+    location: Location | None = None
+
+class MeterReading(BaseModel):
+    grid_id: str
+    units: int = Field(ge=0)
+    time: datetime | None = None
+
+class MeterReadingBatch(BaseModel):
+    readings: list[MeterReading] = Field(min_length=1, max_length=10000)
+
+class OrderRequest(BaseModel):
+    side: Literal["bid", "ask"]
+    units: int = Field(gt=0)
+    price: float = Field(gt=0)
+    # Where a bid is matched; defaults to the buyer's grid. Asks always use the grid's location
+    location: Location | None = None
+
+class PortHoldRequest(BaseModel):
+    grid_id: str
+    port_type: str
+    hold_seconds: int = Field(default=900, ge=60, le=3600)
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+class PublicUser(BaseModel):
+    name: str
+    email: str
+
+class RegisterResponse(BaseModel):
+    msg: str
+    token: str
+    user: PublicUser
+
+class TokenResponse(BaseModel):
+    token: str
+    token_type: str
+
+class TokenValidity(BaseModel):
+    valid: bool
+    message: str
+
+class UserOut(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    name: str
+    email: str
+    mobile: str | None = None
+    walletAddress: str | None = None
+
+class GridOut(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    grid_name: str | None = Field(default=None, alias="grid name")
+    user: PyObjectId
+    location: Location | None = None
+    units: int = 0
+    available: bool = True
+    units_for_sell: int = 0
+    units_in_book: int = 0
+    station: bool = False
+    ports: list[str] = []
+
+class GridInserted(BaseModel):
+    message: str
+    grid_id: str
+
+class UnitsUpdated(BaseModel):
+    message: str
+    units: int
+
+class UnitStatus(BaseModel):
+    units: int
+    units_for_sell: int
+
+class UnitsMovedToSell(UnitStatus):
+    message: str
+
+class ReadingsAccepted(BaseModel):
+    message: str
+    count: int
+    committed: bool
+
+class SellerListing(BaseModel):
+    grid_id: str
+    grid_name: str | None = None
+    location: Location | None = None
+    units_for_sell: int
+    user: str
+    user_name: str | None = None
+
+class NearbySeller(SellerListing):
+    station: bool = False
+    ports: list[str] = []
+    distance_km: float
+
+class PurchaseRecord(BaseModel):
+    buyer: str
+    grid: str
+    units: int
+    status: str
+
+class PurchaseResponse(BaseModel):
+    message: str
+    transaction: PurchaseRecord
+
+class PurchaseLineResult(BaseModel):
+    grid_id: str
+    units: int
+    status: Literal["completed", "not_found", "insufficient_units"]
+    transaction_id: str | None = None
+
+class BulkPurchaseResponse(BaseModel):
+    message: str
+    total_units: int
+    requested_units: int
+    lines: list[PurchaseLineResult]
+
+class TransactionOut(BaseModel):
+    transaction_id: str
+    user_name: str | None = None
+    grid_name: str | None = None
+    units: int
+    time: str | None = None
+    status: str | None = None
+    role: Literal["bought", "sold"]
+
+class TransactionHistory(BaseModel):
+    transactions: list[TransactionOut]
+    total_transactions: int
+    total_units_bought: int
+    total_units_sold: int
+    next_cursor: str | None = None
+
+class MonthlyEnergy(BaseModel):
+    month: str
+    bought: int
+    sold: int
+
+class DashboardSummary(BaseModel):
+    grid_id: PyObjectId | None = None
+    grid_name: str | None = None
+    units: int = 0
+    units_for_sell: int = 0
+    station: bool = False
+    ports: list[str] = []
+    lifetime_bought: int = 0
+    lifetime_sold: int = 0
+    total_transactions: int = 0
+    recent_transactions: list[TransactionOut] = []
+
+class OrderFill(BaseModel):
+    transaction_id: PyObjectId
+    units: int
+    price: float
+
+class OrderPlaced(BaseModel):
+    order_id: PyObjectId
+    region: str
+    status: Literal["open", "filled"]
+    remaining_units: int
+    fills: list[OrderFill]
+
+class OrderOut(BaseModel):
+    id: PyObjectId = Field(alias="_id")
+    side: Literal["bid", "ask"]
+    region: str
+    price: float
+    units: int
+    original_units: int
+    time: datetime
+    status: str
+
+class BookLevel(BaseModel):
+    price: float
+    units: int
+    orders: int
+
+class OrderBookDepth(BaseModel):
+    region: str
+    bids: list[BookLevel]
+    asks: list[BookLevel]
+
+class PortHold(BaseModel):
+    hold_id: PyObjectId
+    grid_id: PyObjectId
+    port: int
+    port_type: str
+    expires_at: datetime
+
+class StationAvailability(BaseModel):
+    grid_id: str
+    grid_name: str | None = None
+    location: Location
+    distance_km: float
+    total_ports: int
+    free_ports: dict[str, int]
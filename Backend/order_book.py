@@ -0,0 +1,396 @@
+import os
+import math
+import heapq
+import random
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from database import db, connect
+from background import GroupCommitLoop
+from history import monthly_energy_updates
+from summaries import Summary_Collection, purchase_updates
+
+
+ORDER_REGION_DEGREES = float(os.getenv("ORDER_REGION_DEGREES", "1.0"))
+ORDER_FLUSH_INTERVAL_MS = int(os.getenv("ORDER_FLUSH_INTERVAL_MS", "50"))
+ORDER_FLUSH_SIZE = int(os.getenv("ORDER_FLUSH_SIZE", "1000"))
+ORDER_FLUSH_MAX_RETRIES = int(os.getenv("ORDER_FLUSH_MAX_RETRIES", "5"))
+
+Order_Collection = db["orders"]
+Grid_Collection = db["user_grid"]
+Transaction_Collection = db["transactions"]
+Monthly_Energy_Collection = db["monthly_energy"]
+
+# load() rests the open orders oldest first
+OPEN_ORDER_SORT = [("time", 1), ("_id", 1)]
+
+
+def open_orders(user_id=None):
+    """Filter on the open orders, of one user or of everyone."""
+    query = {"status": "open"}
+    if user_id is not None:
+        query["user"] = user_id
+    return query
+
+
+def region_of(location):
+    """Square cells of ORDER_REGION_DEGREES; bids and asks only match inside one cell."""
+    lat = math.floor(location["latitude"] / ORDER_REGION_DEGREES)
+    lon = math.floor(location["longitude"] / ORDER_REGION_DEGREES)
+    return f"{lat}:{lon}"
+
+
+class Order:
+    __slots__ = ("id", "side", "user", "user_name", "grid", "grid_name", "region",
+                 "price", "units", "original_units", "time", "seq", "active")
+
+    def __init__(self, id, side, user, region, price, units, time,
+                 user_name=None, grid=None, grid_name=None, original_units=None):
+        self.id, self.side, self.user, self.region = id, side, user, region
+        self.price, self.units, self.time = price, units, time
+        self.user_name, self.grid, self.grid_name = user_name, grid, grid_name
+        self.original_units = units if original_units is None else original_units
+        self.seq = None
+        self.active = True
+
+    @classmethod
+    def from_doc(cls, doc):
+        return cls(doc["_id"], doc["side"], doc["user"], doc["region"], doc["price"], doc["units"], doc["time"],
+                   doc.get("user_name"), doc.get("grid"), doc.get("grid_name"), doc.get("original_units"))
+
+    def to_doc(self):
+        return {
+            "_id": self.id,
+            "side": self.side,
+            "user": self.user,
+            "user_name": self.user_name,
+            "grid": self.grid,
+            "grid_name": self.grid_name,
+            "region": self.region,
+            "price": self.price,
+            "units": self.units,
+            "original_units": self.original_units,
+            "time": self.time,
+            "status": "open",
+        }
+
+
+class RegionBook:
+    """Resting orders of one region as two heaps of (price key, arrival seq, order).
+
+    Asks are keyed by price and bids by -price, so the top of each heap is
+    the best price and, among equal prices, the oldest order. Cancelled and
+    filled orders are dropped lazily when they reach the top.
+    """
+
+    __slots__ = ("bids", "asks")
+
+    def __init__(self):
+        self.bids = []
+        self.asks = []
+
+
+class OrderBook:
+    """In-process price-time priority book per region with a matching engine.
+
+    add() matches synchronously, without awaiting, so on the event loop it
+    is atomic; the fills it returns are persisted by fill_writer. Mongo's
+    orders collection is the source of truth and load() rebuilds the book
+    from it. Every worker keeps its own book, so two of them can match the
+    same resting order; fill_writes makes each persisted fill conditional
+    on the units still open in Mongo, and a batch that loses that race is
+    aborted and the book reloaded. Matching in one worker (or routing
+    /orders to one) avoids those conflicts altogether.
+    """
+
+    def __init__(self):
+        self.books = {}
+        self.orders = {}
+        self.seq = itertools.count()
+        self.matched = 0
+        self.fills = 0
+        self.changing = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.loaded = asyncio.Event()
+        self.loaded.set()
+
+    @asynccontextmanager
+    async def changes(self):
+        """Hold while writing an order to Mongo and applying it to the book.
+
+        Any number of callers may hold it at once. load() waits until none
+        do and keeps new ones out until the rebuilt book is in place, so an
+        order is never both read by load() and added again, nor added to a
+        book that load() is about to replace.
+        """
+        while not self.loaded.is_set():
+            await self.loaded.wait()
+        self.changing += 1
+        self.idle.clear()
+        try:
+            yield
+        finally:
+            self.changing -= 1
+            if not self.changing:
+                self.idle.set()
+
+    def book(self, region):
+        book = self.books.get(region)
+        if book is None:
+            book = self.books[region] = RegionBook()
+        return book
+
+    def rest(self, order):
+        book = self.book(order.region)
+        if order.seq is None:
+            order.seq = next(self.seq)
+        if order.side == "bid":
+            heapq.heappush(book.bids, (-order.price, order.seq, order))
+        else:
+            heapq.heappush(book.asks, (order.price, order.seq, order))
+        self.orders[order.id] = order
+
+    def add(self, order):
+        """Match an incoming order, rest what is left, and return the fills."""
+        book = self.book(order.region)
+        if order.side == "bid":
+            opposite = book.asks
+            crosses = lambda key: key <= order.price
+        else:
+            opposite = book.bids
+            crosses = lambda key: -key >= order.price
+        fills, skipped = [], []
+        while order.units and opposite:
+            key, _, resting = opposite[0]
+            if not resting.active:
+                heapq.heappop(opposite)
+                continue
+            if not crosses(key):
+                break
+            if resting.user == order.user:
+                # No self-trades; set it aside and look deeper
+                skipped.append(heapq.heappop(opposite))
+                continue
+            units = min(order.units, resting.units)
+            order.units -= units
+            resting.units -= units
+            bid, ask = (order, resting) if order.side == "bid" else (resting, order)
+            fills.append({
+                "transaction_id": ObjectId(),
+                "bid": bid,
+                "ask": ask,
+                "units": units,
+                # Trades go through at the resting order's price
+                "price": resting.price,
+                "bid_units": bid.units,
+                "ask_units": ask.units,
+            })
+            if resting.units == 0:
+                resting.active = False
+                heapq.heappop(opposite)
+                del self.orders[resting.id]
+        for entry in skipped:
+            heapq.heappush(opposite, entry)
+        if order.units:
+            self.rest(order)
+        else:
+            order.active = False
+        if fills:
+            self.matched += 1
+            self.fills += len(fills)
+        return fills
+
+    def cancel(self, order_id, user_id):
+        """Take a resting order off the book; returns it, or None if it isn't resting or isn't the user's."""
+        order = self.orders.get(order_id)
+        if order is None or order.user != user_id:
+            return None
+        order.active = False
+        del self.orders[order_id]
+        return order
+
+    def depth(self, region, levels=10):
+        book = self.books.get(region)
+        result = {"region": region, "bids": [], "asks": []}
+        if book is None:
+            return result
+        for side, heap, sign in (("bids", book.bids, -1), ("asks", book.asks, 1)):
+            totals = {}
+            for key, _, order in heap:
+                if order.active:
+                    level = totals.setdefault(sign * key, [0, 0])
+                    level[0] += order.units
+                    level[1] += 1
+            prices = sorted(totals, reverse=(sign == -1))[:levels]
+            result[side] = [{"price": p, "units": totals[p][0], "orders": totals[p][1]} for p in prices]
+        return result
+
+    async def load(self):
+        """Rebuild every region from the open orders in Mongo, oldest first, with changes() held off."""
+        self.loaded.clear()
+        try:
+            await self.idle.wait()
+            fresh = OrderBook()
+            async for doc in Order_Collection.find(open_orders()).sort(OPEN_ORDER_SORT):
+                fresh.rest(Order.from_doc(doc))
+            self.books, self.orders, self.seq = fresh.books, fresh.orders, fresh.seq
+        finally:
+            self.loaded.set()
+        return len(self.orders)
+
+    def stats(self):
+        return {
+            "regions": len(self.books),
+            "resting": len(self.orders),
+            "heap_entries": sum(len(b.bids) + len(b.asks) for b in self.books.values()),
+            "matched": self.matched,
+            "fills": self.fills,
+        }
+
+
+order_book = OrderBook()
+
+
+class FillConflict(Exception):
+    """Another worker has filled or cancelled units this batch matched against."""
+
+
+def fill_writes(fills):
+    """The documents one batch of fills writes, with updates to one order or grid merged."""
+    transactions, rollups, summaries = [], [], []
+    book_units, order_units = {}, {}
+    for fill in fills:
+        bid, ask, units = fill["bid"], fill["ask"], fill["units"]
+        transaction = {
+            "_id": fill["transaction_id"],
+            "buyer": bid.user,
+            "grid": ask.grid,
+            "seller": ask.user,
+            "units": units,
+            "price": fill["price"],
+            "time": fill["time"],
+            "status": "completed",
+            "bid": bid.id,
+            "ask": ask.id,
+        }
+        transactions.append(transaction)
+        rollups += monthly_energy_updates(bid.user, ask.user, units, fill["time"])
+        summaries += purchase_updates(transaction, ask.user, bid.user_name, ask.grid_name, listed=False)
+        book_units[ask.grid] = book_units.get(ask.grid, 0) + units
+        order_units[bid.id] = order_units.get(bid.id, 0) + units
+        order_units[ask.id] = order_units.get(ask.id, 0) + units
+    # Every update only matches while the units it takes are still there;
+    # FillWriter checks that all of them matched
+    grid_updates = [
+        UpdateOne({"_id": grid_id, "units_in_book": {"$gte": units}}, {"$inc": {"units_in_book": -units}})
+        for grid_id, units in book_units.items()
+    ]
+    order_updates = [
+        # A cancel leaves the units of in-flight fills for them to take, and stays cancelled
+        UpdateOne({"_id": order_id, "units": {"$gte": units}}, [
+            {"$set": {"units": {"$subtract": ["$units", units]}}},
+            {"$set": {"status": {"$cond": [
+                {"$and": [{"$eq": ["$status", "open"]}, {"$eq": ["$units", 0]}]}, "filled", "$status",
+            ]}}},
+        ])
+        for order_id, units in order_units.items()
+    ]
+    return transactions, grid_updates, order_updates, rollups, summaries
+
+
+class FillWriter(GroupCommitLoop):
+    """Write-behind persistence for order book fills, the same group commit as MeterBuffer.
+
+    Every ORDER_FLUSH_INTERVAL_MS, or once ORDER_FLUSH_SIZE fills wait, one
+    Mongo transaction inserts their transactions and bulk-writes user_grid,
+    orders, monthly_energy and dashboard_summary. add() returns a future
+    that resolves when the fills commit. If a batch can't be written, or
+    another worker got to its units first, the book is rebuilt from Mongo
+    and every fill not yet persisted fails.
+    """
+
+    interval_ms = ORDER_FLUSH_INTERVAL_MS
+
+    def __init__(self, book):
+        super().__init__()
+        self.book = book
+        self.fills = []
+        self.waiters = []
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+
+    def add(self, fills):
+        now = datetime.now(timezone.utc)
+        for fill in fills:
+            fill["time"] = now
+        self.fills.extend(fills)
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        if len(self.fills) >= ORDER_FLUSH_SIZE:
+            self.wakeup.set()
+        return future
+
+    async def apply(self, writes, session=None):
+        """Issue one batch's writes; raises FillConflict, aborting the transaction, if a fill lost its units."""
+        transactions, grid_updates, order_updates, rollups, summaries = writes
+        grids = await Grid_Collection.bulk_write(grid_updates, ordered=False, session=session)
+        orders = await Order_Collection.bulk_write(order_updates, ordered=False, session=session)
+        if grids.matched_count != len(grid_updates) or orders.matched_count != len(order_updates):
+            raise FillConflict(
+                f"{len(grid_updates) - grids.matched_count} grids and "
+                f"{len(order_updates) - orders.matched_count} orders no longer have the units matched")
+        await Transaction_Collection.insert_many(transactions, session=session)
+        await Monthly_Energy_Collection.bulk_write(rollups, ordered=False, session=session)
+        await Summary_Collection.bulk_write(summaries, ordered=True, session=session)
+
+    async def write(self, fills):
+        writes = fill_writes(fills)
+        for attempt in range(ORDER_FLUSH_MAX_RETRIES):
+            try:
+                async with await connect().start_session() as session:
+                    async with session.start_transaction():
+                        await self.apply(writes, session)
+                return
+            except PyMongoError as e:
+                if not e.has_error_label("TransientTransactionError") or attempt == ORDER_FLUSH_MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+    async def flush(self):
+        fills, waiters = self.fills, self.waiters
+        self.fills, self.waiters = [], []
+        try:
+            if fills:
+                await self.write(fills)
+                self.flushed += len(fills)
+                self.batches += 1
+            for future in waiters:
+                if not future.done():
+                    future.set_result(len(fills))
+        except Exception as e:
+            print(e)
+            await self.book.load()
+            # Everything matched before the rebuild assumed the lost fills; fail it too
+            fills, waiters = fills + self.fills, waiters + self.waiters
+            self.fills, self.waiters = [], []
+            self.failed += len(fills)
+            for future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self):
+        return {
+            "pending": len(self.fills),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failed": self.failed,
+        }
+
+
+fill_writer = FillWriter(order_book)
@@ -0,0 +1,69 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from passlib.context import CryptContext
+
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_QUEUE_LIMIT = int(os.getenv("PASSWORD_QUEUE_LIMIT", "64"))
+
+# min/max pinned to the configured cost so hashes made with any other cost
+# report needs_update and get rehashed on the next successful login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordPoolSaturated(Exception):
+    pass
+
+
+class PasswordPool:
+    """Runs bcrypt off the event loop on a bounded thread pool.
+
+    bcrypt releases the GIL, so threads give real parallelism. At most
+    ``workers`` calls run and ``queue_limit`` more wait; anything beyond
+    that raises PasswordPoolSaturated straight away.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.workers = workers
+        self.limit = workers + queue_limit
+        self.pending = 0
+        self.rejected = 0
+
+    async def run(self, fn, *args):
+        if self.pending >= self.limit:
+            self.rejected += 1
+            raise PasswordPoolSaturated()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "limit": self.limit,
+            "pending": self.pending,
+            "rejected": self.rejected,
+        }
+
+
+password_pool = PasswordPool()
+
+
+async def hash_password(password):
+    return await password_pool.run(pwd_context.hash, password)
+
+
+async def verify_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be replaced."""
+    return await password_pool.run(pwd_context.verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,21 @@
+from auth import get_current_principal
+from fastapi import APIRouter, Depends
+from models import DashboardSummary
+from summaries import Summary_Collection, build_summary
+
+router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+
+@router.get("/summary", response_model=DashboardSummary)
+async def get_dashboard_summary(refresh: bool = False, user: dict = Depends(get_current_principal)):
+    """Everything the dashboard shows in one read of the user's summary document.
+
+    The summary is kept up to date by the /grid writes, purchases and meter
+    readings; refresh=true recomputes it from the source collections.
+    """
+    summary = None
+    if not refresh:
+        # A summary without built_at is a placeholder of a build that did not finish
+        summary = await Summary_Collection.find_one({"_id": user["_id"], "built_at": {"$exists": True}})
+    if summary is None:
+        summary = await build_summary(user["_id"])
+    return summary
@@ -1,124 +1,254 @@
 import os
-from .Users import create_token, decode_token
-from fastapi import APIRouter, HTTPException, status, Depends, Body
-from database import db
+from auth import get_current_principal, get_admin_principal
+from admission import admit, admit_stream
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from database import db, connect
+from sell_pool import sell_pool, geo_near_stage, nearby_pipeline
+from events import hub
+from chain_indexer import chain_indexer
+from history import IST, as_ist, history_match, format_transaction, monthly_energy_updates
+from summaries import Summary_Collection, purchase_updates
+from export import ENCODERS, export_chunks
+from archive import archiver, history_totals, history_page
+from typing import Literal
 from bson import ObjectId
-from models import UserModel, UserLogin, Location, UserGrid
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from contextlib import asynccontextmanager
+from models import (
+    UserModel, UserLogin, Location, UserGrid, BulkPurchase,
+    SellerListing, NearbySeller, PurchaseResponse, BulkPurchaseResponse, TransactionHistory, MonthlyEnergy,
+)
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError,ExpiredSignatureError
 from datetime import datetime, timedelta, timezone
-import pytz
 import calendar
+import asyncio
+import random
+import hashlib
+import json
 
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-IST = pytz.timezone('Asia/Kolkata')
-
 Grid_Collection = db["user_grid"]
 collection = db["users"]
 Transaction_Collection = db["transactions"]
+Monthly_Energy_Collection = db["monthly_energy"]
 
 router = APIRouter(prefix="/energypool", tags=["energypool"])
 
-def convert_id(doc):
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+@router.get("/", response_model=list[SellerListing])
+async def get_available_units(
+    request: Request,
+    response: Response,
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    user: dict = Depends(get_current_principal)
+):
+    if cursor is not None and not ObjectId.is_valid(cursor):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+    user_id = str(user["_id"])
+    # Served from the shared snapshot; a poll with a matching ETag costs no database work
+    version = await sell_pool.current_version()
+    view_key = hashlib.sha1(f"{user_id}:{limit}:{cursor}".encode()).hexdigest()[:16]
+    etag = f'"{version}-{view_key}"'
+    if request.headers.get("if-none-match") == etag:
+        sell_pool.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    await sell_pool.get(version)
+    result = sell_pool.view(user_id, limit, cursor)
+    response.headers["ETag"] = etag
+    if limit is not None and len(result) == limit:
+        response.headers["X-Next-Cursor"] = result[-1]["grid_id"]
+    return result
+
+@router.get("/cache_stats")
+async def get_sell_pool_cache_stats():
+    return sell_pool.stats()
 
-@router.get("/")
-async def get_available_units(token: str = Depends(oauth2_scheme)):
+EVENT_HEARTBEAT_SECONDS = 15
+
+@router.websocket("/ws")
+async def subscribe_events_ws(websocket: WebSocket, token: str = Query(...)):
+    """Push listing, units_sold and my_grid events; browsers can't set headers, so the token is a query parameter."""
     try:
-        payload = decode_token(token)
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        user = collection.find_one({"email": email}, {"_id": 1})
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        user_id = user["_id"]
-        grids = Grid_Collection.find({"units_for_sell": {"$gt": 0}, "user": {"$ne": user_id}})
-        result = []
-        for grid in grids:
-            grid_data = convert_id(grid)
-            user_id_grid = grid_data.get("user")
-            user_name = None
-            if user_id_grid:
-                user_doc = collection.find_one({"_id": ObjectId(user_id_grid)})
-                if user_doc:
-                    user_name = user_doc.get("name")
-            result.append({
-                "grid_id": grid_data["_id"],
-                "grid_name": grid_data.get("grid name"),
-                "location": grid_data.get("location"),
-                "units_for_sell": grid_data.get("units_for_sell", 0),
-                "user": str(user_id_grid),
-                "user_name": user_name,
-            })
-        return result
-    except Exception as e:
+        user = await get_current_principal(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    sub = hub.subscribe(user["_id"])
+    try:
+        while True:
+            batch = await sub.next_batch(timeout=EVENT_HEARTBEAT_SECONDS)
+            await websocket.send_json(batch)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(sub)
+
+@router.get("/events")
+async def subscribe_events_sse(user: dict = Depends(get_current_principal)):
+    """Same events as /ws as a Server-Sent Events stream."""
+    sub = hub.subscribe(user["_id"])
+
+    async def stream():
+        try:
+            while True:
+                batch = await sub.next_batch(timeout=EVENT_HEARTBEAT_SECONDS)
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(batch)}\n\n"
+        finally:
+            hub.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.get("/events/stats")
+async def get_event_stats():
+    return hub.stats()
+
+@router.get("/chain/stats")
+async def get_chain_indexer_stats():
+    return chain_indexer.stats()
+
+@router.get("/archive/stats")
+async def get_archive_stats():
+    return archiver.stats()
+
+@router.get("/nearby", response_model=list[NearbySeller])
+async def get_nearby_sellers(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    # Half the Earth's circumference; anything wider is every grid
+    radius_km: float | None = Query(None, gt=0, le=20000),
+    min_latitude: float | None = Query(None, ge=-90, le=90),
+    min_longitude: float | None = Query(None, ge=-180, le=180),
+    max_latitude: float | None = Query(None, ge=-90, le=90),
+    max_longitude: float | None = Query(None, ge=-180, le=180),
+    min_units: int = Query(1, ge=1),
+    station: bool | None = None,
+    ports: list[str] | None = Query(None),
+    limit: int = Query(50, ge=1, le=500),
+    user: dict = Depends(get_current_principal)
+):
+    bbox = (min_latitude, min_longitude, max_latitude, max_longitude)
+    if any(v is not None for v in bbox) and any(v is None for v in bbox):
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Authorization failed: {str(e)}",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bounding box needs min_latitude, min_longitude, max_latitude and max_longitude",
+        )
+    if bbox[0] is not None and (min_latitude > max_latitude or min_longitude > max_longitude):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Bounding box minimums must not exceed its maximums",
+        )
+    query = {"units_for_sell": {"$gte": min_units}, "user": {"$ne": user["_id"]}}
+    if station is not None:
+        query["station"] = True if station else {"$ne": True}
+    if ports:
+        query["ports"] = {"$in": ports}
+    if bbox[0] is not None:
+        query["geo"] = {"$geoWithin": {"$box": [
+            [min_longitude, min_latitude],
+            [max_longitude, max_latitude],
+        ]}}
+    pipeline = nearby_pipeline(latitude, longitude, query, limit, radius_km)
+    return await Grid_Collection.aggregate(pipeline).to_list(length=limit)
+
+PURCHASE_MAX_RETRIES = int(os.getenv("PURCHASE_MAX_RETRIES", "5"))
+PURCHASE_QUEUE_LIMIT = int(os.getenv("PURCHASE_QUEUE_LIMIT", "256"))
+
+# grid_id -> [lock, holders]; purchases of one grid in this worker run one at a
+# time so they don't abort each other's Mongo transactions with write conflicts
+grid_locks = {}
+
+@asynccontextmanager
+async def grid_lock(grid_id):
+    entry = grid_locks.setdefault(grid_id, [asyncio.Lock(), 0])
+    if entry[1] >= PURCHASE_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many purchases queued for this grid",
+            headers={"Retry-After": "1"},
         )
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del grid_locks[grid_id]
+
+async def purchase_units(buyer_id, grid_id, units, buyer_name=None):
+    """Take units from a grid's sell pool and record the transaction atomically.
 
-@router.post("/buy")
+    The decrement only matches while units_for_sell >= units, so concurrent
+    buyers can never oversell; the decrement, transaction, monthly rollups
+    and dashboard summaries commit together. Transient transaction errors (write conflicts with other
+    workers) are retried up to PURCHASE_MAX_RETRIES times.
+    """
+    async with grid_lock(grid_id):
+        for attempt in range(PURCHASE_MAX_RETRIES):
+            try:
+                async with await connect().start_session() as session:
+                    async with session.start_transaction():
+                        grid = await Grid_Collection.find_one_and_update(
+                            {"_id": grid_id, "units_for_sell": {"$gte": units}},
+                            {"$inc": {"units_for_sell": -units}},
+                            projection={"user": 1, "grid name": 1},
+                            session=session,
+                        )
+                        if not grid:
+                            if not await Grid_Collection.find_one({"_id": grid_id}, {"_id": 1}, session=session):
+                                raise HTTPException(
+                                    status_code=status.HTTP_404_NOT_FOUND,
+                                    detail="Grid not found",
+                                )
+                            raise HTTPException(
+                                status_code=status.HTTP_400_BAD_REQUEST,
+                                detail="Not enough units available for sale",
+                            )
+                        transaction = {
+                            "buyer": buyer_id,
+                            "grid": grid_id,
+                            "seller": grid.get("user"),
+                            "units": units,
+                            "time": datetime.now(IST),
+                            "status": "completed"
+                        }
+                        await Transaction_Collection.insert_one(transaction, session=session)
+                        await record_monthly_energy(buyer_id, grid.get("user"), units, transaction["time"], session=session)
+                        await Summary_Collection.bulk_write(
+                            purchase_updates(transaction, grid.get("user"), buyer_name, grid.get("grid name")),
+                            ordered=False, session=session)
+                        return transaction
+            except PyMongoError as e:
+                if not e.has_error_label("TransientTransactionError") or attempt == PURCHASE_MAX_RETRIES - 1:
+                    raise
+                await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+@router.post("/buy", response_model=PurchaseResponse, dependencies=[Depends(admit("purchase"))])
 async def buy_energy(
     grid_id: str = Body(...),
     units: int = Body(...),
-    token: str = Depends(oauth2_scheme)
+    buyer: dict = Depends(get_current_principal)
 ):
-    try:
-        payload = decode_token(token)
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        buyer = collection.find_one({"email": email}, {"_id": 1})
-        if not buyer:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        grid = Grid_Collection.find_one({"_id": ObjectId(grid_id)})
-        if not grid:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Grid not found",
-            )
-        if grid.get("units_for_sell", 0) < units:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Not enough units available for sale",
-            )
-        # Decrement units_for_sell
-        Grid_Collection.update_one(
-            {"_id": ObjectId(grid_id)},
-            {"$inc": {"units_for_sell": -units}}
+    if units <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Units to buy must be positive.",
         )
-        # Insert transaction
-        transaction = {
-            "buyer": buyer["_id"],
-            "grid": ObjectId(grid_id),
-            "units": units,
-            "time": datetime.now(IST),
-            "status": "completed"
-        }
-        Transaction_Collection.insert_one(transaction)
+    try:
+        await purchase_units(buyer["_id"], ObjectId(grid_id), units, buyer.get("name"))
+        await sell_pool.bump()
         return {
             "message": "Purchase successful",
             "transaction": {
@@ -128,83 +258,203 @@ async def buy_energy(
                 "status": "completed"
             }
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Purchase failed: {str(e)}"
         )
 
-@router.get("/transaction_history")
-async def transaction_history(token: str = Depends(oauth2_scheme)):
+BULK_CANDIDATE_LIMIT = 100
+
+class SellPoolChanged(Exception):
+    pass
+
+def candidates_query(buyer_id):
+    return {"units_for_sell": {"$gt": 0}, "user": {"$ne": buyer_id}}
+
+def nearest_candidates_pipeline(buyer_id, latitude, longitude):
+    return [
+        geo_near_stage(latitude, longitude, candidates_query(buyer_id)),
+        {"$limit": BULK_CANDIDATE_LIMIT},
+        {"$project": {"_id": 1}},
+    ]
+
+async def bulk_candidates(buyer_id, purchase: BulkPurchase):
+    """Grids to fill a total quantity from, best first; ranked outside the transaction.
+
+    "oldest" takes grids in the order they were listed, "nearest" by distance.
+    """
+    if purchase.strategy == "nearest":
+        pipeline = nearest_candidates_pipeline(buyer_id, purchase.location.latitude, purchase.location.longitude)
+        docs = await Grid_Collection.aggregate(pipeline).to_list(length=BULK_CANDIDATE_LIMIT)
+    else:
+        docs = await Grid_Collection.find(candidates_query(buyer_id), {"_id": 1}).sort("_id", 1).limit(BULK_CANDIDATE_LIMIT).to_list(length=BULK_CANDIDATE_LIMIT)
+    return [doc["_id"] for doc in docs]
+
+async def purchase_bulk(buyer_id, lines, total_units=None, buyer_name=None):
+    """Buy from several grids in one Mongo transaction.
+
+    lines is a list of (grid_id, units). With total_units set the units in
+    lines are ignored and grids are drained in order until the total is
+    reached. Every decrement, transaction, rollup and summary update goes
+    out as one bulk_write/insert_many per collection; lines that can't be
+    filled are reported and skipped while the rest commit together.
+    """
+    for attempt in range(PURCHASE_MAX_RETRIES):
+        try:
+            async with await connect().start_session() as session:
+                async with session.start_transaction():
+                    grid_ids = [grid_id for grid_id, _ in lines]
+                    grids = {
+                        grid["_id"]: grid
+                        async for grid in Grid_Collection.find(
+                            {"_id": {"$in": grid_ids}}, {"user": 1, "units_for_sell": 1, "grid name": 1}, session=session
+                        )
+                    }
+                    now = datetime.now(IST)
+                    remaining = total_units
+                    results, grid_updates, transactions, rollups, summaries = [], [], [], [], []
+                    for grid_id, units in lines:
+                        grid = grids.get(grid_id)
+                        available = grid.get("units_for_sell", 0) if grid else 0
+                        if total_units is not None:
+                            units = min(available, remaining)
+                            if units <= 0:
+                                continue
+                        line = {"grid_id": str(grid_id), "units": units}
+                        if not grid:
+                            results.append({**line, "status": "not_found"})
+                            continue
+                        if available < units:
+                            results.append({**line, "status": "insufficient_units"})
+                            continue
+                        # Keep the read-time balance in step if a grid appears twice
+                        grid["units_for_sell"] = available - units
+                        grid_updates.append(UpdateOne(
+                            {"_id": grid_id, "units_for_sell": {"$gte": units}},
+                            {"$inc": {"units_for_sell": -units}},
+                        ))
+                        transaction = {
+                            "_id": ObjectId(),
+                            "buyer": buyer_id,
+                            "grid": grid_id,
+                            "seller": grid.get("user"),
+                            "units": units,
+                            "time": now,
+                            "status": "completed"
+                        }
+                        transactions.append(transaction)
+                        rollups += monthly_energy_updates(buyer_id, grid.get("user"), units, now)
+                        summaries += purchase_updates(transaction, grid.get("user"), buyer_name, grid.get("grid name"))
+                        results.append({**line, "status": "completed", "transaction_id": str(transaction["_id"])})
+                        if remaining is not None:
+                            remaining -= units
+                            if remaining == 0:
+                                break
+                    if grid_updates:
+                        written = await Grid_Collection.bulk_write(grid_updates, ordered=True, session=session)
+                        if written.modified_count != len(grid_updates):
+                            # Snapshot reads make this a write conflict in practice; retry from scratch
+                            raise SellPoolChanged()
+                        await Transaction_Collection.insert_many(transactions, session=session)
+                        await Monthly_Energy_Collection.bulk_write(rollups, ordered=False, session=session)
+                        await Summary_Collection.bulk_write(summaries, ordered=True, session=session)
+                    return results
+        except (PyMongoError, SellPoolChanged) as e:
+            transient = isinstance(e, SellPoolChanged) or e.has_error_label("TransientTransactionError")
+            if not transient or attempt == PURCHASE_MAX_RETRIES - 1:
+                raise
+            await asyncio.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+@router.post("/buy_bulk", response_model=BulkPurchaseResponse, dependencies=[Depends(admit("purchase"))])
+async def buy_energy_bulk(purchase: BulkPurchase, buyer: dict = Depends(get_current_principal)):
+    if bool(purchase.lines) == (purchase.total_units is not None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Give either lines or total_units",
+        )
+    if purchase.strategy == "cheapest":
+        # Listed units have no price; priced asks go through /orders
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Listed grids have no price, use the oldest or nearest strategy",
+        )
+    if purchase.strategy == "nearest" and purchase.total_units is not None and purchase.location is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="location is required for the nearest strategy",
+        )
+    if any(not ObjectId.is_valid(line.grid_id) for line in purchase.lines):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid grid_id",
+        )
     try:
-        payload = decode_token(token)
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        user = collection.find_one({"email": email}, {"_id": 1, "name": 1})
-        if not user:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        # Find all grids owned by the user
-        user_grids = list(Grid_Collection.find({"user": user["_id"]}))
-        user_grid_ids = [g["_id"] for g in user_grids]
-        # Transactions where user is buyer
-        tx_buyer = list(Transaction_Collection.find({"buyer": user["_id"]}))
-        # Transactions where user's grid is the seller
-        tx_seller = list(Transaction_Collection.find({"grid": {"$in": user_grid_ids}}))
-        result = []
-        total_units = 0
-        total_units_sold = 0
-        for tx in tx_buyer:
-            grid = Grid_Collection.find_one({"_id": tx["grid"]})
-            grid_name = grid.get("grid name") if grid else None
-
-            tx_time = tx.get("time")
-            if tx_time and tx_time.tzinfo is None:
-                tx_time = tx_time.replace(tzinfo=timezone.utc)
-            tx_time_ist = tx_time.astimezone(IST)
-            time_str = tx_time_ist.isoformat()
+        if purchase.total_units is not None:
+            candidates = await bulk_candidates(buyer["_id"], purchase)
+            lines = [(grid_id, 0) for grid_id in candidates]
+        else:
+            lines = [(ObjectId(line.grid_id), line.units) for line in purchase.lines]
+        results = await purchase_bulk(buyer["_id"], lines, purchase.total_units, buyer.get("name"))
+        bought = sum(line["units"] for line in results if line["status"] == "completed")
+        if bought:
+            await sell_pool.bump()
+        return {
+            "message": "Purchase completed" if bought else "Nothing purchased",
+            "total_units": bought,
+            "requested_units": purchase.total_units or sum(line.units for line in purchase.lines),
+            "lines": results
+        }
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Purchase failed: {str(e)}"
+        )
 
-            result.append({
-                "transaction_id": str(tx["_id"]),
-                "user_name": user.get("name"),
-                "grid_name": grid_name,
-                "units": tx.get("units", 0),
-                "time": time_str,
-                "status": tx.get("status"),
-                "role": "bought"
-            })
-            total_units += tx.get("units", 0)
-        for tx in tx_seller:
-            # Avoid duplicate if user bought from own grid
-            if tx["buyer"] == user["_id"]:
-                continue
-            buyer_doc = collection.find_one({"_id": tx["buyer"]})
-            buyer_name = buyer_doc.get("name") if buyer_doc else None
-            grid = Grid_Collection.find_one({"_id": tx["grid"]})
-            grid_name = grid.get("grid name") if grid else None
-            result.append({
-                "transaction_id": str(tx["_id"]),
-                "user_name": buyer_name,
-                "grid_name": grid_name,
-                "units": tx.get("units", 0),
-                "time": tx.get("time"),
-                "status": tx.get("status"),
-                "role": "sold"
-            })
-            total_units_sold += tx.get("units", 0)
+def encode_history_cursor(tx_time, tx_id):
+    if tx_time.tzinfo is None:
+        tx_time = tx_time.replace(tzinfo=timezone.utc)
+    return f"{int(tx_time.timestamp() * 1000)}_{tx_id}"
+
+def decode_history_cursor(cursor):
+    millis, _, tx_id = cursor.partition("_")
+    if not millis.isdigit() or not ObjectId.is_valid(tx_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+    tx_time = datetime.fromtimestamp(int(millis) / 1000, tz=timezone.utc)
+    return tx_time, ObjectId(tx_id)
+
+@router.get("/transaction_history", response_model=TransactionHistory)
+async def transaction_history(
+    limit: int | None = Query(None, ge=1, le=500),
+    before: str | None = None,
+    start: datetime | None = None,
+    user: dict = Depends(get_current_principal)
+):
+    """Totals are lifetime; rows come from the hot set unless the page or start reaches into the archives."""
+    before_key = decode_history_cursor(before) if before is not None else None
+    try:
+        user_id = user["_id"]
+        user_grid_ids = await Grid_Collection.distinct("_id", {"user": user_id})
+        totals, page = await asyncio.gather(
+            history_totals(user_id, user_grid_ids),
+            history_page(user_id, user_grid_ids, limit, before_key, as_ist(start) if start else None),
+        )
+        result = [format_transaction(tx) for tx in page]
+
+        next_cursor = None
+        if limit is not None and len(page) == limit and page[-1].get("time"):
+            next_cursor = encode_history_cursor(page[-1]["time"], page[-1]["_id"])
         return {
             "transactions": result,
-            "total_transactions": len(result),
-            "total_units_bought": total_units,
-            "total_units_sold": total_units_sold
+            "total_transactions": totals["count"],
+            "total_units_bought": totals["bought"],
+            "total_units_sold": totals["sold"],
+            "next_cursor": next_cursor
         }
     except Exception as e:
         raise HTTPException(
@@ -212,63 +462,96 @@ async def transaction_history(token: str = Depends(oauth2_scheme)):
             detail=f"Failed to fetch transaction history: {str(e)}"
         )
         
-@router.get("/monthly_energy_summary")
-async def monthly_energy_summary(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = decode_token(token)
-        email = payload.get("sub")
-        if not email:
-            raise HTTPException(status_code=401, detail="Invalid authentication credentials")
+async def export_response(request, match, start, end, format, filename, user_id=None):
+    """Stream an export under the "export" admission group.
 
-        user = collection.find_one({"email": email}, {"_id": 1})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
+    The slot is released when the body finishes, or by the background task
+    if the client disconnects before it does.
+    """
+    release = await admit_stream("export", request)
 
-        user_id = user["_id"]
+    async def stream():
+        try:
+            async for chunk in export_chunks(match, format, start, end, user_id):
+                yield chunk
+        finally:
+            release()
 
-        # Find all grids owned by this user
-        user_grids = list(Grid_Collection.find({"user": user_id}))
-        user_grid_ids = [g["_id"] for g in user_grids]
+    return StreamingResponse(
+        stream(),
+        media_type=ENCODERS[format][1],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{format}"'},
+        background=BackgroundTask(release),
+    )
 
-        # Fetch all transactions where user is buyer or grid belongs to user (seller)
-        transactions = list(Transaction_Collection.find({
-            "$or": [
-                {"buyer": user_id},
-                {"grid": {"$in": user_grid_ids}}
-            ]
-        }))
+@router.get("/export")
+async def export_transactions(
+    request: Request,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    format: Literal["csv", "ndjson"] = "csv",
+    user: dict = Depends(get_current_principal)
+):
+    """The caller's transaction history, oldest first, for accounting.
 
-        # Prepare month-wise data
-        monthly_data = {month: {"bought": 0, "sold": 0} for month in range(1, 13)}
+    Same rows as /transaction_history; naive start/end are IST.
+    """
+    user_id = user["_id"]
+    user_grid_ids = await Grid_Collection.distinct("_id", {"user": user_id})
+    match = history_match(user_id, user_grid_ids)
+    return await export_response(request, match, start, end, format, f"transactions-{user_id}", user_id)
 
-        for tx in transactions:
-            tx_time = tx.get("time")
-            if not tx_time:
-                continue
+@router.get("/export/all")
+async def export_all_transactions(
+    request: Request,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    user_id: str | None = None,
+    format: Literal["csv", "ndjson"] = "csv",
+    admin: dict = Depends(get_admin_principal)
+):
+    """Every transaction in [start, end), optionally only those a user bought or sold. Admins only."""
+    match, user_oid = None, None
+    if user_id is not None:
+        if not ObjectId.is_valid(user_id):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid user_id"
+            )
+        user_oid = ObjectId(user_id)
+        match = history_match(user_oid, await Grid_Collection.distinct("_id", {"user": user_oid}))
+    return await export_response(request, match, start, end, format, "transactions", user_oid)
 
-            # Convert UTC datetime to IST
-            tx_time_ist = tx_time.astimezone(datetime.now().astimezone().tzinfo)  # Converts to local system tz
-            month = tx_time_ist.month
+async def record_monthly_energy(buyer_id, seller_id, units, tx_time, session=None):
+    """Add a purchase to the buyer's and seller's (year, month) rollups in one round trip."""
+    updates = monthly_energy_updates(buyer_id, seller_id, units, tx_time)
+    await Monthly_Energy_Collection.bulk_write(updates, ordered=False, session=session)
 
-            if tx.get("buyer") == user_id:
-                # User bought
-                monthly_data[month]["bought"] += tx.get("units", 0)
+@router.get("/monthly_energy_summary", response_model=list[MonthlyEnergy])
+async def monthly_energy_summary(year: int | None = Query(None, ge=1970, le=9999), user: dict = Depends(get_current_principal)):
+    try:
+        if year is None:
+            year = datetime.now(IST).year
 
-            elif tx.get("grid") in user_grid_ids and tx.get("buyer") != user_id:
-                # User sold (grid was seller)
-                monthly_data[month]["sold"] += tx.get("units", 0)
+        # At most 12 rollup documents, maintained by buy_energy and backfill_monthly_energy.py
+        rollups = await Monthly_Energy_Collection.find(
+            {"user": user["_id"], "year": year},
+            {"_id": 0, "month": 1, "bought": 1, "sold": 1}
+        ).to_list(length=12)
+        monthly_data = {doc["month"]: doc for doc in rollups}
 
         # Prepare final output list
         result = []
         for month_num in range(1, 13):
             month_name = calendar.month_abbr[month_num]
+            bucket = monthly_data.get(month_num, {})
             result.append({
                 "month": month_name,
-                "bought": monthly_data[month_num]["bought"],
-                "sold": monthly_data[month_num]["sold"]
+                "bought": bucket.get("bought", 0),
+                "sold": bucket.get("sold", 0)
             })
 
         return result
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch monthly summary: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Failed to fetch monthly summary: {str(e)}")
@@ -1,130 +1,147 @@
 import os
-from .Users import create_token, decode_token
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from auth import get_current_principal
+from admission import admit
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Query
 from database import db
 from bson import ObjectId
-from models import UserModel, UserLogin, Location, UserGrid
+from pymongo import ReturnDocument
+from models import (
+    UserModel, UserLogin, Location, UserGrid, MeterReadingBatch,
+    MessageResponse, GridOut, GridInserted, UnitsUpdated, UnitStatus, UnitsMovedToSell, ReadingsAccepted,
+)
+from meter_readings import meter_buffer, make_reading, MeterBufferFull
 from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import jwt, JWTError,ExpiredSignatureError
 from datetime import datetime, timedelta
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+from typing import Literal
+from listing import list_documents
+from sell_pool import sell_pool
+from summaries import Summary_Collection, grid_state, update_grid_state
+from stations import port_index
 
 Grid_Collection = db["user_grid"]
 collection = db["users"]
 
 router = APIRouter(prefix="/grid", tags=["grids"])
 
-def convert_id(doc):
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+GRID_FIELDS = ("grid name", "user", "location", "geo", "units", "available", "units_for_sell", "units_in_book", "station", "ports")
 
 @router.get("/")
-async def list_grids():
-    grids = Grid_Collection.find()
-    grids = list(grids)
-    grids = [convert_id(grid) for grid in grids]
-    return grids
+async def list_grids(
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    fields: str | None = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    return await list_documents(Grid_Collection, limit, cursor, fields, format, GRID_FIELDS)
 
-@router.post("/insert_new")
-async def insert_new_grid(grid: UserGrid,token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    userid = collection.find_one({"email": email}, {"_id": 1, "name": 0, "email": 0, "mobile": 0, "password": 0})
+@router.post("/insert_new", response_model=GridInserted, dependencies=[Depends(admit("grid_write"))])
+async def insert_new_grid(grid: UserGrid, user: dict = Depends(get_current_principal)):
     new_grid = {
         "grid name": grid.grid_name,
-        "user": ObjectId(userid["_id"]),
+        "user": user["_id"],
         "location": {
             "latitude": grid.location.latitude,
             "longitude": grid.location.longitude
             },
+        "geo": {
+            "type": "Point",
+            "coordinates": [grid.location.longitude, grid.location.latitude]
+            },
         "units": grid.units,
         "available": grid.available,
         "units_for_sell": grid.units_for_sell
         }
-    result = Grid_Collection.insert_one(new_grid)
+    result = await Grid_Collection.insert_one(new_grid)
+    # Only a first grid becomes the one the dashboard shows
+    await Summary_Collection.update_one(
+        {"_id": user["_id"], "grid_id": None},
+        {"$set": grid_state(new_grid), "$inc": {"version": 1}})
+    if grid.units_for_sell > 0:
+        await sell_pool.bump()
     return {
         "message": "Grid inserted successfully",
         "grid_id": str(result.inserted_id)
     }
     
-@router.get("/get_user_grid")
-async def get_user_grid(token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = collection.find_one({"email": email}, {"_id": 1, "name": 0, "email": 0, "mobile": 0, "password": 0})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found")
-    grid = Grid_Collection.find_one({"user": ObjectId(user["_id"])})
+@router.get("/get_user_grid", response_model=GridOut)
+async def get_user_grid(user: dict = Depends(get_current_principal)):
+    grid = await Grid_Collection.find_one({"user": user["_id"]})
     if not grid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Grid not found for this user"
         )
-    grid["_id"] = str(grid["_id"])
-    grid["user"] = str(grid["user"])
     return grid
 
-@router.post("/update_units")
-async def update_units(units: int, token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = collection.find_one({"email": email}, {"_id": 1, "name": 0, "email": 0, "mobile": 0, "password": 0})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    grid = Grid_Collection.find_one({"user": ObjectId(user["_id"])})
+@router.post("/update_units", response_model=UnitsUpdated, dependencies=[Depends(admit("grid_write"))])
+async def update_units(units: int, user: dict = Depends(get_current_principal)):
+    grid = await Grid_Collection.find_one({"user": user["_id"]})
     if not grid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Grid not found for this user"
         )
-    Grid_Collection.update_one(
+    await Grid_Collection.update_one(
         {"_id": grid["_id"]},
         {"$set": {"units": units}})
+    await update_grid_state(user["_id"], units=units)
     return {"message": "Units updated successfully", "units": units}    
 
-@router.post("/sell_units")
-async def sell_units(units: int = Body(..., embed=True), token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
+@router.post(
+    "/readings",
+    response_model=ReadingsAccepted,
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(admit("grid_write"))],
+)
+async def ingest_readings(
+    batch: MeterReadingBatch,
+    wait: bool = True,
+    user: dict = Depends(get_current_principal)
+):
+    """Accept many meter readings for the caller's grids in one request.
+
+    Readings are group-committed by meter_buffer into the meter_readings
+    time-series collection, and each grid's live units follow its newest
+    reading. With wait=false the call returns once the readings are
+    buffered instead of after their batch commits.
+    """
+    if any(not ObjectId.is_valid(reading.grid_id) for reading in batch.readings):
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid grid_id"
         )
-    user = collection.find_one({"email": email}, {"_id": 1})
-    if not user:
+    grid_ids = {ObjectId(reading.grid_id) for reading in batch.readings}
+    owned = await Grid_Collection.distinct("_id", {"_id": {"$in": list(grid_ids)}, "user": user["_id"]})
+    if len(owned) != len(grid_ids):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
+            detail="Grid not found for this user"
         )
-    grid = Grid_Collection.find_one({"user": ObjectId(user["_id"])})
+    readings = [make_reading(ObjectId(r.grid_id), r.units, r.time) for r in batch.readings]
+    try:
+        committed = meter_buffer.add(readings)
+    except MeterBufferFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Meter ingest buffer is full",
+            headers={"Retry-After": "1"},
+        )
+    if wait:
+        await committed
+    else:
+        # Nobody awaits this one; retrieve a flush error so it isn't reported as unhandled
+        committed.add_done_callback(lambda future: future.cancelled() or future.exception())
+    return {"message": "Readings accepted", "count": len(readings), "committed": wait}
+
+@router.get("/readings/stats")
+async def get_reading_stats():
+    return meter_buffer.stats()
+
+@router.post("/sell_units", response_model=UnitsMovedToSell, dependencies=[Depends(admit("grid_write"))])
+async def sell_units(units: int = Body(..., embed=True), user: dict = Depends(get_current_principal)):
+    grid = await Grid_Collection.find_one({"user": user["_id"]}, {"_id": 1})
     if not grid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -135,40 +152,31 @@ async def sell_units(units: int = Body(..., embed=True), token: str = Depends(oa
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Units to sell must be positive."
         )
-    if grid["units"] < units:
+    # One conditional $inc, so purchases and escrows that land in between are never overwritten
+    grid = await Grid_Collection.find_one_and_update(
+        {"_id": grid["_id"], "units": {"$gte": units}},
+        {"$inc": {"units": -units, "units_for_sell": units}},
+        projection={"units": 1, "units_for_sell": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if not grid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Not enough units available to sell."
         )
-    new_units = grid["units"] - units
-    new_units_for_sell = grid.get("units_for_sell", 0) + units
-    Grid_Collection.update_one(
-        {"_id": grid["_id"]},
-        {"$set": {"units": new_units, "units_for_sell": new_units_for_sell}}
-    )
+    await Summary_Collection.update_one(
+        {"_id": user["_id"], "grid_id": grid["_id"]},
+        {"$inc": {"units": -units, "units_for_sell": units, "version": 1}})
+    await sell_pool.bump()
     return {
         "message": f"{units} units moved to sell pool.",
-        "units": new_units,
-        "units_for_sell": new_units_for_sell
+        "units": grid["units"],
+        "units_for_sell": grid["units_for_sell"]
     }
     
-@router.get("/get_unit_status")
-async def get_units(token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = collection.find_one({"email": email}, {"_id": 1})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    grid = Grid_Collection.find_one({"user": ObjectId(user["_id"])})
+@router.get("/get_unit_status", response_model=UnitStatus)
+async def get_units(user: dict = Depends(get_current_principal)):
+    grid = await Grid_Collection.find_one({"user": user["_id"]})
     if not grid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -179,31 +187,19 @@ async def get_units(token: str = Depends(oauth2_scheme)):
         "units_for_sell": grid.get("units_for_sell", 0)
     }
     
-@router.post("/update_grid")
-async def update_grid(ports: list[str] = Body(..., embed=True), token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    user = collection.find_one({"email": email}, {"_id": 1})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
-    grid = Grid_Collection.find_one({"user": ObjectId(user["_id"])})
+@router.post("/update_grid", response_model=MessageResponse, dependencies=[Depends(admit("grid_write"))])
+async def update_grid(ports: list[str] = Body(..., embed=True), user: dict = Depends(get_current_principal)):
+    grid = await Grid_Collection.find_one({"user": user["_id"]})
     if not grid:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Grid not found for this user"
         )
-    Grid_Collection.update_one(
+    await Grid_Collection.update_one(
         {"_id": grid["_id"]},
         {"$set": {"station": True,
             "ports": ports}})
+    await update_grid_state(user["_id"], station=True, ports=ports)
+    port_index.upsert_station({**grid, "station": True, "ports": ports})
     return {
         "message": "Grid updated successfully",}
\ No newline at end of file
@@ -0,0 +1,149 @@
+from auth import get_current_principal
+from admission import admit
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from database import db
+from bson import ObjectId
+from datetime import datetime, timezone
+from models import OrderRequest, OrderPlaced, OrderOut, OrderBookDepth, MessageResponse
+from order_book import Order, order_book, fill_writer, region_of, open_orders, Order_Collection
+from summaries import Summary_Collection
+
+Grid_Collection = db["user_grid"]
+
+router = APIRouter(prefix="/orders", tags=["orders"])
+
+async def escrow_ask_units(user_id, units):
+    """Move units out of the seller's grid into units_in_book, like sell_units does for units_for_sell."""
+    grid = await Grid_Collection.find_one_and_update(
+        {"user": user_id, "units": {"$gte": units}},
+        {"$inc": {"units": -units, "units_in_book": units}},
+        projection={"grid name": 1, "location": 1},
+    )
+    if not grid:
+        if not await Grid_Collection.find_one({"user": user_id}, {"_id": 1}):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Grid not found for this user"
+            )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Not enough units available to sell."
+        )
+    await Summary_Collection.update_one({"_id": user_id, "grid_id": grid["_id"]}, {"$inc": {"units": -units, "version": 1}})
+    return grid
+
+async def release_ask_units(order):
+    await Grid_Collection.update_one(
+        {"_id": order.grid},
+        {"$inc": {"units": order.units, "units_in_book": -order.units}})
+    await Summary_Collection.update_one({"_id": order.user, "grid_id": order.grid}, {"$inc": {"units": order.units, "version": 1}})
+
+async def cancel_open_order(order):
+    """Cancel in Mongo what this worker's book has left of the order.
+
+    Units of fills still in flight stay on the order for the fill writer to
+    take. False if another worker has filled or cancelled those units.
+    """
+    result = await Order_Collection.update_one(
+        {"_id": order.id, "status": "open", "units": {"$gte": order.units}},
+        {"$inc": {"units": -order.units}, "$set": {"status": "cancelled", "cancelled_units": order.units}})
+    return result.modified_count == 1
+
+@router.post("/", response_model=OrderPlaced, dependencies=[Depends(admit("purchase"))])
+async def place_order(request: OrderRequest, user: dict = Depends(get_current_principal)):
+    """Match a priced bid or ask against the book of its region.
+
+    Whatever doesn't fill rests on the book at its limit price. The call
+    returns once its fills are committed to transactions and user_grid.
+    """
+    grid = None
+    if request.side == "ask":
+        grid = await escrow_ask_units(user["_id"], request.units)
+        location = grid.get("location")
+    elif request.location is not None:
+        location = request.location.model_dump()
+    else:
+        buyer_grid = await Grid_Collection.find_one({"user": user["_id"]}, {"location": 1})
+        location = buyer_grid.get("location") if buyer_grid else None
+    if not location:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="location is required for a bid without a grid"
+        )
+    order = Order(
+        ObjectId(), request.side, user["_id"], region_of(location), request.price, request.units,
+        datetime.now(timezone.utc), user_name=user.get("name"),
+        grid=grid["_id"] if grid else None, grid_name=grid.get("grid name") if grid else None,
+    )
+    async with order_book.changes():
+        await Order_Collection.insert_one(order.to_doc())
+        fills = order_book.add(order)
+    remaining = order.units
+    if fills:
+        try:
+            await fill_writer.add(fills)
+        except Exception as e:
+            # The book was rebuilt without these fills; take the order back off it
+            async with order_book.changes():
+                reloaded = order_book.cancel(order.id, user["_id"])
+                if reloaded is not None and not await cancel_open_order(reloaded):
+                    reloaded = None
+            if reloaded is not None and reloaded.side == "ask":
+                await release_ask_units(reloaded)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Order could not be settled: {str(e)}",
+                headers={"Retry-After": "1"},
+            )
+    return {
+        "order_id": order.id,
+        "region": order.region,
+        "status": "open" if remaining else "filled",
+        "remaining_units": remaining,
+        "fills": [
+            {"transaction_id": fill["transaction_id"], "units": fill["units"], "price": fill["price"]}
+            for fill in fills
+        ]
+    }
+
+@router.delete("/{order_id}", response_model=MessageResponse, dependencies=[Depends(admit("purchase"))])
+async def cancel_order(order_id: str, user: dict = Depends(get_current_principal)):
+    if not ObjectId.is_valid(order_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid order_id"
+        )
+    async with order_book.changes():
+        order = order_book.cancel(ObjectId(order_id), user["_id"])
+        cancelled = order is not None and await cancel_open_order(order)
+    if order is not None and not cancelled:
+        # Another worker matched it first; this book is stale
+        await order_book.load()
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Order changed while cancelling, please retry",
+        )
+    if order is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No open order with this id"
+        )
+    if order.side == "ask":
+        await release_ask_units(order)
+    return {"message": f"Order cancelled, {order.units} units released"}
+
+@router.get("/mine", response_model=list[OrderOut])
+async def get_my_orders(user: dict = Depends(get_current_principal)):
+    return await Order_Collection.find(open_orders(user["_id"])).sort([("time", -1)]).to_list(length=None)
+
+@router.get("/book", response_model=OrderBookDepth)
+async def get_order_book(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    levels: int = Query(10, ge=1, le=100)
+):
+    return order_book.depth(region_of({"latitude": latitude, "longitude": longitude}), levels)
+
+@router.get("/stats")
+async def get_order_book_stats():
+    return {**order_book.stats(), "writer": fill_writer.stats()}
@@ -0,0 +1,83 @@
+from auth import get_current_principal
+from admission import admit
+from fastapi import APIRouter, HTTPException, status, Depends, Query
+from bson import ObjectId
+from datetime import datetime, timezone
+from models import PortHoldRequest, PortHold, StationAvailability, MessageResponse
+from stations import port_index, Hold_Collection
+
+router = APIRouter(prefix="/stations", tags=["stations"])
+
+def hold_out(hold):
+    return {
+        "hold_id": hold["hold"],
+        "grid_id": hold["_id"]["grid"],
+        "port": hold["_id"]["port"],
+        "port_type": hold["port_type"],
+        "expires_at": hold["expires_at"],
+    }
+
+@router.get("/nearby", response_model=list[StationAvailability])
+async def get_nearby_stations(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    port_type: str | None = None,
+    radius_km: float = Query(50, gt=0, le=1000),
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Stations with a free port of port_type (or any free port), nearest first, from the in-memory index."""
+    return port_index.nearby(latitude, longitude, port_type, radius_km, limit)
+
+@router.post("/reserve", response_model=PortHold, dependencies=[Depends(admit("purchase"))])
+async def reserve_port(request: PortHoldRequest, user: dict = Depends(get_current_principal)):
+    """Hold a free port of the requested type for hold_seconds; the hold lapses on its own afterwards."""
+    if not ObjectId.is_valid(request.grid_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid grid_id"
+        )
+    grid_id = ObjectId(request.grid_id)
+    station = port_index.stations.get(grid_id)
+    if station is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Charging station not found"
+        )
+    if request.port_type not in station.by_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Station has no {request.port_type} port"
+        )
+    hold = await port_index.reserve(grid_id, request.port_type, user["_id"], request.hold_seconds)
+    if hold is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"No free {request.port_type} port at this station"
+        )
+    return hold_out(hold)
+
+@router.delete("/holds/{hold_id}", response_model=MessageResponse, dependencies=[Depends(admit("purchase"))])
+async def release_port(hold_id: str, user: dict = Depends(get_current_principal)):
+    if not ObjectId.is_valid(hold_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid hold_id"
+        )
+    hold = await port_index.release(ObjectId(hold_id), user["_id"])
+    if hold is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No hold with this id"
+        )
+    return {"message": f"Port {hold['_id']['port']} released"}
+
+@router.get("/holds/mine", response_model=list[PortHold])
+async def get_my_holds(user: dict = Depends(get_current_principal)):
+    holds = await Hold_Collection.find(
+        {"user": user["_id"], "expires_at": {"$gt": datetime.now(timezone.utc)}}
+    ).to_list(length=None)
+    return [hold_out(hold) for hold in holds]
+
+@router.get("/stats")
+async def get_port_index_stats():
+    return port_index.stats()
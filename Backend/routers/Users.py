@@ -1,84 +1,69 @@
 import os
-from fastapi import APIRouter, HTTPException, status, Depends, Body
+from fastapi import APIRouter, HTTPException, status, Depends, Body, Query
 from database import db
 from bson import ObjectId
-from models import UserModel, UserLogin
-from passlib.context import CryptContext
+from typing import Literal
+from listing import list_documents
+from admission import admit
+from pymongo.errors import DuplicateKeyError
+from models import UserModel, UserLogin, RegisterResponse, TokenResponse, TokenValidity, UserOut
+from passwords import hash_password, verify_password, PasswordPoolSaturated
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt, JWTError,ExpiredSignatureError
-from datetime import datetime, timedelta
+from auth import (
+    oauth2_scheme, create_token, decode_token, verify_token,
+    get_current_principal, invalidate_user, auth_cache_stats,
+)
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 router = APIRouter(prefix="/user", tags=["users"])
 collection = db["users"]
 
-def convert_id(doc):
-    doc["_id"] = str(doc["_id"])
-    return doc
+# Password hashes are never listed
+USER_FIELDS = ("name", "email", "mobile", "walletAddress")
 
 @router.get("/")
-async def list_users():
-    users = collection.find()
-    users = list(users)
-    users = [convert_id(user) for user in users]
-    return users
-
-
-def hash_password(password):
-    return pwd_context.hash(password)
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-SECRET_KEY = os.getenv("SECRET_KEY", "secret_key")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+async def list_users(
+    limit: int | None = Query(None, ge=1, le=1000),
+    cursor: str | None = None,
+    fields: str | None = None,
+    format: Literal["json", "ndjson"] = "json"
+):
+    return await list_documents(collection, limit, cursor, fields, format, USER_FIELDS)
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+def password_pool_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
-def create_token(data: dict):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def decode_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except ExpiredSignatureError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token has expired",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-        
-@router.post("/register")
+@router.post("/register", response_model=RegisterResponse, dependencies=[Depends(admit("auth"))])
 async def register_user(user: UserModel):
-    if collection.find_one({"email": user.email}):
+    if await collection.find_one({"email": user.email}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    user.password = hash_password(user.password)
-    collection.insert_one({
-      "name" : user.name,
-      "email" : user.email,
-      "mobile" : user.mobile,
-      "password" : user.password
-    })
+    try:
+        user.password = await hash_password(user.password)
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
+    try:
+        await collection.insert_one({
+          "name" : user.name,
+          "email" : user.email,
+          "mobile" : user.mobile,
+          "password" : user.password
+        })
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
+    invalidate_user(user.email)
     
     token = create_token({"sub": user.email})
     return {
@@ -90,38 +75,38 @@ async def register_user(user: UserModel):
         }
     }
     
-@router.post("/login")
+@router.post("/login", response_model=TokenResponse, dependencies=[Depends(admit("auth"))])
 async def login(data: UserLogin):
-    user = collection.find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["password"]):
+    user = await collection.find_one({"email": data.email}, {"email": 1, "password": 1})
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    try:
+        valid, new_hash = await verify_password(data.password, user["password"])
+    except PasswordPoolSaturated:
+        raise password_pool_busy()
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        # Cost factor changed since this hash was made
+        await collection.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
     token = create_token({"sub": user["email"]})
     return {"token": token, "token_type": "bearer"}
 
-@router.get("/me")
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    user = collection.find_one({"email": email})
+@router.get("/me", response_model=UserOut)
+async def get_current_user(principal: dict = Depends(get_current_principal)):
+    user = await collection.find_one({"_id": principal["_id"]})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    return convert_id(user)
+    return user
 
-@router.get("/check_token_valid")
+@router.get("/check_token_valid", response_model=TokenValidity)
 async def check_token_valid(token: str = Depends(oauth2_scheme)):
     try:
-        payload = decode_token(token)
+        payload = verify_token(token)
         email = payload.get("sub")
         if not email:
             return {"valid": False, "message": "Invalid token: no subject."}
@@ -129,40 +114,31 @@ async def check_token_valid(token: str = Depends(oauth2_scheme)):
     except Exception as e:
         return {"valid": False, "message": str(e)}
 
-@router.post("/wallet")
+@router.get("/auth_cache_stats")
+async def get_auth_cache_stats():
+    return auth_cache_stats()
+
+@router.post("/wallet", response_model=UserOut)
 async def update_wallet_address(
     wallet_data: dict = Body(...),
-    token: str = Depends(oauth2_scheme)
+    principal: dict = Depends(get_current_principal)
 ):
-    payload = decode_token(token)
-    email = payload.get("sub")
-    if not email:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+    email = principal["email"]
     wallet_address = wallet_data.get("walletAddress")
     if not wallet_address:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="walletAddress is required"
         )
-    result = collection.update_one(
+    result = await collection.update_one(
         {"email": email},
         {"$set": {"walletAddress": wallet_address}}
     )
+    invalidate_user(email)
     if result.matched_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    user = collection.find_one({"email": email})
-    return convert_id(user)
-
-
-
-
-
-
-
+    user = await collection.find_one({"email": email})
+    return user
\ No newline at end of file
@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import bisect
+from pymongo import ReturnDocument
+from database import db
+
+
+# How long a worker trusts its last read of the shared version before asking Mongo again
+SELL_POOL_VERSION_TTL = float(os.getenv("SELL_POOL_VERSION_TTL", "1"))
+
+Grid_Collection = db["user_grid"]
+Counter_Collection = db["counters"]
+
+SELL_POOL_PIPELINE = [
+    {"$match": {"units_for_sell": {"$gt": 0}}},
+    {"$sort": {"_id": 1}},
+    # Resolve every seller name in the same round trip instead of one find_one per grid
+    {"$lookup": {
+        "from": "users",
+        "localField": "user",
+        "foreignField": "_id",
+        "pipeline": [{"$project": {"_id": 0, "name": 1}}],
+        "as": "owner",
+    }},
+    {"$project": {
+        "_id": 0,
+        "grid_id": {"$toString": "$_id"},
+        "grid_name": "$grid name",
+        "location": 1,
+        "units_for_sell": 1,
+        "user": {"$toString": "$user"},
+        "user_name": {"$first": "$owner.name"},
+    }},
+]
+
+
+def geo_near_stage(latitude, longitude, query, radius_km=None):
+    """$geoNear over the geo index of user_grid; distance is in metres."""
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [longitude, latitude]},
+        "key": "geo",
+        "distanceField": "distance",
+        "spherical": True,
+        "query": query,
+    }
+    if radius_km is not None:
+        geo_near["maxDistance"] = radius_km * 1000
+    return {"$geoNear": geo_near}
+
+
+def nearby_pipeline(latitude, longitude, query, limit, radius_km=None):
+    """The nearest limit grids matching query, as sell pool rows with station details and distance_km."""
+    return [
+        geo_near_stage(latitude, longitude, query, radius_km),
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"_id": 0, "name": 1}}],
+            "as": "owner",
+        }},
+        {"$project": {
+            "_id": 0,
+            "grid_id": {"$toString": "$_id"},
+            "grid_name": "$grid name",
+            "location": 1,
+            "units_for_sell": 1,
+            "station": {"$ifNull": ["$station", False]},
+            "ports": {"$ifNull": ["$ports", []]},
+            "user": {"$toString": "$user"},
+            "user_name": {"$first": "$owner.name"},
+            "distance_km": {"$divide": ["$distance", 1000]},
+        }},
+    ]
+
+
+class SellPoolSnapshot:
+    """In-process copy of every listed grid, tagged with the sell pool version.
+
+    The version is a counter document in Mongo that every write to the sell
+    pool bumps, so all uvicorn workers agree on it; each worker rebuilds its
+    snapshot only when the version it reads has moved on.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.sellers = []
+        self.grid_ids = []
+        self.known_version = None
+        self.checked_at = 0.0
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    async def current_version(self):
+        if self.known_version is not None and time.monotonic() - self.checked_at < SELL_POOL_VERSION_TTL:
+            return self.known_version
+        doc = await Counter_Collection.find_one({"_id": "sell_pool"}, {"version": 1})
+        self.known_version = doc["version"] if doc else 0
+        self.checked_at = time.monotonic()
+        return self.known_version
+
+    async def bump(self):
+        """Call after any committed change to units_for_sell or to a listed grid."""
+        doc = await Counter_Collection.find_one_and_update(
+            {"_id": "sell_pool"},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self.known_version = doc["version"]
+        self.checked_at = time.monotonic()
+
+    async def get(self, version):
+        if self.version == version:
+            self.hits += 1
+            return self.sellers
+        async with self.lock:
+            # Another request may have rebuilt it while this one waited
+            if self.version != version:
+                self.misses += 1
+                sellers = await Grid_Collection.aggregate(SELL_POOL_PIPELINE).to_list(length=None)
+                self.sellers, self.grid_ids = sellers, [s["grid_id"] for s in sellers]
+                self.version = version
+            else:
+                self.hits += 1
+        return self.sellers
+
+    def view(self, user_id, limit=None, cursor=None):
+        """The sellers one user sees: everyone else's grids, after cursor, up to limit."""
+        start = bisect.bisect_right(self.grid_ids, cursor) if cursor else 0
+        result = []
+        for seller in self.sellers[start:]:
+            if seller["user"] == user_id:
+                continue
+            result.append(seller)
+            if limit is not None and len(result) == limit:
+                break
+        return result
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "version": self.version,
+            "sellers": len(self.sellers),
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+sell_pool = SellPoolSnapshot()
@@ -0,0 +1,29 @@
+from decimal import Decimal
+import orjson
+from bson import ObjectId, Decimal128
+from fastapi.responses import JSONResponse
+
+
+def bson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class BSONJSONResponse(JSONResponse):
+    """orjson-backed default response that also encodes ObjectId and Decimal128.
+
+    orjson writes datetimes as ISO 8601 natively. As the default response
+    class it only replaces the final json.dumps: FastAPI still runs the
+    return value through the response_model or jsonable_encoder first, and
+    jsonable_encoder cannot encode ObjectId. Routes without a response_model
+    that return raw Mongo documents must return BSONJSONResponse(docs)
+    themselves, as listing.list_documents does.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=bson_default, option=orjson.OPT_NON_STR_KEYS)
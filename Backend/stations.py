@@ -0,0 +1,332 @@
+import os
+import math
+import time
+import heapq
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from database import db
+
+
+PORT_CELL_DEGREES = float(os.getenv("PORT_CELL_DEGREES", "0.05"))
+
+Grid_Collection = db["user_grid"]
+Hold_Collection = db["port_holds"]
+
+STATION_FIELDS = {"grid name": 1, "user": 1, "location": 1, "station": 1, "ports": 1}
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def cell_of(latitude, longitude):
+    return math.floor(latitude / PORT_CELL_DEGREES), math.floor(longitude / PORT_CELL_DEGREES)
+
+
+def haversine(phi1, lam1, cos_phi1, phi2, lam2, cos_phi2):
+    """The haversine of the central angle; grows with distance, so it ranks like distance_km."""
+    return math.sin((phi2 - phi1) / 2) ** 2 + cos_phi1 * cos_phi2 * math.sin((lam2 - lam1) / 2) ** 2
+
+
+def haversine_km(h):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    return haversine_km(haversine(phi1, math.radians(lon1), math.cos(phi1), phi2, math.radians(lon2), math.cos(phi2)))
+
+
+def ring_reach_km(latitude, longitude, cx, cy, r):
+    """A lower bound on the distance from the point to any cell of ring r around its cell (cx, cy).
+
+    Ring r lies outside the square of cells cx - r + 1 .. cx + r - 1, so the
+    nearest it can be is the nearest side of that square: the parallels at
+    its top and bottom, or the meridians at its left and right.
+    """
+    if r == 0:
+        return 0.0
+    north = (cx + r) * PORT_CELL_DEGREES - latitude
+    south = latitude - (cx - r + 1) * PORT_CELL_DEGREES
+    east = (cy + r) * PORT_CELL_DEGREES - longitude
+    west = longitude - (cy - r + 1) * PORT_CELL_DEGREES
+    to_parallel = min(north, south) * KM_PER_DEGREE
+    # Distance from a point to a meridian delta degrees away, along a great circle
+    delta = math.radians(min(90.0, min(east, west)))
+    to_meridian = EARTH_RADIUS_KM * math.asin(math.cos(math.radians(latitude)) * math.sin(delta))
+    return min(to_parallel, to_meridian)
+
+
+def hold_key(grid_id, port):
+    # One hold document per port, so _id uniqueness is what makes a reservation atomic
+    return {"grid": grid_id, "port": port}
+
+
+class Station:
+    """A station's ports and, per port, until when it is held (epoch seconds; free once passed).
+
+    free_at keeps, per port type and under None for any type, the earliest
+    time one of those ports is free, so checking a station is one lookup.
+    """
+
+    __slots__ = ("grid", "grid_name", "user", "latitude", "longitude", "phi", "lam", "cos_phi",
+                 "cell", "ports", "expires", "by_type", "free_at")
+
+    def __init__(self, grid, grid_name, user, latitude, longitude, ports):
+        self.grid, self.grid_name, self.user = grid, grid_name, user
+        self.latitude, self.longitude = latitude, longitude
+        self.phi, self.lam = math.radians(latitude), math.radians(longitude)
+        self.cos_phi = math.cos(self.phi)
+        self.cell = cell_of(latitude, longitude)
+        self.ports = list(ports)
+        self.expires = [0.0] * len(self.ports)
+        self.by_type = {}
+        for port, port_type in enumerate(self.ports):
+            self.by_type.setdefault(port_type, []).append(port)
+        self.free_at = dict.fromkeys([None, *self.by_type], 0.0)
+
+    def hold(self, port, until):
+        """Mark a port held until the given epoch seconds; 0 frees it."""
+        self.expires[port] = until
+        port_type = self.ports[port]
+        self.free_at[port_type] = min(self.expires[p] for p in self.by_type[port_type])
+        self.free_at[None] = min(self.expires)
+
+    def free(self, port_type, now):
+        return sum(1 for port in self.by_type.get(port_type, ()) if self.expires[port] <= now)
+
+    def free_ports(self, now):
+        return {port_type: self.free(port_type, now) for port_type in self.by_type}
+
+    def to_dict(self, now, distance):
+        return {
+            "grid_id": str(self.grid),
+            "grid_name": self.grid_name,
+            "location": {"latitude": self.latitude, "longitude": self.longitude},
+            "distance_km": round(distance, 3),
+            "total_ports": len(self.ports),
+            "free_ports": self.free_ports(now),
+        }
+
+
+class PortIndex:
+    """Charging stations and port holds of every grid, in memory, for nearby lookups.
+
+    Stations are bucketed into square cells of PORT_CELL_DEGREES, once per
+    port type and once under None for any type. nearby() walks the rings
+    of cells around the point outward and stops once the next ring is
+    farther than the limit-th best station, so a lookup touches a few
+    cells whatever the number of stations.
+
+    port_holds in Mongo is the source of truth: reserve() is a conditional
+    upsert on the port's hold document, so two workers can never hold one
+    port. The index follows user_grid and port_holds as a listener on the
+    EventHub's change stream, and applies this worker's own writes right
+    away.
+    """
+
+    # Change stream filters for EventHub.add_listener
+    changes = [
+        {"ns.coll": "port_holds"},
+        {"ns.coll": "user_grid", "operationType": {"$in": ["insert", "update", "replace"]}},
+    ]
+
+    def __init__(self):
+        self.stations = {}
+        self.cells = {}
+        self.bounds = None
+        self.lookups = 0
+        self.reserved = 0
+        self.conflicts = 0
+        self.released = 0
+
+    def bucket_keys(self, station):
+        return [(None, *station.cell)] + [(port_type, *station.cell) for port_type in station.by_type]
+
+    def remove_station(self, grid_id):
+        station = self.stations.pop(grid_id, None)
+        if station is None:
+            return None
+        for key in self.bucket_keys(station):
+            bucket = self.cells.get(key)
+            if bucket is not None:
+                bucket.pop(grid_id, None)
+                if not bucket:
+                    del self.cells[key]
+        return station
+
+    def upsert_station(self, grid):
+        """Index a grid document, or drop it when it is no longer a station with ports and a location."""
+        old = self.remove_station(grid["_id"])
+        location = grid.get("location")
+        if not grid.get("station") or not grid.get("ports") or not location:
+            return None
+        station = Station(
+            grid["_id"], grid.get("grid name"), grid.get("user"),
+            location["latitude"], location["longitude"], grid["ports"],
+        )
+        if old is not None:
+            # Holds stay on their port number while the port still exists
+            for port in range(min(len(old.expires), len(station.expires))):
+                station.hold(port, old.expires[port])
+        self.stations[station.grid] = station
+        for key in self.bucket_keys(station):
+            self.cells.setdefault(key, {})[station.grid] = station
+        x, y = station.cell
+        if self.bounds is None:
+            self.bounds = [x, y, x, y]
+        else:
+            self.bounds = [min(self.bounds[0], x), min(self.bounds[1], y),
+                           max(self.bounds[2], x), max(self.bounds[3], y)]
+        return station
+
+    def apply_hold(self, hold):
+        """Set a port's expiry from a port_holds document, or clear it when expires_at is None."""
+        station = self.stations.get(hold["_id"]["grid"])
+        port = hold["_id"]["port"]
+        if station is None or port >= len(station.expires):
+            return
+        expires_at = hold.get("expires_at")
+        if expires_at is None:
+            station.hold(port, 0.0)
+        else:
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            station.hold(port, expires_at.timestamp())
+
+    def ring(self, cx, cy, r):
+        """Cells at ring distance r around (cx, cy), leaving out those outside the stations' bounds."""
+        x0, y0, x1, y1 = self.bounds
+        if r == 0:
+            yield cx, cy
+            return
+        for y in (cy - r, cy + r):
+            if y0 <= y <= y1:
+                for x in range(max(cx - r, x0), min(cx + r, x1) + 1):
+                    yield x, y
+        for x in (cx - r, cx + r):
+            if x0 <= x <= x1:
+                for y in range(max(cy - r + 1, y0), min(cy + r - 1, y1) + 1):
+                    yield x, y
+
+    def nearby(self, latitude, longitude, port_type=None, radius_km=None, limit=10, now=None):
+        """Up to limit stations with a free port of port_type (any type when None), nearest first."""
+        self.lookups += 1
+        if self.bounds is None:
+            return []
+        now = time.time() if now is None else now
+        cx, cy = cell_of(latitude, longitude)
+        phi, lam = math.radians(latitude), math.radians(longitude)
+        cos_phi = math.cos(phi)
+        # Compared as haversines, so the loop needs no asin or sqrt
+        within = math.sin(radius_km / (2 * EARTH_RADIUS_KM)) ** 2 if radius_km is not None else 1.0
+        # The largest ring that can still hold a station
+        last = max(cx - self.bounds[0], self.bounds[2] - cx, cy - self.bounds[1], self.bounds[3] - cy)
+        best = []
+        cells, sin = self.cells, math.sin
+        for r in range(last + 1):
+            reach = ring_reach_km(latitude, longitude, cx, cy, r)
+            if radius_km is not None and reach > radius_km:
+                break
+            if len(best) >= limit and reach > haversine_km(-best[0][0]):
+                break
+            for x, y in self.ring(cx, cy, r):
+                bucket = cells.get((port_type, x, y))
+                if bucket is None:
+                    continue
+                for station in bucket.values():
+                    if station.free_at[port_type] > now:
+                        continue
+                    # haversine() inlined; this loop is the whole cost of a lookup
+                    h = sin((station.phi - phi) / 2) ** 2 + cos_phi * station.cos_phi * sin((station.lam - lam) / 2) ** 2
+                    if h > within:
+                        continue
+                    if len(best) < limit:
+                        heapq.heappush(best, (-h, id(station), station))
+                    elif h < -best[0][0]:
+                        heapq.heapreplace(best, (-h, id(station), station))
+        return [station.to_dict(now, haversine_km(-h)) for h, _, station in sorted(best, reverse=True)]
+
+    async def reserve(self, grid_id, port_type, user_id, hold_seconds):
+        """Hold a free port of port_type at a station; returns the hold, or None when none is free."""
+        station = self.stations.get(grid_id)
+        if station is None:
+            return None
+        now = datetime.now(timezone.utc)
+        expires_at = datetime.fromtimestamp(now.timestamp() + hold_seconds, tz=timezone.utc)
+        for port in station.by_type.get(port_type, ()):
+            if station.expires[port] > now.timestamp():
+                continue
+            hold = {
+                "_id": hold_key(grid_id, port),
+                "hold": ObjectId(),
+                "user": user_id,
+                "port_type": port_type,
+                "time": now,
+                "expires_at": expires_at,
+            }
+            try:
+                # Matches only an expired hold; a live one makes the upsert collide on _id
+                await Hold_Collection.update_one(
+                    {"_id": hold["_id"], "expires_at": {"$lte": now}},
+                    {"$set": {key: value for key, value in hold.items() if key != "_id"}},
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                # Held through another worker; the change stream hasn't told us yet
+                self.conflicts += 1
+                current = await Hold_Collection.find_one({"_id": hold["_id"]})
+                if current:
+                    self.apply_hold(current)
+                continue
+            self.apply_hold(hold)
+            self.reserved += 1
+            return hold
+        return None
+
+    async def release(self, hold_id, user_id):
+        """Give up a hold early; returns the released hold, or None if it isn't the user's live hold."""
+        hold = await Hold_Collection.find_one_and_delete({"hold": hold_id, "user": user_id})
+        if hold is None:
+            return None
+        self.apply_hold({"_id": hold["_id"], "expires_at": None})
+        self.released += 1
+        return hold
+
+    async def load(self):
+        """Rebuild the index from the stations in user_grid and the live holds in port_holds."""
+        fresh = PortIndex()
+        async for grid in Grid_Collection.find({"station": True}, STATION_FIELDS):
+            fresh.upsert_station(grid)
+        async for hold in Hold_Collection.find({"expires_at": {"$gt": datetime.now(timezone.utc)}}):
+            fresh.apply_hold(hold)
+        self.stations, self.cells, self.bounds = fresh.stations, fresh.cells, fresh.bounds
+        return len(self.stations)
+
+    async def handle_change(self, change):
+        coll = change["ns"]["coll"]
+        if coll == "port_holds":
+            if change["operationType"] == "delete":
+                self.apply_hold({"_id": change["documentKey"]["_id"], "expires_at": None})
+            elif change.get("fullDocument"):
+                self.apply_hold(change["fullDocument"])
+        elif coll == "user_grid" and change.get("fullDocument"):
+            updated = change.get("updateDescription", {}).get("updatedFields")
+            # The hub hands over every grid update, meter readings included
+            if updated is None or any(field in STATION_FIELDS for field in updated):
+                self.upsert_station(change["fullDocument"])
+
+    def stats(self):
+        now = time.time()
+        return {
+            "stations": len(self.stations),
+            "ports": sum(len(station.ports) for station in self.stations.values()),
+            "held_ports": sum(expires > now for station in self.stations.values() for expires in station.expires),
+            "cells": len(self.cells),
+            "lookups": self.lookups,
+            "reserved": self.reserved,
+            "conflicts": self.conflicts,
+            "released": self.released,
+        }
+
+
+port_index = PortIndex()
@@ -0,0 +1,141 @@
+import os
+import asyncio
+from datetime import datetime, timezone
+from pymongo import ReturnDocument, UpdateOne
+from database import db
+from history import format_transaction
+from archive import history_totals, history_page
+
+
+DASHBOARD_RECENT_TRANSACTIONS = int(os.getenv("DASHBOARD_RECENT_TRANSACTIONS", "10"))
+SUMMARY_BUILD_RETRIES = int(os.getenv("SUMMARY_BUILD_RETRIES", "5"))
+
+Summary_Collection = db["dashboard_summary"]
+Grid_Collection = db["user_grid"]
+
+# Summary documents are keyed by the user's _id and mirror the grid that
+# find_one({"user": ...}) returns, like every /grid endpoint does.
+#
+# The write paths only update summaries that already exist. A missing one
+# is built from the source collections on its first read (build_summary),
+# so a user who never opened the dashboard costs the write paths nothing.
+#
+# Every write path also does $inc {"version": 1}. build_summary only
+# replaces the version it started from, so a write that lands while the
+# totals are being computed makes it start over instead of being lost.
+
+
+def grid_state(grid):
+    return {
+        "grid_id": grid["_id"],
+        "grid_name": grid.get("grid name"),
+        "units": grid.get("units", 0),
+        "units_for_sell": grid.get("units_for_sell", 0),
+        "station": grid.get("station", False),
+        "ports": grid.get("ports", []),
+    }
+
+
+async def update_grid_state(user_id, **fields):
+    """Copy changed grid fields into the owner's summary after a /grid write."""
+    await Summary_Collection.update_one({"_id": user_id}, {"$set": fields, "$inc": {"version": 1}})
+
+
+def push_recent(entry):
+    return {"recent_transactions": {
+        "$each": [entry],
+        "$position": 0,
+        "$slice": DASHBOARD_RECENT_TRANSACTIONS,
+    }}
+
+
+def purchase_updates(transaction, seller_id, buyer_name=None, grid_name=None, listed=True):
+    """Summary updates for one purchase: the buyer's bought side and the seller's sold side.
+
+    A purchase from an own grid counts as bought only, same as the
+    transaction history. For listed units the grid's units_for_sell drops
+    either way, in the owner's summary only if it mirrors that grid; order
+    book fills (listed=False) come out of units_in_book.
+    """
+    buyer_id, units, grid_id = transaction["buyer"], transaction["units"], transaction["grid"]
+    row = {
+        "_id": transaction["_id"],
+        "user_name": buyer_name,
+        "grid_name": grid_name,
+        "units": units,
+        "time": transaction["time"],
+        "status": transaction.get("status"),
+    }
+    updates = [UpdateOne(
+        {"_id": buyer_id},
+        {
+            "$inc": {"lifetime_bought": units, "total_transactions": 1, "version": 1},
+            "$push": push_recent(format_transaction({**row, "role": "bought"})),
+        },
+    )]
+    if seller_id and seller_id != buyer_id:
+        updates.append(UpdateOne(
+            {"_id": seller_id},
+            {
+                "$inc": {"lifetime_sold": units, "total_transactions": 1, "version": 1},
+                "$push": push_recent(format_transaction({**row, "role": "sold"})),
+            },
+        ))
+    if listed and seller_id:
+        updates.append(UpdateOne(
+            {"_id": seller_id, "grid_id": grid_id},
+            {"$inc": {"units_for_sell": -units, "version": 1}},
+        ))
+    return updates
+
+
+async def build_summary(user_id):
+    """Compute a user's summary from user_grid, transactions and the archived periods, and store it.
+
+    A missing summary is first created as a placeholder without built_at,
+    so the writes made during the build have a version to bump. If the
+    version moved, the build is redone, up to SUMMARY_BUILD_RETRIES times;
+    after that the computed summary is returned without being stored.
+    """
+    for _ in range(SUMMARY_BUILD_RETRIES):
+        current = await Summary_Collection.find_one_and_update(
+            {"_id": user_id},
+            {"$setOnInsert": {"version": 0}},
+            projection={"version": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        version = current.get("version")
+        summary = await compute_summary(user_id, version or 0)
+        # A summary stored before versions existed has none; None matches that
+        result = await Summary_Collection.replace_one({"_id": user_id, "version": version}, summary)
+        if result.matched_count:
+            return summary
+    print(f"Dashboard summary of {user_id} kept changing, not stored after {SUMMARY_BUILD_RETRIES} builds")
+    return summary
+
+
+async def compute_summary(user_id, version):
+    grid = await Grid_Collection.find_one({"user": user_id})
+    grid_ids = await Grid_Collection.distinct("_id", {"user": user_id})
+    totals, recent = await asyncio.gather(
+        history_totals(user_id, grid_ids),
+        history_page(user_id, grid_ids, DASHBOARD_RECENT_TRANSACTIONS),
+    )
+    return {
+        "_id": user_id,
+        "grid_id": None,
+        "grid_name": None,
+        "units": 0,
+        "units_for_sell": 0,
+        "station": False,
+        "ports": [],
+        **(grid_state(grid) if grid else {}),
+        "lifetime_bought": totals["bought"],
+        "lifetime_sold": totals["sold"],
+        "total_transactions": totals["count"],
+        "recent_transactions": [format_transaction(tx) for tx in recent],
+        "built_at": datetime.now(timezone.utc),
+        "version": version,
+    }
+
@@ -0,0 +1,47 @@
+"""Tests run against mongomock_motor instead of a live MongoDB:
+
+    pip install pytest mongomock-motor
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+from mongomock import aggregate as mongomock_aggregate
+from mongomock.collection import BulkOperationBuilder
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+# mongomock rejects $lookup with a pipeline. Ours only $project the joined
+# documents, so run them as plain localField/foreignField lookups.
+_lookup = mongomock_aggregate._PIPELINE_HANDLERS["$lookup"]
+mongomock_aggregate._PIPELINE_HANDLERS["$lookup"] = lambda collection, database, options: _lookup(
+    collection, database, {key: value for key, value in options.items() if key != "pipeline"})
+
+
+def without_sort(add):
+    # pymongo >= 4.9 passes sort= to bulk builders, which mongomock predates
+    def wrapper(self, *args, sort=None, **kwargs):
+        assert sort is None, "mongomock cannot sort bulk updates"
+        return add(self, *args, **kwargs)
+    return wrapper
+
+
+BulkOperationBuilder.add_update = without_sort(BulkOperationBuilder.add_update)
+BulkOperationBuilder.add_replace = without_sort(BulkOperationBuilder.add_replace)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db():
+    """A fresh in-process mongomock database per test."""
+    database.use_client(AsyncMongoMockClient())
+    yield database.db
+    database.close()
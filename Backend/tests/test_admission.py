@@ -0,0 +1,156 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+import admission
+from admission import AdmissionGroup, TokenBuckets
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission, "time", clock)
+    return clock
+
+
+def group(concurrency=1, queue=2, wait_ms=1000):
+    return AdmissionGroup("test", concurrency, queue, wait_ms, rate=0, burst=0)
+
+
+async def queued(group, key):
+    task = asyncio.create_task(group.acquire(key))
+    await asyncio.sleep(0)
+    return task
+
+
+def test_bucket_spends_its_burst_then_refills_at_rate(clock):
+    buckets = TokenBuckets(rate=2, burst=3)
+    assert [buckets.take("a") for _ in range(3)] == [0, 0, 0]
+    assert buckets.take("a") == pytest.approx(0.5)
+    # Other keys have buckets of their own
+    assert buckets.take("b") == 0
+
+    clock.now += 0.5
+    assert buckets.take("a") == 0
+    assert buckets.take("a") > 0
+
+
+def test_buckets_forget_the_least_recently_used_key(clock):
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+    buckets.take("a")
+    buckets.take("b")
+    buckets.take("a")
+    buckets.take("c")
+    assert list(buckets.buckets) == ["a", "c"]
+    # A forgotten key starts over with a full bucket
+    assert buckets.take("b") == 0
+
+
+def test_zero_rate_never_limits(clock):
+    buckets = TokenBuckets(rate=0, burst=0)
+    assert all(buckets.take("a") == 0 for _ in range(100))
+    assert not buckets.buckets
+
+
+@pytest.mark.anyio
+async def test_rate_limited_caller_gets_429_with_retry_after(clock):
+    limited = AdmissionGroup("test", 1, 1, 1000, rate=0.5, burst=1)
+    await limited.acquire("a")
+    limited.release()
+    with pytest.raises(HTTPException) as error:
+        await limited.acquire("a")
+    assert error.value.status_code == 429
+    assert error.value.headers["Retry-After"] == "2"
+    assert limited.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_released_slots_go_to_waiters_in_arrival_order():
+    slots = group(queue=3)
+    await slots.acquire("a")
+    first, second = await queued(slots, "b"), await queued(slots, "c")
+    # A newcomer queues behind the waiters even if a slot is free by then
+    slots.release()
+    third = await queued(slots, "d")
+    await first
+    assert not second.done() and not third.done()
+    assert slots.in_flight == 1
+
+    slots.release()
+    await second
+    assert not third.done()
+    slots.release()
+    await third
+    slots.release()
+    assert (slots.in_flight, len(slots.waiters), slots.admitted) == (0, 0, 4)
+
+
+@pytest.mark.anyio
+async def test_full_queue_is_rejected_right_away():
+    slots = group(queue=1, wait_ms=3000)
+    await slots.acquire("a")
+    waiting = await queued(slots, "b")
+    with pytest.raises(HTTPException) as error:
+        await slots.acquire("c")
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == "3"
+    assert slots.queue_full == 1
+
+    slots.release()
+    await waiting
+    slots.release()
+
+
+@pytest.mark.anyio
+async def test_queued_caller_times_out_and_leaves_the_queue():
+    slots = group(wait_ms=20)
+    await slots.acquire("a")
+    with pytest.raises(HTTPException) as error:
+        await slots.acquire("b")
+    assert error.value.status_code == 503
+    assert (slots.timed_out, len(slots.waiters), slots.in_flight) == (1, 0, 1)
+
+    slots.release()
+    assert slots.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_leaves_the_queue():
+    slots = group()
+    await slots.acquire("a")
+    waiting = await queued(slots, "b")
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert not slots.waiters
+
+    slots.release()
+    assert slots.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_waiter_cancelled_at_the_handoff_never_loses_the_slot():
+    slots = group()
+    await slots.acquire("a")
+    first, second = await queued(slots, "b"), await queued(slots, "c")
+    # The slot is handed to first, whose client disconnects before it resumes
+    slots.release()
+    first.cancel()
+    (outcome,) = await asyncio.gather(first, return_exceptions=True)
+    if not isinstance(outcome, asyncio.CancelledError):
+        # Before Python 3.12, wait_for keeps a result that arrives with the cancel;
+        # the caller then holds the slot and its dependency releases it
+        slots.release()
+    await second
+    assert (slots.in_flight, len(slots.waiters)) == (1, 0)
+
+    slots.release()
+    assert slots.in_flight == 0
@@ -0,0 +1,74 @@
+import pytest
+from fastapi import HTTPException
+import auth
+from auth import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(auth, "time", clock)
+    return clock
+
+
+def test_entries_expire_at_their_own_time(clock):
+    cache = TTLCache(10)
+    cache.set("short", 1, clock.now + 5)
+    cache.set("long", 2, clock.now + 60)
+
+    clock.now += 5
+    assert cache.get("short") is None
+    assert cache.get("long") == 2
+    assert "short" not in cache.entries
+    assert cache.stats() == {"size": 1, "hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(2)
+    cache.set("a", 1, clock.now + 60)
+    cache.set("b", 2, clock.now + 60)
+    cache.get("a")
+    cache.set("c", 3, clock.now + 60)
+    assert list(cache.entries) == ["a", "c"]
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(auth, "token_cache", TTLCache(10))
+    monkeypatch.setattr(auth, "user_cache", TTLCache(10))
+
+
+@pytest.mark.anyio
+async def test_principal_is_read_once_per_ttl(db, clock, caches):
+    user_id = (await db["users"].insert_one({"email": "asha@example.com", "name": "Asha"})).inserted_id
+    token = auth.create_token({"sub": "asha@example.com"})
+
+    first = await auth.get_current_principal(token)
+    await db["users"].update_one({"_id": user_id}, {"$set": {"name": "Asha R"}})
+    assert await auth.get_current_principal(token) == first == {"_id": user_id, "email": "asha@example.com", "name": "Asha"}
+    assert (auth.user_cache.misses, auth.user_cache.hits) == (1, 1)
+    assert auth.token_cache.hits == 1
+
+    clock.now += auth.AUTH_USER_CACHE_TTL
+    assert (await auth.get_current_principal(token))["name"] == "Asha R"
+
+
+@pytest.mark.anyio
+async def test_invalidated_user_is_read_again(db, clock, caches):
+    user_id = (await db["users"].insert_one({"email": "asha@example.com", "name": "Asha"})).inserted_id
+    token = auth.create_token({"sub": "asha@example.com"})
+    await auth.get_current_principal(token)
+
+    await db["users"].delete_one({"_id": user_id})
+    auth.invalidate_user("asha@example.com")
+    with pytest.raises(HTTPException) as error:
+        await auth.get_current_principal(token)
+    assert error.value.status_code == 401
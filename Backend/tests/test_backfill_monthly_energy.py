@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from archive import period_start
+from backfill_monthly_energy import rebuild_monthly_energy
+
+
+@pytest.mark.anyio
+async def test_rows_archived_but_not_yet_deleted_count_once(db):
+    buyer, seller, grid = ObjectId(), ObjectId(), ObjectId()
+    await db["user_grid"].insert_one({"_id": grid, "user": seller, "grid name": "Grid"})
+    january = {"_id": ObjectId(), "grid": grid, "buyer": buyer, "units": 5,
+               "time": datetime(2024, 1, 10, tzinfo=timezone.utc)}
+    february = {"_id": ObjectId(), "grid": grid, "buyer": buyer, "units": 7,
+                "time": datetime(2024, 2, 10, tzinfo=timezone.utc)}
+    # January has been copied to its archive and the watermark moved past
+    # it, but its hot copy is still waiting out delete_archived's delay
+    await db["transactions_2024_01"].insert_one(january)
+    await db["transactions"].insert_many([january, february])
+    await db["archive_state"].insert_one(
+        {"_id": "transactions", "periods": ["2024_01"], "watermark": period_start("2024_02")})
+
+    assert await rebuild_monthly_energy() == 4
+
+    rollups = {
+        (doc["user"], doc["month"]): (doc["bought"], doc["sold"])
+        async for doc in db["monthly_energy"].find({"year": 2024})
+    }
+    assert rollups == {
+        (buyer, 1): (5, 0),
+        (buyer, 2): (7, 0),
+        (seller, 1): (0, 5),
+        (seller, 2): (0, 7),
+    }
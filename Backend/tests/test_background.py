@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+from background import StartupStep
+
+
+@pytest.mark.anyio
+async def test_startup_step_is_retried_until_it_succeeds(capsys):
+    calls = []
+
+    async def load():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            raise ConnectionError("no primary")
+
+    step = StartupStep("order_book.load", load)
+    await step.first()
+    assert not step.done
+    assert "STARTUP FAILED: order_book.load" in capsys.readouterr().out
+
+    await asyncio.wait_for(step.task, 1)
+    assert step.done and calls == [0, 1]
+    await step.stop()
@@ -0,0 +1,27 @@
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from models import BulkPurchase
+from routers import Energypool
+
+
+@pytest.mark.anyio
+async def test_cheapest_is_rejected_while_listed_grids_have_no_price(db):
+    with pytest.raises(HTTPException) as error:
+        await Energypool.buy_energy_bulk(BulkPurchase(total_units=5, strategy="cheapest"), {"_id": ObjectId()})
+    assert error.value.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_oldest_fills_from_grids_in_listing_order(db):
+    buyer, seller = ObjectId(), ObjectId()
+    grids = [ObjectId() for _ in range(3)]
+    await db["user_grid"].insert_many([
+        {"_id": grids[2], "user": seller, "units_for_sell": 4},
+        {"_id": grids[0], "user": seller, "units_for_sell": 1},
+        {"_id": grids[1], "user": buyer, "units_for_sell": 2},
+        {"_id": ObjectId(), "user": seller, "units_for_sell": 0},
+    ])
+
+    candidates = await Energypool.bulk_candidates(buyer, BulkPurchase(total_units=5))
+    assert candidates == [grids[0], grids[2]]
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+from events import EventHub
+from stations import PortIndex, hold_key
+
+
+class Recorder:
+    changes = [{"ns.coll": "port_holds"}]
+
+    def __init__(self):
+        self.seen = []
+        self.loads = 0
+
+    async def handle_change(self, change):
+        self.seen.append(change)
+
+    async def load(self):
+        self.loads += 1
+
+
+def grid_change(grid, updated=None):
+    change = {"ns": {"coll": "user_grid"}, "operationType": "update" if updated else "insert", "fullDocument": grid}
+    if updated:
+        change["updateDescription"] = {"updatedFields": updated}
+    return change
+
+
+def test_listener_filters_join_the_hub_pipeline():
+    hub = EventHub()
+    hub.add_listener(Recorder())
+    changes = hub.pipeline()[0]["$match"]["$or"]
+    assert {"ns.coll": "port_holds"} in changes
+    assert changes[0]["ns.coll"] == {"$in": ["user_grid", "transactions"]}
+
+
+@pytest.mark.anyio
+async def test_hub_hands_changes_to_the_port_index():
+    hub, index = EventHub(), PortIndex()
+    hub.add_listener(index)
+    grid = {"_id": ObjectId(), "grid name": "Station", "user": ObjectId(), "station": True,
+            "location": {"latitude": 9.9, "longitude": 76.2}, "ports": ["CCS2", "Type 2"], "units": 10}
+    await hub.handle_change(grid_change(grid))
+    station = index.stations[grid["_id"]]
+
+    hold_id = hold_key(grid["_id"], 0)
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
+    await hub.handle_change({"ns": {"coll": "port_holds"}, "operationType": "insert",
+                             "fullDocument": {"_id": hold_id, "expires_at": expires_at}})
+    assert station.expires[0] == expires_at.timestamp()
+
+    # A meter reading leaves the indexed station alone, a port change replaces it
+    await hub.handle_change(grid_change({**grid, "units": 11}, {"units": 11}))
+    assert index.stations[grid["_id"]] is station
+    await hub.handle_change(grid_change({**grid, "ports": ["CCS2"]}, {"ports": ["CCS2"]}))
+    assert index.stations[grid["_id"]].ports == ["CCS2"]
+    assert index.stations[grid["_id"]].expires == [expires_at.timestamp()]
+
+    await hub.handle_change({"ns": {"coll": "port_holds"}, "operationType": "delete", "documentKey": {"_id": hold_id}})
+    assert index.stations[grid["_id"]].expires == [0.0]
+
+
+@pytest.mark.anyio
+async def test_lost_history_reloads_listeners():
+    hub, recorder = EventHub(), Recorder()
+    hub.add_listener(recorder)
+    hub.resume_token = {"_data": "token"}
+
+    error = Exception("resume point lost")
+    error.code = 286
+    await hub.failed(error)
+    assert (hub.resume_token, recorder.loads) == (None, 1)
+
+    await hub.failed(Exception("not primary"))
+    assert recorder.loads == 1
+
+
+@pytest.mark.anyio
+async def test_sales_reach_the_seller_without_a_grid_read_each(db):
+    hub, seller = EventHub(), ObjectId()
+    grid_id = (await db["user_grid"].insert_one({"user": seller, "units_for_sell": 5})).inserted_id
+    sub = hub.subscribe(seller)
+
+    def sale(**fields):
+        tx = {"_id": ObjectId(), "buyer": ObjectId(), "grid": grid_id, "units": 1, **fields}
+        return {"ns": {"coll": "transactions"}, "operationType": "insert", "fullDocument": tx}
+
+    await hub.handle_change(sale(seller=seller))
+    # Transactions written before they carried the seller look the grid up once
+    await hub.handle_change(sale())
+    await hub.handle_change(sale())
+
+    assert len(sub.pending) == 3
+    assert hub.owner_lookups == 1
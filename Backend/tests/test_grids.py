@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from routers import Grids
+
+
+@pytest.fixture
+async def owner(db):
+    user = {"_id": ObjectId()}
+    grid = {"_id": ObjectId(), "user": user["_id"], "grid name": "Grid", "units": 10, "units_for_sell": 0}
+    await db["user_grid"].insert_one(grid)
+    await db["dashboard_summary"].insert_one({"_id": user["_id"], "grid_id": grid["_id"], "units": 10, "units_for_sell": 0})
+    return user, grid["_id"]
+
+
+@pytest.mark.anyio
+async def test_concurrent_sales_never_sell_more_than_the_grid_has(db, owner):
+    user, grid_id = owner
+    results = await asyncio.gather(
+        *(Grids.sell_units(4, user) for _ in range(3)), return_exceptions=True)
+
+    assert sum(isinstance(result, HTTPException) and result.status_code == 400 for result in results) == 1
+    grid = await db["user_grid"].find_one({"_id": grid_id})
+    assert (grid["units"], grid["units_for_sell"]) == (2, 8)
+    summary = await db["dashboard_summary"].find_one({"_id": user["_id"]})
+    assert (summary["units"], summary["units_for_sell"]) == (2, 8)
+
+
+@pytest.mark.anyio
+async def test_sale_keeps_a_purchase_that_lands_in_between(db, owner, monkeypatch):
+    user, grid_id = owner
+    find_one = Grids.Grid_Collection.find_one
+
+    async def find_then_buy(*args, **kwargs):
+        grid = await find_one(*args, **kwargs)
+        # An escrow or purchase takes 3 units after the route read the grid
+        await db["user_grid"].update_one({"_id": grid_id}, {"$inc": {"units": -3}})
+        return grid
+
+    monkeypatch.setattr(Grids.Grid_Collection, "find_one", find_then_buy)
+    response = await Grids.sell_units(5, user)
+    assert (response["units"], response["units_for_sell"]) == (2, 5)
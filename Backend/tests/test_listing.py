@@ -0,0 +1,64 @@
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pymongo.errors import ServerSelectionTimeoutError
+from auth import get_current_principal
+from serialization import BSONJSONResponse
+from routers import Energypool, Grids, Users
+
+
+@pytest.fixture
+def client():
+    app = FastAPI(default_response_class=BSONJSONResponse)
+    app.include_router(Grids.router)
+    app.include_router(Users.router)
+    return TestClient(app)
+
+
+@pytest.mark.anyio
+async def test_grid_listing_pages_raw_documents(db, client):
+    owner = ObjectId()
+    await db["user_grid"].insert_many([{"grid name": f"Grid {i}", "user": owner, "units": i} for i in range(3)])
+
+    first = client.get("/grid/", params={"limit": 2, "fields": "grid name,user"})
+    assert first.status_code == 200
+    assert [grid["grid name"] for grid in first.json()] == ["Grid 0", "Grid 1"]
+    assert first.json()[0]["user"] == str(owner)
+    assert "units" not in first.json()[0]
+
+    rest = client.get("/grid/", params={"cursor": first.headers["X-Next-Cursor"]})
+    assert [grid["grid name"] for grid in rest.json()] == ["Grid 2"]
+    assert "X-Next-Cursor" not in rest.headers
+
+
+@pytest.mark.anyio
+async def test_user_listing_never_returns_passwords(db, client):
+    await db["users"].insert_one({"name": "Asha", "email": "asha@example.com", "password": "hash"})
+
+    response = client.get("/user/")
+    assert response.status_code == 200
+    assert response.json() == [{"_id": response.json()[0]["_id"], "name": "Asha", "email": "asha@example.com"}]
+
+
+@pytest.mark.anyio
+async def test_ndjson_listing_streams_every_document(db, client):
+    await db["user_grid"].insert_many([{"grid name": f"Grid {i}", "user": ObjectId()} for i in range(3)])
+
+    response = client.get("/grid/", params={"format": "ndjson"})
+    assert response.status_code == 200
+    assert len(response.text.splitlines()) == 3
+
+
+def test_sell_pool_errors_are_server_errors_not_auth_failures(monkeypatch):
+    app = FastAPI(default_response_class=BSONJSONResponse)
+    app.include_router(Energypool.router)
+    app.dependency_overrides[get_current_principal] = lambda: {"_id": ObjectId()}
+
+    async def down():
+        raise ServerSelectionTimeoutError("no primary")
+
+    monkeypatch.setattr(Energypool.sell_pool, "current_version", down)
+    response = TestClient(app, raise_server_exceptions=False).get("/energypool/")
+    assert response.status_code == 500
+    assert "WWW-Authenticate" not in response.headers
@@ -0,0 +1,41 @@
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from auth import get_current_principal
+from serialization import BSONJSONResponse
+from routers import Energypool
+
+
+@pytest.fixture
+def client(db):
+    app = FastAPI(default_response_class=BSONJSONResponse)
+    app.include_router(Energypool.router)
+    app.dependency_overrides[get_current_principal] = lambda: {"_id": ObjectId()}
+    return TestClient(app, raise_server_exceptions=False)
+
+
+@pytest.mark.parametrize("params", [
+    {"latitude": 91, "longitude": 76},
+    {"latitude": 10, "longitude": -181},
+    {"latitude": 10, "longitude": 76, "radius_km": 0},
+    {"latitude": 10, "longitude": 76, "radius_km": 50000},
+])
+def test_out_of_range_coordinates_are_rejected(client, params):
+    assert client.get("/energypool/nearby", params=params).status_code == 422
+
+
+@pytest.mark.parametrize("params", [
+    {"min_latitude": 9},
+    {"min_latitude": 11, "min_longitude": 75, "max_latitude": 9, "max_longitude": 77},
+])
+def test_incomplete_or_inverted_bounding_box_is_rejected(client, params):
+    response = client.get("/energypool/nearby", params={"latitude": 10, "longitude": 76, **params})
+    assert response.status_code == 400
+
+
+def test_database_errors_are_not_reported_as_auth_failures(client):
+    # mongomock has no $geoNear, which stands in for a failing query
+    response = client.get("/energypool/nearby", params={"latitude": 10, "longitude": 76})
+    assert response.status_code == 500
+    assert "WWW-Authenticate" not in response.headers
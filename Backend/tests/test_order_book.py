@@ -0,0 +1,137 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import PyMongoError
+from models import OrderRequest
+import order_book
+from order_book import Order, OrderBook, FillWriter, FillConflict, fill_writes
+from routers import Orders
+
+LOCATION = {"latitude": 9.9, "longitude": 76.2}
+
+
+class NetworkCollection:
+    """Yields to the event loop around each call, as motor does on the wire; mongomock never does."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        method = getattr(self.collection, name)
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            result = await method(*args, **kwargs)
+            await asyncio.sleep(0)
+            return result
+        return call
+
+    def find(self, *args, **kwargs):
+        return NetworkCursor(self.collection.find(*args, **kwargs))
+
+
+class NetworkCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def sort(self, *args):
+        self.cursor = self.cursor.sort(*args)
+        return self
+
+    async def __aiter__(self):
+        async for doc in self.cursor:
+            await asyncio.sleep(0)
+            yield doc
+
+
+@pytest.fixture
+def book(db, monkeypatch):
+    orders = NetworkCollection(db["orders"])
+    monkeypatch.setattr(order_book, "Order_Collection", orders)
+    monkeypatch.setattr(Orders, "Order_Collection", orders)
+    book = OrderBook()
+    monkeypatch.setattr(Orders, "order_book", book)
+    monkeypatch.setattr(Orders, "fill_writer", FillWriter(book))
+    return book
+
+
+def resting(book):
+    """Active heap entries per order id."""
+    counts = {}
+    for region in book.books.values():
+        for _, _, order in region.bids + region.asks:
+            if order.active:
+                counts[order.id] = counts.get(order.id, 0) + 1
+    return counts
+
+
+async def place(side, units, price, user):
+    return await Orders.place_order(OrderRequest(side=side, units=units, price=price, location=LOCATION), user)
+
+
+@pytest.mark.anyio
+async def test_order_placed_during_a_reload_rests_exactly_once(db, book, monkeypatch):
+    seller, buyer, other = ({"_id": ObjectId(), "name": name} for name in ("seller", "buyer", "other"))
+    await db["user_grid"].insert_one({"_id": ObjectId(), "user": seller["_id"], "grid name": "Grid",
+                                      "units": 10, "location": LOCATION})
+    await place("ask", 5, 10, seller)
+
+    placing = []
+
+    async def failing_write(fills):
+        # Another bid arrives while the failed batch sends the book back to Mongo
+        placing.append(asyncio.create_task(place("bid", 3, 9, other)))
+        await asyncio.sleep(0)
+        raise PyMongoError("write failed")
+
+    monkeypatch.setattr(Orders.fill_writer, "write", failing_write)
+    bid = asyncio.create_task(place("bid", 5, 10, buyer))
+    while not Orders.fill_writer.fills:
+        await asyncio.sleep(0)
+    await Orders.fill_writer.flush()
+
+    with pytest.raises(HTTPException) as failed:
+        await bid
+    assert failed.value.status_code == 503
+    placed = await placing[0]
+    assert placed["status"] == "open"
+
+    # The book holds every open order in Mongo once, with its units
+    open_orders = {doc["_id"]: doc["units"] async for doc in db["orders"].find({"status": "open"})}
+    assert resting(book) == {order_id: 1 for order_id in open_orders}
+    assert {order_id: order.units for order_id, order in book.orders.items()} == open_orders
+    assert placed["order_id"] in open_orders
+
+
+@pytest.mark.anyio
+async def test_second_worker_filling_the_same_ask_conflicts(db):
+    seller, grid = ObjectId(), ObjectId()
+    await db["user_grid"].insert_one({"_id": grid, "user": seller, "units_in_book": 5})
+    ask = Order(ObjectId(), "ask", seller, "9:76", 10, 5, datetime.now(timezone.utc), grid=grid)
+    await db["orders"].insert_one(ask.to_doc())
+    # Two workers, each with its own copy of the book
+    workers = [OrderBook(), OrderBook()]
+    for book in workers:
+        await book.load()
+
+    batches = []
+    for book in workers:
+        bid = Order(ObjectId(), "bid", ObjectId(), "9:76", 10, 5, datetime.now(timezone.utc))
+        await db["orders"].insert_one(bid.to_doc())
+        fills = book.add(bid)
+        for fill in fills:
+            fill["time"] = datetime.now(timezone.utc)
+        batches.append(fills)
+
+    writer = FillWriter(workers[0])
+    await writer.apply(fill_writes(batches[0]))
+    # Outside a transaction here; in FillWriter.write the raise aborts the whole batch
+    with pytest.raises(FillConflict):
+        await writer.apply(fill_writes(batches[1]))
+
+    assert await db["transactions"].count_documents({}) == 1
+    assert (await db["user_grid"].find_one({"_id": grid}))["units_in_book"] == 0
+    assert (await db["orders"].find_one({"_id": ask.id}))["status"] == "filled"
@@ -0,0 +1,67 @@
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+import summaries
+from summaries import Summary_Collection, purchase_updates
+
+
+def transaction(buyer, grid, units=3):
+    return {"_id": ObjectId(), "buyer": buyer, "grid": grid, "units": units,
+            "time": datetime.now(timezone.utc), "status": "completed"}
+
+
+@pytest.mark.anyio
+async def test_purchase_only_lowers_units_for_sell_of_the_mirrored_grid(db):
+    seller, buyer = ObjectId(), ObjectId()
+    mirrored, other = ObjectId(), ObjectId()
+    await db["dashboard_summary"].insert_many([
+        {"_id": seller, "grid_id": mirrored, "units_for_sell": 10, "lifetime_sold": 0, "total_transactions": 0},
+        {"_id": buyer, "grid_id": ObjectId(), "units_for_sell": 5, "lifetime_bought": 0, "total_transactions": 0},
+    ])
+
+    await Summary_Collection.bulk_write(purchase_updates(transaction(buyer, other), seller))
+    await Summary_Collection.bulk_write(purchase_updates(transaction(buyer, mirrored), seller))
+
+    summary = await db["dashboard_summary"].find_one({"_id": seller})
+    assert (summary["units_for_sell"], summary["lifetime_sold"]) == (7, 6)
+    summary = await db["dashboard_summary"].find_one({"_id": buyer})
+    assert (summary["units_for_sell"], summary["lifetime_bought"]) == (5, 6)
+
+
+@pytest.mark.anyio
+async def test_purchase_from_another_own_grid_keeps_the_mirrored_units_for_sell(db):
+    owner, mirrored = ObjectId(), ObjectId()
+    await db["dashboard_summary"].insert_one(
+        {"_id": owner, "grid_id": mirrored, "units_for_sell": 10, "lifetime_bought": 0, "lifetime_sold": 0})
+
+    await Summary_Collection.bulk_write(purchase_updates(transaction(owner, ObjectId()), owner))
+
+    summary = await db["dashboard_summary"].find_one({"_id": owner})
+    assert (summary["units_for_sell"], summary["lifetime_bought"], summary["lifetime_sold"]) == (10, 3, 0)
+
+
+@pytest.mark.anyio
+async def test_build_redoes_a_summary_that_a_purchase_changed_meanwhile(db, monkeypatch):
+    buyer, grid = ObjectId(), ObjectId()
+    await db["user_grid"].insert_one({"_id": grid, "user": ObjectId(), "grid name": "Grid", "units": 10})
+    history_totals = summaries.history_totals
+    builds = []
+
+    async def totals_then_purchase(user_id, grid_ids):
+        totals = await history_totals(user_id, grid_ids)
+        if not builds:
+            # The purchase commits after the totals were read
+            tx = transaction(buyer, grid)
+            await db["transactions"].insert_one(tx)
+            await Summary_Collection.bulk_write(purchase_updates(tx, None))
+        builds.append(totals)
+        return totals
+
+    monkeypatch.setattr(summaries, "history_totals", totals_then_purchase)
+    await summaries.build_summary(buyer)
+
+    assert [totals["bought"] for totals in builds] == [0, 3]
+    summary = await db["dashboard_summary"].find_one({"_id": buyer})
+    assert (summary["lifetime_bought"], summary["total_transactions"]) == (3, 1)
+    assert "built_at" in summary